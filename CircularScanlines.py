@@ -0,0 +1,314 @@
+__author__ = 'ryshackleton'
+
+import math
+import numpy as np
+from VectorGeometry import circle_chord_parameters, clipped_chord_lengths, chord_crossings, closest_points, \
+    distances, polygons_clipped_pieces
+from SpatialIndex import PointIndex
+from Profiling import PROFILER
+
+# bytes of temporary arrays allowed per chunk of grid points x candidate segments
+DEFAULT_CHUNK_BYTES = 64 * 1024 * 1024
+# number of float64 temporaries created per (grid point, segment) pair while clipping
+_BYTES_PER_PAIR = 8 * 8
+# number of sides of the polygon approximating each circle of the 'polygon' p21 method
+POLYGON_SIDES = 20
+
+
+def _grid_chunks(grid_xy, tileSize, maxPoints):
+    '''
+    Splits the grid points into spatially compact chunks
+    :param grid_xy: (G,2) array of grid points
+    :param tileSize: width of the square tiles the points are grouped by
+    :param maxPoints: maximum number of points in a chunk
+    :return: generator of arrays of grid point indices
+    '''
+    if len(grid_xy) == 0:
+        return
+    tx = np.floor((grid_xy[:, 0] - grid_xy[:, 0].min()) / tileSize).astype(np.int64)
+    ty = np.floor((grid_xy[:, 1] - grid_xy[:, 1].min()) / tileSize).astype(np.int64)
+    order = np.lexsort((tx, ty))
+    key = ty[order] * (tx.max() + 1) + tx[order]
+    bounds = np.concatenate((np.nonzero(np.diff(key))[0] + 1, [len(order)]))
+    start = 0
+    for end in bounds:
+        for s in range(start, end, maxPoints):
+            yield order[s:min(s + maxPoints, end)]
+        start = end
+
+
+def parse_radii(radii):
+    '''
+    Reads one or more circle radii
+    :param radii: a number, a comma separated string of numbers like '0.5,1,2,5', or a sequence of numbers
+    :return: list of float radii, in the order given
+    '''
+    if isinstance(radii, str):
+        radii = radii.split(',')
+    elif not hasattr(radii, '__len__'):
+        radii = [radii]
+    return [float(r) for r in radii]
+
+
+def length_inside_circles(grid_xy, radius, traceSet, maxChunkBytes=DEFAULT_CHUNK_BYTES):
+    '''
+    Sums up the fracture trace length inside a circle of the specified radius around every grid point
+    :param grid_xy: (G,2) array of circle centers
+    :param radius: Radius of the circles
+    :param traceSet: TraceSet of the fracture traces
+    :param maxChunkBytes: limit on the memory used by temporary arrays
+    :return: (G) array of the trace length inside each circle
+    '''
+    return segment_length_inside_circles(grid_xy, [radius], traceSet.segments()[0], traceSet.segment_index(),
+                                         maxChunkBytes)[:, 0]
+
+
+def segment_length_inside_circles(grid_xy, radii, segs, index, maxChunkBytes=DEFAULT_CHUNK_BYTES):
+    '''
+    Sums up the length of straight segments inside circles of several radii around every grid point
+    Candidate segments are found once with the largest radius and the radius independent part of the clipping is
+    shared by all radii. The lengths of each circle are added in segment order, skipping segments outside the circle,
+    so any subset of segs that keeps their order and includes every segment reaching the circles, and any set of
+    other radii, gives bit-identical sums
+    :param grid_xy: (G,2) array of circle centers
+    :param radii: sequence of R circle radii
+    :param segs: (S,4) array of segments x0,y0,x1,y1
+    :param index: SegmentIndex of segs
+    :param maxChunkBytes: limit on the memory used by temporary arrays
+    :return: (G,R) array of the segment length inside each circle
+    '''
+    return _clip_circles(grid_xy, radii, segs, index, maxChunkBytes)[0]
+
+
+def _clip_circles(grid_xy, radii, segs, index, maxChunkBytes, closedEnd=None):
+    '''
+    Shared loop of segment_length_inside_circles() and circular_scanline_counts()
+    :param closedEnd: optional (S) boolean array marking the last segment of every trace,
+                      when given the crossings of the circles by the segments are counted too
+    :return: tuple ((G,R) lengths, (G,R) crossings or None)
+    '''
+    grid_xy = np.asarray(grid_xy, dtype=np.float64).reshape(-1, 2)
+    radii = parse_radii(radii)
+    lengths = np.zeros((len(grid_xy), len(radii)))
+    crossings = None if closedEnd is None else np.zeros((len(grid_xy), len(radii)), dtype=np.int64)
+    if len(radii) == 0:
+        return lengths, crossings
+    radius = max(radii)
+    maxPairs = max(maxChunkBytes // _BYTES_PER_PAIR, 1)
+
+    for chunk in _grid_chunks(grid_xy, max(2.0 * radius, index._cellSize), max(int(math.sqrt(maxPairs)), 1)):
+        cx = grid_xy[chunk, 0]
+        cy = grid_xy[chunk, 1]
+        candidates = index.query_bbox(cx.min() - radius, cy.min() - radius, cx.max() + radius, cy.max() + radius)
+        PROFILER.count('circleQueries', len(chunk))
+        PROFILER.count('circleSegmentTests', len(chunk) * len(candidates))
+
+        # clip blocks of (segments x points), keep the non-zero lengths of every radius in segment order
+        points = [[] for r in radii]
+        values = [[] for r in radii]
+        blockSize = max(maxPairs // len(chunk), 1)
+        for b in range(0, len(candidates), blockSize):
+            block = segs[candidates[b:b + blockSize]]
+            t0, h2, segLen = circle_chord_parameters(block, cx[:, None], cy[:, None])
+            for ri, r in enumerate(radii):
+                clipped = clipped_chord_lengths(t0, h2, segLen, r).T
+                k, p = np.nonzero(clipped)
+                points[ri].append(p)
+                values[ri].append(clipped[k, p])
+                if crossings is not None:
+                    blockEnds = closedEnd[candidates[b:b + blockSize]]
+                    counts = chord_crossings(t0, h2, segLen, r, blockEnds).sum(axis=1)
+                    crossings[chunk, ri] += counts
+        for ri in range(len(radii)):
+            if len(points[ri]) > 0:
+                # bincount adds the lengths of each point sequentially in segment order, so the sums do not
+                # depend on how the points and segments were chunked
+                lengths[chunk, ri] = np.bincount(np.concatenate(points[ri]), weights=np.concatenate(values[ri]),
+                                                 minlength=len(chunk))
+    return lengths, crossings
+
+
+def compute_p21_radii(grid_xy, radii, traceSet, maxChunkBytes=DEFAULT_CHUNK_BYTES):
+    '''
+    Computes fracture length/area (p21) within circular scanlines of several radii around every grid point
+    in one pass over the candidate segments
+    :param grid_xy: (G,2) array of circle centers
+    :param radii: sequence of R radii of the circular scanlines
+    :param traceSet: TraceSet of the fracture traces
+    :param maxChunkBytes: limit on the memory used by temporary arrays
+    :return: (G,R) array of p21 values, column k is identical to compute_p21(grid_xy, radii[k], traceSet)
+    '''
+    radii = parse_radii(radii)
+    circleAreas = np.array([math.pi * r * r for r in radii])
+    if not np.all(circleAreas > 0.0):
+        raise ZeroDivisionError('Circle radius must be non-zero')
+    return segment_length_inside_circles(grid_xy, radii, traceSet.segments()[0], traceSet.segment_index(),
+                                         maxChunkBytes) / circleAreas
+
+
+def compute_p21(grid_xy, radius, traceSet, maxChunkBytes=DEFAULT_CHUNK_BYTES):
+    '''
+    Computes fracture length/area (p21) within a circular scanline around every grid point
+    :param grid_xy: (G,2) array of circle centers
+    :param radius: Radius of the circular scanlines
+    :param traceSet: TraceSet of the fracture traces
+    :param maxChunkBytes: limit on the memory used by temporary arrays
+    :return: (G) array of p21 values
+    '''
+    circleArea = math.pi * radius * radius
+    if not circleArea > 0.0:
+        raise ZeroDivisionError('Circle radius must be non-zero')
+    return length_inside_circles(grid_xy, radius, traceSet, maxChunkBytes) / circleArea
+
+
+def circle_polygons(cx, cy, radius, numSides=POLYGON_SIDES):
+    '''
+    Builds the polygons approximating circles around many centers, with the vertices of
+    FracTrace.build_circular_trace(cx, cy, radius, numSides)
+    :param cx: (C) array of the X coordinates of the centers
+    :param cy: (C) array of the Y coordinates of the centers
+    :param radius: Radius of the circles
+    :param numSides: number of sides of each polygon
+    :return: (C,numSides,4) array of the segments of each polygon
+    '''
+    # the angles are accumulated and their cosines taken one by one exactly as build_circular_trace() does
+    angles = []
+    angle = 0.0
+    for i in range(numSides + 1):
+        angles.append(angle)
+        angle += 2.0 * math.pi / (numSides - 1)
+    x = np.asarray(cx, dtype=np.float64)[:, None] + radius * np.array([math.cos(a) for a in angles])[None, :]
+    y = np.asarray(cy, dtype=np.float64)[:, None] + radius * np.array([math.sin(a) for a in angles])[None, :]
+    return np.stack((x[:, :-1], y[:, :-1], x[:, 1:], y[:, 1:]), axis=2)
+
+
+def polygon_length_inside_circles(grid_xy, radii, segs, segTrace, index, maxChunkBytes=DEFAULT_CHUNK_BYTES,
+                                  numSides=POLYGON_SIDES):
+    '''
+    Sums up the length of trace segments inside polygons approximating circles of several radii around every grid
+    point, clipped as FracTrace.trace_length_inside_circular_scanline() clips them (see
+    VectorGeometry.polygon_clipped_pieces()). Candidate segments are found once per chunk of grid points with the
+    largest radius, and the pieces are added up trace by trace, then over the traces in trace order, so the sums are
+    bit-identical to clipping each trace against each polygon in turn
+    :param grid_xy: (G,2) array of circle centers
+    :param radii: sequence of R circle radii
+    :param segs: (S,4) array of segments x0,y0,x1,y1, the segments of each trace consecutive and in trace order
+    :param segTrace: (S) array of the trace of each segment
+    :param index: SegmentIndex of segs
+    :param maxChunkBytes: limit on the memory used by temporary arrays
+    :param numSides: number of sides of the polygons
+    :return: (G,R) array of the segment length inside each polygon
+    '''
+    grid_xy = np.asarray(grid_xy, dtype=np.float64).reshape(-1, 2)
+    radii = parse_radii(radii)
+    lengths = np.zeros((len(grid_xy), len(radii)))
+    if len(radii) == 0 or len(segs) == 0:
+        return lengths
+    radius = max(radii)
+    maxPairs = max(maxChunkBytes // (2 * _BYTES_PER_PAIR), 1)
+    numTraces = int(segTrace.max()) + 1
+
+    for chunk in _grid_chunks(grid_xy, max(2.0 * radius, index._cellSize), max(int(math.sqrt(maxPairs)), 1)):
+        cx = grid_xy[chunk, 0]
+        cy = grid_xy[chunk, 1]
+        candidates = index.query_bbox(cx.min() - radius, cy.min() - radius, cx.max() + radius, cy.max() + radius)
+        PROFILER.count('circleQueries', len(chunk))
+        PROFILER.count('circleSegmentTests', len(chunk) * len(candidates))
+
+        # pairs of a grid point and a segment whose closest point lies within the largest radius
+        pairPoint = [np.zeros(0, dtype=np.int64)]
+        pairSeg = [np.zeros(0, dtype=np.int64)]
+        blockSize = max(maxPairs // len(chunk), 1)
+        for b in range(0, len(candidates), blockSize):
+            block = candidates[b:b + blockSize]
+            point = np.repeat(np.arange(len(chunk)), len(block))
+            seg = np.tile(block, len(chunk))
+            px = cx[point]
+            py = cy[point]
+            near = distances(np.column_stack(closest_points(segs[seg], px, py)), np.column_stack((px, py))) <= radius
+            pairPoint.append(point[near])
+            pairSeg.append(seg[near])
+        point = np.concatenate(pairPoint)
+        seg = np.concatenate(pairSeg)
+        order = np.lexsort((seg, point))
+        point = point[order]
+        seg = seg[order]
+
+        for ri, r in enumerate(radii):
+            pieceRow, pieceLength = polygons_clipped_pieces(segs[seg], point, circle_polygons(cx, cy, r, numSides),
+                                                            cx, cy, r)
+            # add up the pieces of each trace in segment order, then the traces of each grid point in trace order
+            traceKey, inverse = np.unique(point[pieceRow] * numTraces + segTrace[seg[pieceRow]], return_inverse=True)
+            traceLengths = np.bincount(inverse.ravel(), weights=pieceLength, minlength=len(traceKey))
+            lengths[chunk, ri] = np.bincount(traceKey // numTraces, weights=traceLengths, minlength=len(chunk))
+    return lengths
+
+
+def compute_polygon_p21_radii(grid_xy, radii, traceSet, maxChunkBytes=DEFAULT_CHUNK_BYTES):
+    '''
+    Computes fracture length/area (p21) within polygons approximating circular scanlines of several radii around
+    every grid point, the 'polygon' method of p21_within_circular_scanlines
+    :param grid_xy: (G,2) array of circle centers
+    :param radii: sequence of R radii of the circular scanlines
+    :param traceSet: TraceSet of the fracture traces
+    :param maxChunkBytes: limit on the memory used by temporary arrays
+    :return: (G,R) array of the trace length inside each polygon divided by the area of its circle
+    '''
+    radii = parse_radii(radii)
+    circleAreas = np.array([math.pi * r * r for r in radii])
+    if not np.all(circleAreas > 0.0):
+        raise ZeroDivisionError('Circle radius must be non-zero')
+    segs, segTrace = traceSet.segments()
+    return polygon_length_inside_circles(grid_xy, radii, segs, segTrace, traceSet.segment_index(),
+                                         maxChunkBytes) / circleAreas
+
+
+def circular_scanline_counts(grid_xy, radii, traceSet, maxChunkBytes=DEFAULT_CHUNK_BYTES):
+    '''
+    Counts, for circular scanlines of several radii around every grid point, the crossings of the circle by the traces
+    and the trace endpoints inside the circle, and measures the trace length inside it, in one pass over the candidate
+    segments. Per trace these are the values of FracTrace.circular_scanline_counts()
+    :param grid_xy: (G,2) array of circle centers
+    :param radii: sequence of R radii of the circular scanlines
+    :param traceSet: TraceSet of the fracture traces
+    :param maxChunkBytes: limit on the memory used by temporary arrays
+    :return: tuple (n, m, length) of (G,R) arrays: crossings, endpoints inside and trace length inside each circle
+    '''
+    radii = parse_radii(radii)
+    segs, segTrace = traceSet.segments()
+    closedEnd = np.ones(len(segs), dtype=bool)
+    closedEnd[:-1] = segTrace[1:] != segTrace[:-1]
+    lengths, n = _clip_circles(grid_xy, radii, segs, traceSet.segment_index(), maxChunkBytes, closedEnd)
+
+    first, last = traceSet.endpoints()
+    valid = np.diff(traceSet._offsets) > 0
+    endpoints = np.vstack((first[valid], last[valid]))
+    if len(endpoints) > 0 and len(radii) > 0:
+        m = PointIndex(endpoints, max(radii)).count_within_radii(grid_xy, radii)
+    else:
+        m = np.zeros(lengths.shape, dtype=np.int64)
+    return n, m, lengths
+
+
+def mauldon_estimators(grid_xy, radii, traceSet, maxChunkBytes=DEFAULT_CHUNK_BYTES):
+    '''
+    Computes Mauldon's circular scanline estimators around every grid point, from n crossings of the circle,
+    m trace endpoints inside it and the measured trace length L inside it
+    :param grid_xy: (G,2) array of circle centers
+    :param radii: sequence of R radii of the circular scanlines
+    :param traceSet: TraceSet of the fracture traces
+    :param maxChunkBytes: limit on the memory used by temporary arrays
+    :return: dict of (G,R) arrays:  'n', 'm', 'length' as in circular_scanline_counts(),
+             'intensity' n/4r (estimated p21), 'density' m/2 pi r^2 (estimated p20), 'p21' L/pi r^2 (measured p21),
+             'meanLength' pi r n/2m (estimated mean trace length, nan where m is 0)
+    '''
+    radii = parse_radii(radii)
+    r = np.array(radii)
+    if not np.all(math.pi * r * r > 0.0):
+        raise ZeroDivisionError('Circle radius must be non-zero')
+    n, m, lengths = circular_scanline_counts(grid_xy, radii, traceSet, maxChunkBytes)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        meanLength = np.where(m > 0, math.pi * r * n / (2.0 * m), np.nan)
+    return {'n': n, 'm': m, 'length': lengths,
+            'intensity': n / (4.0 * r), 'density': m / (2.0 * math.pi * r * r),
+            'p21': lengths / (math.pi * r * r), 'meanLength': meanLength}
@@ -3,12 +3,17 @@ __author__ = 'ryshackleton'
 import sys
 from Point import Point2
 import math
+import numpy as np
 from StraightLine2 import StraightLine2
+from VectorGeometry import segment_lengths_inside_circle, segment_crossings_of_circle, segment_array, \
+    polygon_clipped_pieces, all_segment_intersections, segment_intersections
+from SpatialIndex import SegmentBVH, BVH_LEAF_SIZE
+from PlaneProjection import is_map_view, project_to_plane
 
 class FracTrace():
     """Models a fracture trace in 2D or 3D."""
 
-    def __init__(self, traceId=-1, traceName="", coordinatePlane=(0.0,0.0,0.0), vlist3=[ () ]):
+    def __init__(self, traceId=-1, traceName="", coordinatePlane=(0.0,0.0,0.0), vlist3=None):
         """
         Initializes a FracTrace
 
@@ -24,7 +29,7 @@ class FracTrace():
             self._traceId = int(traceId)
             self._traceName = traceName
             self._coordinatePlane = coordinatePlane
-            self._vlist3 = vlist3
+            self._vlist3 = [] if vlist3 is None else vlist3
             self._vlist2 = []
             self._ptype = []
             self._colorindex = []
@@ -33,6 +38,7 @@ class FracTrace():
             self._gvalue = []
             self._bvalue = []
             self._segmentList = []
+            self._segmentCache = None
         except (ValueError,TypeError) as e:
             print("Conversion error: {}" \
                   .format(str(e)),file=sys.stderr)
@@ -176,57 +182,142 @@ class FracTrace():
         return segs
 
 
+    def _segment_cache(self):
+        '''
+        Returns the cached segment array of this trace, rebuilt whenever the vertex list has been replaced, grown,
+        shrunk or had the coordinates of its end points changed since it was cached (use invalidate_segments() after
+        moving vertices in the middle of the list)
+        :return: dict of the 'segs' array and, once built, the 'bbox' and 'bvh' of the segments
+        '''
+        vlist2 = self._vlist2
+        ends = (vlist2[0]._x, vlist2[0]._y, vlist2[-1]._x, vlist2[-1]._y) if len(vlist2) > 0 else None
+        cache = self._segmentCache
+        if cache is None or cache['vlist2'] is not vlist2 or cache['count'] != len(vlist2) or cache['ends'] != ends:
+            xy = np.array([(v._x, v._y) for v in vlist2], dtype=np.float64).reshape(-1, 2)
+            cache = {'vlist2': vlist2, 'count': len(vlist2), 'ends': ends, 'segs': np.hstack((xy[:-1], xy[1:]))}
+            self._segmentCache = cache
+        return cache
+
+    def invalidate_segments(self):
+        '''
+        Drops the cached segment array, bounding box and hierarchy, they are rebuilt on next use
+        :return:
+        '''
+        self._segmentCache = None
+
+    def segment_array(self):
+        '''
+        returns the straight line segments of this line as a (cached) array, see VectorGeometry
+        The cache only notices changes to the vertex list and its end points, call invalidate_segments() after
+        moving any other vertex in place
+        :return: (N,4) array of x0,y0,x1,y1 rows, one per segment of to_segments()
+        '''
+        return self._segment_cache()['segs']
+
+    def bbox(self):
+        '''
+        returns the bounding box of this trace's segments, cached like segment_array()
+        :return: tuple (xmin, ymin, xmax, ymax), None if the trace has no segments
+        '''
+        cache = self._segment_cache()
+        if 'bbox' not in cache:
+            segs = cache['segs']
+            cache['bbox'] = None if len(segs) == 0 else \
+                (float(min(segs[:, 0].min(), segs[:, 2].min())), float(min(segs[:, 1].min(), segs[:, 3].min())),
+                 float(max(segs[:, 0].max(), segs[:, 2].max())), float(max(segs[:, 1].max(), segs[:, 3].max())))
+        return cache['bbox']
+
+    def segment_bvh(self):
+        '''
+        returns the (cached) bounding volume hierarchy over this trace's segments
+        :return: SegmentBVH
+        '''
+        cache = self._segment_cache()
+        if 'bvh' not in cache:
+            cache['bvh'] = SegmentBVH(cache['segs'])
+        return cache['bvh']
+
+    def segments_near_circle(self, circleCenter, radius, tol=0.0):
+        '''
+        Finds the segments whose bounding boxes reach the bounding box of a circle grown by tol,
+        only these segments can lie within or intersect the circle
+        :param circleCenter: Point2 at the center of the circle
+        :param radius: Radius of the circle
+        :param tol: distance tolerance added to the radius
+        :return: sorted array of segment indices
+        '''
+        reach = radius + tol
+        xmin, ymin = circleCenter._x - reach, circleCenter._y - reach
+        xmax, ymax = circleCenter._x + reach, circleCenter._y + reach
+        box = self.bbox()
+        if box is None or box[0] > xmax or box[2] < xmin or box[1] > ymax or box[3] < ymin:
+            return np.zeros(0, dtype=np.int64)
+        if len(self.segment_array()) <= BVH_LEAF_SIZE:
+            return np.arange(len(self.segment_array()))
+        return self.segment_bvh().query_bbox(xmin, ymin, xmax, ymax)
+
+
     def trace_length_inside_circular_scanline(self,circularSegs,circleCenter,radius,tol=1e-03):
+        '''
+        Returns the length of this trace that lies inside a circular scanline
+        :param circularSegs: list of StraightLine2 segments, or (K,4) array of segments, of a polygonal circle
+                             (see build_circular_trace) or None to clip the trace exactly against the circle
+        :param circleCenter: Point2 at the center of the circle
+        :param radius: Radius of the circle
+        :param tol: Tolerance used for determining distance tolerances
+        :return: length of this trace inside the circle
+        '''
         if not isinstance(circleCenter,Point2):
             raise TypeError("FracTrace.trace_length_inside_circular_frac_trace() can only operate on a Point2")
 
-        # get segment list, don't modify self
-        mySegs = []
-        if len(self._segmentList) == 0:
-            mySegs = self.to_segments()
-        else:
-            mySegs = self._segmentList
-
-        # check for segments inside the circle
-        segList = [] # list of disconnected segments inside the circle to measure the length of
-        for m in mySegs:
-            # intersection test:
-            # the segment must lie within or intersect the circle if the closest point of this segment
-            # to the circle's center lies within the circle's radius
-            closePt = m.closestPoint(circleCenter)
-            if m._v0.distance_to(closePt) <= radius:
-                isV0in = m._v0.distance_to(circleCenter) <= radius
-                isV1in = m._v1.distance_to(circleCenter) <= radius
-                if isV0in and isV1in: # both inside, just add the segment
-                    segList.append(m)
-                else: # otherwise, find some intersections
-                    spanPt = None
-                    for o in circularSegs: # find the intersection point with the circle
-                        traceIntersects = m.intersectionPoints(o,tol)
-                        if len(traceIntersects) == 1:
-                            iPt = traceIntersects[0]
-                            if isV0in: # v0 in, v1 out - add segment from intersection & v0
-                                segList.append(StraightLine2(iPt._x,iPt._y, m._v0._x,m._v0._y))
-                            elif isV1in:# v1 in, v0 out - add segment from intersection & v1
-                                segList.append(StraightLine2(iPt._x,iPt._y, m._v1._x,m._v1._y))
-                            elif spanPt == None: # handle the odd case of a line with endpoints outside,
-                                                 # but an intersection inside
-                                                 # (assume that we'll hit the other intersection later in the loop)
-                                spanPt = iPt
-                            else:
-                                segList.append(StraightLine2(iPt._x,iPt._y, spanPt._x,spanPt._y))
-                                spanPt = None
-                        elif len(traceIntersects) > 1:
-                            raise ValueError("WTF IS HAPPENING????")
-
-        # sum up lengths
+        # far away traces and segments are rejected by their bounding boxes
+        segs = self.segment_array()
+        if circularSegs is None:
+            near = self.segments_near_circle(circleCenter, radius)
+            if len(near) == 0:
+                return 0.0
+            lengths = np.zeros(len(segs))
+            lengths[near] = segment_lengths_inside_circle(segs[near], circleCenter._x, circleCenter._y, radius)
+            return float(lengths.sum())
+        if not isinstance(circularSegs, np.ndarray):
+            circularSegs = segment_array(circularSegs)
+
+        # sum up the lengths of the pieces inside the circle
+        near = self.segments_near_circle(circleCenter, radius, tol)
+        if len(near) == 0:
+            return 0.0
         sumLen = 0.0
-        for s in segList:
-            sumLen += s._v0.distance_to(s._v1)
+        for length in polygon_clipped_pieces(segs[near], circularSegs, circleCenter._x, circleCenter._y, radius,
+                                             tol)[1].tolist():
+            sumLen += length
 
         return sumLen
 
 
+    def circular_scanline_counts(self,circleCenter,radius):
+        '''
+        Returns the counts used by Mauldon's circular scanline estimators for this trace
+        :param circleCenter: Point2 at the center of the circle
+        :param radius: Radius of the circle
+        :return: tuple (n, m, length): number of times the trace crosses the circle, number of its endpoints
+                 closer than the radius to the center, and the length of the trace inside the circle
+        '''
+        if not isinstance(circleCenter,Point2):
+            raise TypeError("FracTrace.circular_scanline_counts() can only operate on a Point2")
+        if len(self._vlist2) == 0:
+            return 0, 0, 0.0
+
+        segs = self.segment_array()
+        near = self.segments_near_circle(circleCenter, radius)
+        n = 0
+        if len(near) > 0:
+            closedEnd = near == len(segs) - 1
+            n = int(segment_crossings_of_circle(segs[near], circleCenter._x, circleCenter._y, radius,
+                                                closedEnd).sum())
+        m = int(circleCenter.distance_to(self._vlist2[0]) < radius) + \
+            int(circleCenter.distance_to(self._vlist2[-1]) < radius)
+        return n, m, self.trace_length_inside_circular_scanline(None, circleCenter, radius)
+
     def intersection_points_with_trace(self, ot, tol=1e-03):
         '''
         Returns a list of Point2's representing the intersection points of this FracTrace with another FracTrace
@@ -236,15 +327,22 @@ class FracTrace():
         '''
         if not isinstance(ot,FracTrace):
             raise TypeError("FracTrace.intersectionPoints() can only operate on another FracTrace")
-        mySegs = self.to_segments()
-        otSegs = ot.to_segments()
-
-        traceIntersects = []
-        for m in mySegs:
-            for o in otSegs:
-                traceIntersects.extend(m.intersectionPoints(o,tol))
-
-        return traceIntersects
+        # traces whose bounding boxes are further apart than the tolerance cannot intersect
+        mySegs = self.segment_array()
+        otSegs = ot.segment_array()
+        myBox = self.bbox()
+        otBox = ot.bbox()
+        if myBox is None or otBox is None or myBox[0] > otBox[2] + tol or otBox[0] > myBox[2] + tol or \
+                myBox[1] > otBox[3] + tol or otBox[1] > myBox[3] + tol:
+            return []
+
+        # segment pairs, in the order of looping over the segments of this trace and then the other
+        if len(mySegs) * len(otSegs) <= BVH_LEAF_SIZE * BVH_LEAF_SIZE:
+            xy = all_segment_intersections(mySegs, otSegs, tol)[2]
+        else:
+            i, j = self.segment_bvh().candidate_pairs(ot.segment_bvh(), tol)
+            xy = segment_intersections(mySegs[i], otSegs[j], tol)[1]
+        return [Point2(x, y) for x, y in xy.tolist()]
 
 
     def append_if_same_endpoints(self, ot, tol):
@@ -312,14 +410,20 @@ class FracTrace():
         """Does the 3D to 2D conversion by projecting the vlist3 to the coordinate plane
         and building the _vlist2 vector
         """
+        if isinstance(self._coordinatePlane, str):
+            # a fitted plane depends on the vertices of every trace, not just this one
+            raise ValueError("FracTrace {} has no coordinate plane normal, resolve '{}' for all of the traces first "
+                             "(see PlaneProjection.resolve_plane)".format(self._traceId, self._coordinatePlane))
         try:
             # simple case of map view where, coordinatePlane == 1 or -1 and z coordinates all == 0.0
-            if (0.0,0.0,1.0) == self._coordinatePlane or (0.0,0.0,-1.0) == self._coordinatePlane:
+            if is_map_view(self._coordinatePlane):
                 for vertex in self._vlist3:
                     self._vlist2.append(Point2( vertex[0] , vertex[1] ) )
-            else:
-                pass
-                #TODO: implement generalized projection onto 3d planes
+            elif len(self._vlist3) > 0:
+                # every vertex at once, see PlaneProjection
+                xy = project_to_plane(np.array(self._vlist3, dtype=np.float64), self._coordinatePlane)
+                for x, y in xy.tolist():
+                    self._vlist2.append(Point2(x, y))
 
         except TypeError as e:
             print("Conversion error in _build_vlists (non-numeric type in the vertex list??) {}" \
@@ -1,32 +1,62 @@
 __author__ = 'ryshackleton'
 
 import sys
+import argparse
 from pprint import pprint
 import MVE_importer
-import Point2_MVE
-import FracTrace
+import MVE_cache
+from TraceIntersections import find_trace_intersections
+from SpatialIndex import PointIndex
+from ParallelTiles import TilePool, count_tile
+from CircularScanlines import parse_radii
+from Profiling import PROFILER
+from IncrementalGrid import IncrementalGrid
+from ResultWriters import GridResultWriter, FORMATS
+from PlaneProjection import MAP_VIEW, parse_plane, map_view_warning
 
-def main(fractureTraceFileName,gridFileName,fractureIntersectionsPerAreaRadius,outputFileName):
+def main(fractureTraceFileName,gridFileName,fractureIntersectionsPerAreaRadius,outputFileName,workers=1,profile=None,
+         incremental=False,format=None,traces=None,intersectsXY=None,grid=None,coordinatePlane=MAP_VIEW):
     '''
     Computes fractures/area on a specified grid from a 2D map view of fracture traces
     :param fractureTraceFileName: filename of a Midland Valley-Move software export
                                     representing lines representing fracture traces
     :param gridFileName: file containing a Midland Valley-Move software export of points representing the grid
                             over which to compute the intersections per area
-    :param fractureIntersectionsPerAreaRadius: radius of a circle to search within
+    :param fractureIntersectionsPerAreaRadius: radius of a circle to search within, or several radii as a list or a
+                                                comma separated string like '0.5,1,2,5', all counted in one pass
     :param outputFileName: name of the output file to write the grid points with number of intersections within the
-                            specified radius
+                            specified radius, one column per radius
+    :param workers: number of worker processes counting tiles of the grid in parallel,
+                    the results are identical to a single process run
+    :param profile: name of a file to write a JSON report of the time spent in each phase and the geometry primitive
+                    counts to ('-' prints it), None does not profile (see Profiling)
+    :param incremental: reuse the counts stored by the previous incremental run writing the same output file and
+                        only recount the grid points within the largest radius of traces added, removed or changed
+                        since then (see IncrementalGrid), the intersections themselves are always found again
+    :param format: output format, one of ResultWriters.FORMATS, None chooses from the extension of outputFileName
+    :param traces: TraceSet of the traces if they are already parsed, e.g. shared by the stages of fracanalysis
+    :param intersectsXY: (U,2) array of the unique intersection points of the traces if they are already found
+    :param grid: PointSet (or MVE_importer.PointSetFile) of the grid if it is already parsed
+    :param coordinatePlane: normal of the plane to analyse the traces in, or PlaneProjection.FIT_PLANE,
+                            the grid is projected onto the same plane as the traces
     :return: nothing
     '''
     tolerance = 1e-03
     try:
-        radius = float(fractureIntersectionsPerAreaRadius)
-    except TypeError as e:
+        radii = parse_radii(fractureIntersectionsPerAreaRadius)
+    except (TypeError, ValueError) as e:
         print("Invalid fractureIntersectionsPerAreaRadius: The radius must be a floating point number")
         return
 
-    traces = MVE_importer.build_FracTraces(fractureTraceFileName)
-    gridPoints = MVE_importer.build_point_list(gridFileName)
+    if profile is not None:
+        PROFILER.enable()
+    try:
+        with PROFILER.phase('parse'):
+            if traces is None:
+                traces = MVE_cache.load_TraceSet(fractureTraceFileName, None, coordinatePlane)
+                warning = map_view_warning(traces._coordinatePlane, traces._xyz)
+                if warning is not None:
+                    print(warning, file=sys.stderr)
 
 #    doubleCheck = True
 #    i = 0
@@ -42,35 +72,80 @@ def main(fractureTraceFileName,gridFileName,fractureIntersectionsPerAreaRadius,o
 #                j += 1
 #            i += 1
 
-    # find all intersection points
-    allIntersects = []
-    i = 0
-    while i < len(traces):
-        j = i+1
-        while j < len(traces):
-            pts = traces[i].intersection_points_with_trace(traces[j])
-            for p in pts:
-                if p not in allIntersects:
-                    allIntersects.append(p)
-            j += 1
-        i += 1
+        # find all intersection points
+        with PROFILER.phase('intersections'):
+            if intersectsXY is None:
+                intersectsXY = find_trace_intersections(traces,tolerance).unique_points(tolerance)[0]
 
-    # count intersections within the specified radius for each grid point
-    for pt in gridPoints:
-        for ipt in allIntersects:
-            if pt.distance_to(ipt) < radius:
-                pt._otherint += 1
+        # count intersections within the specified radius for each grid point,
+        # the grid is memory-mapped from the parse cache and written in chunks
+        with PROFILER.phase('index'):
+            intersectIndex = PointIndex(intersectsXY, max(radii))
+        pool = None
+        previous = None
+        try:
+            if workers > 1:
+                pool = TilePool({'points': intersectsXY}, workers)
+            if incremental:
+                with PROFILER.phase('incremental'):
+                    settings = {'radii': radii, 'tolerance': tolerance,
+                                'coordinatePlane': list(traces._coordinatePlane)}
+                    previous = IncrementalGrid(outputFileName, 'intersections', settings, traces, gridFileName,
+                                               max(radii) + tolerance)
+            resultNames = ['IntersectionsWithin{}'.format(radius) for radius in radii]
+            with GridResultWriter(outputFileName, resultNames, format) as writer:
+                with PROFILER.phase('parse'):
+                    if grid is None:
+                        grid = MVE_cache.load_PointSet(gridFileName, None, traces._coordinatePlane)
+                for gridPoints in PROFILER.iterate('readGrid', grid.iter_chunks()):
+                    grid_xy = gridPoints.xy()
+                    with PROFILER.phase('count'):
+                        count = lambda xy: intersectIndex.count_within_radii(xy, radii) if pool is None else \
+                            pool.map(count_tile, xy, radii)
+                        if previous is None:
+                            counts = count(grid_xy)
+                        else:
+                            counts = previous.values(grid_xy, lambda dirty: count(grid_xy[dirty]))
+                    with PROFILER.phase('write'):
+                        writer.write(gridPoints, counts)
+                    PROFILER.count('gridPoints', len(gridPoints))
+        finally:
+            if pool is not None:
+                pool.close()
+        if previous is not None:
+            with PROFILER.phase('incremental'):
+                previous.save()
+            print(previous.summary())
 
-    with open(outputFileName,'w') as f:
-        f.write('x	y	z	Name	Id	PType	Colour_Num	Colour_Id	Colour_(red)	Colour_(green)	Colour_(blue)')
-        f.write('   IntersectionsWithin{}\n'.format(radius))
-        for pt in gridPoints:
-            f.write(pt.to_string() + '\n')
+        if profile is not None:
+            PROFILER.write_report(profile, command='FractureIntersectionsPerRadius', radii=radii, workers=workers,
+                                  traces=len(traces), uniqueIntersections=len(intersectsXY))
+    finally:
+        if profile is not None:
+            PROFILER.enable(False)
 
 
 if __name__ == '__main__':
-    try:
-        main(sys.argv[1], sys.argv[2], sys.argv[3],sys.argv[4])
-    except IndexError as e:
-        print("Incorrect command line arguments.")
-        print("usage: FractureIntersectionsPerRadius fractureTraceFileName gridFileName radius_in_meters outputFileName")
+    parser = argparse.ArgumentParser(description="Counts fracture trace intersections within a radius of grid points")
+    parser.add_argument('fractureTraceFileName')
+    parser.add_argument('gridFileName')
+    parser.add_argument('radius_in_meters', help="radius, or comma separated radii like 0.5,1,2,5")
+    parser.add_argument('outputFileName')
+    parser.add_argument('--workers', type=int, default=1,
+                        help="number of worker processes counting tiles of the grid in parallel (default 1)")
+    parser.add_argument('--profile', nargs='?', const='-', default=None, metavar='REPORT_FILE',
+                        help="record the time of each phase and the geometry primitive counts, and write them as "
+                             "JSON to REPORT_FILE (default: print them)")
+    parser.add_argument('--incremental', action='store_true',
+                        help="store the counts, and on the next run with this option only recount the grid points "
+                             "near traces added, removed or changed since then")
+    parser.add_argument('--format', choices=FORMATS, default=None,
+                        help="output format: 'tsv' (MVE export with one column per radius), 'npy', 'npz' or 'raster' "
+                             "(regular grids only, an .npz of one 2d array per radius), "
+                             "default: from the output file extension")
+    parser.add_argument('--plane', type=parse_plane, default=MAP_VIEW,
+                        help="coordinate plane to analyse the traces in: 'map' (default), 'fit' for the plane fit "
+                             "through all trace vertices (e.g. a cliff face), or its normal like 0,-1,0")
+    args = parser.parse_args()
+    main(args.fractureTraceFileName, args.gridFileName, args.radius_in_meters, args.outputFileName, args.workers,
+         args.profile, args.incremental, args.format, None, None, None, args.plane)
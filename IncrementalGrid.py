@@ -0,0 +1,186 @@
+__author__ = 'ryshackleton'
+
+import hashlib
+import numpy as np
+import MVE_cache
+import MVE_importer
+from SpatialIndex import SegmentIndex
+
+'''
+Incremental recomputation of grid analyses after a few traces have been edited.
+A run stores its per grid point results with a fingerprint of every trace (its Id and a hash of its 2d geometry).
+The next run diffs the traces against the fingerprints and only recomputes the grid points that lie within the
+reach (the largest radius plus the tolerance) of the bounding box of a trace that was added, removed or changed,
+before or after the edit; every other grid point keeps its stored result. Everything is recomputed when the grid file
+or the settings of the analysis differ from the stored run.
+'''
+
+# version of the stored results, bump it when their layout or meaning changes
+INCREMENTAL_VERSION = 1
+# added to the reach of every analysis, covers the distance tolerances of the geometry code
+REACH_TOLERANCE = 1e-03
+
+
+def trace_fingerprints(traceSet):
+    '''
+    Fingerprints the traces of a TraceSet
+    :param traceSet: TraceSet of the traces
+    :return: tuple (ids, hashes, boxes) of the (T) array of trace Ids, (T) array of sha1 digests of the 2d vertex
+             coordinates of each trace and the (T,4) array of xmin,ymin,xmax,ymax bounding boxes of the traces
+    '''
+    xy = np.ascontiguousarray(traceSet._xy)
+    offsets = traceSet._offsets
+    hashes = np.array([hashlib.sha1(xy[offsets[i]:offsets[i + 1]].tobytes()).digest() for i in range(len(traceSet))],
+                      dtype='S20').reshape(-1)
+    boxes = np.full((len(traceSet), 4), np.nan)
+    counts = np.diff(offsets)
+    has = np.nonzero(counts > 0)[0]
+    if len(has) > 0:
+        starts = offsets[:-1][has]
+        boxes[has, 0] = np.minimum.reduceat(xy[:, 0], starts)
+        boxes[has, 1] = np.minimum.reduceat(xy[:, 1], starts)
+        boxes[has, 2] = np.maximum.reduceat(xy[:, 0], starts)
+        boxes[has, 3] = np.maximum.reduceat(xy[:, 1], starts)
+    return np.asarray(traceSet._traceIds, dtype=np.int64), hashes, boxes
+
+
+def _keyed(ids):
+    '''
+    :return: list of (Id, occurrence) keys, so traces that share an Id are told apart by their order
+    '''
+    seen = {}
+    keys = []
+    for i in ids.tolist():
+        seen[i] = seen.get(i, -1) + 1
+        keys.append((i, seen[i]))
+    return keys
+
+
+def changed_boxes(previous, current):
+    '''
+    Diffs two sets of trace fingerprints by trace Id and geometry hash
+    :param previous: tuple (ids, hashes, boxes) from trace_fingerprints() of the previous traces
+    :param current: tuple (ids, hashes, boxes) from trace_fingerprints() of the current traces
+    :return: tuple (boxes, numChanged) of the (N,4) array of the bounding boxes of the removed traces, the added
+             traces and both versions of the changed traces, and the number of traces added, removed or changed
+    '''
+    before = dict(zip(_keyed(previous[0]), range(len(previous[0]))))
+    after = dict(zip(_keyed(current[0]), range(len(current[0]))))
+    boxes = []
+    numChanged = 0
+    for key, i in before.items():
+        j = after.get(key)
+        if j is None or previous[1][i] != current[1][j]:
+            boxes.append(previous[2][i])
+            numChanged += 1
+    for key, j in after.items():
+        i = before.get(key)
+        if i is None or previous[1][i] != current[1][j]:
+            boxes.append(current[2][j])
+            numChanged += 1 if i is None else 0
+    boxes = np.array(boxes, dtype=np.float64).reshape(-1, 4)
+    return boxes[~np.isnan(boxes).any(axis=1)], numChanged
+
+
+def points_near_boxes(grid_xy, boxes, reach):
+    '''
+    Finds the points that lie within a distance of any of a set of boxes (a box grown by the distance on every side)
+    :param grid_xy: (G,2) array of points
+    :param boxes: (N,4) array of xmin,ymin,xmax,ymax boxes
+    :param reach: distance to grow the boxes by
+    :return: (G) boolean array, True for the points near a box
+    '''
+    grid_xy = np.asarray(grid_xy, dtype=np.float64).reshape(-1, 2)
+    near = np.zeros(len(grid_xy), dtype=bool)
+    if len(grid_xy) == 0 or len(boxes) == 0:
+        return near
+    index = SegmentIndex.from_points(grid_xy)
+    for xmin, ymin, xmax, ymax in boxes.tolist():
+        near[index.query_bbox(xmin - reach, ymin - reach, xmax + reach, ymax + reach)] = True
+    return near
+
+
+class IncrementalGrid():
+    """Previous results of a grid analysis and the grid points that have to be recomputed after trace edits.
+    Grid chunks must be passed to values() in file order; save() stores the results for the next run."""
+
+    def __init__(self, outputFileName, kind, settings, traceSet, gridFileName, reach):
+        """
+        Loads the results of the previous run and diffs its traces against the current ones
+        :param outputFileName: output file of the analysis, the results are stored in the parse cache next to it
+        :param kind: name of the analysis, e.g. 'p21'
+        :param settings: dict of every setting the results depend on (radii, method, tolerance ...)
+        :param traceSet: TraceSet of the current traces
+        :param gridFileName: MVE export of the grid points
+        :param reach: distance from a trace within which the results of a grid point can depend on it
+        """
+        self._outputFileName = outputFileName
+        self._kind = kind
+        self._settings = dict(settings, version=INCREMENTAL_VERSION, parserVersion=MVE_importer.PARSER_VERSION,
+                              grid=MVE_cache.file_key(gridFileName, 'PointSet'))
+        self._fingerprints = trace_fingerprints(traceSet)
+        self._reach = float(reach) + REACH_TOLERANCE
+        self._results = []
+        self._offset = 0
+        self._recomputed = 0
+
+        self._previous = None
+        self._boxes = None
+        self._numChanged = len(traceSet)
+        meta, arrays = MVE_cache.load_results(outputFileName, kind)
+        if meta is not None and all(meta.get(k) == v for k, v in self._settings.items()):
+            self._previous = arrays['results']
+            previous = (arrays['traceIds'], arrays['traceHashes'], arrays['traceBoxes'])
+            self._boxes, self._numChanged = changed_boxes(previous, self._fingerprints)
+
+    def is_incremental(self):
+        '''
+        :return: True if the results of a previous run with the same settings and grid are being reused
+        '''
+        return self._previous is not None
+
+    def values(self, grid_xy, compute):
+        '''
+        Returns the results of the next chunk of grid points, only computing those of the points near edited traces
+        :param grid_xy: (G,2) array of the grid points of the chunk
+        :param compute: function taking the array of the indices in the chunk of the points to compute and returning
+                        the (N,R) array of their results
+        :return: (G,R) array of the results of every point of the chunk
+        '''
+        grid_xy = np.asarray(grid_xy, dtype=np.float64).reshape(-1, 2)
+        start = self._offset
+        self._offset += len(grid_xy)
+        if self._previous is None or self._offset > len(self._previous):
+            dirty = np.arange(len(grid_xy))
+            values = None
+        else:
+            dirty = np.nonzero(points_near_boxes(grid_xy, self._boxes, self._reach))[0]
+            values = np.array(self._previous[start:self._offset])
+        if values is None:
+            values = np.asarray(compute(dirty))
+        elif len(dirty) > 0:
+            values[dirty] = compute(dirty)
+        self._recomputed += len(dirty)
+        self._results.append(values)
+        return values
+
+    def summary(self):
+        '''
+        :return: one line describing how much of the grid was recomputed
+        '''
+        if self._previous is None:
+            return "Incremental: no previous results for these settings and grid, computed all {} grid points" \
+                .format(self._offset)
+        return "Incremental: {} traces added, removed or changed, recomputed {} of {} grid points".format(
+            self._numChanged, self._recomputed, self._offset)
+
+    def save(self):
+        '''
+        Stores the results of this run and the trace fingerprints for the next run
+        :return: True if the results were stored
+        '''
+        results = np.concatenate(self._results) if len(self._results) > 0 else np.zeros((0, 0))
+        ids, hashes, boxes = self._fingerprints
+        return MVE_cache.store_results(self._outputFileName, self._kind, self._settings,
+                                       {'results': results, 'traceIds': ids, 'traceHashes': hashes,
+                                        'traceBoxes': boxes})
@@ -0,0 +1,177 @@
+__author__ = 'ryshackleton'
+
+import os
+import sys
+import json
+import shutil
+import hashlib
+import time
+import tempfile
+import numpy as np
+import MVE_importer
+from PlaneProjection import MAP_VIEW, is_map_view
+from TraceSet import TraceSet
+from PointSet import PointSet
+from Profiling import PROFILER
+
+'''
+On-disk cache of parsed MVE files.
+Each parsed file is stored as a directory of .npy column files (opened memory-mapped) plus a meta.json,
+keyed by the sha1 of the source file's contents and MVE_importer.PARSER_VERSION, so an edited file
+or a new parser version automatically misses the cache and replaces the stale entry.
+'''
+
+CACHE_DIR_NAME = '.fraccache'
+
+_TRACESET_COLUMNS = ('_xyz', '_xy', '_offsets', '_traceIds', '_ptype', '_colorindex', '_colornum',
+                     '_rvalue', '_gvalue', '_bvalue')
+_POINTSET_COLUMNS = ('_xyz', '_names', '_traceId', '_ptype', '_colorindex', '_colornum',
+                     '_rvalue', '_gvalue', '_bvalue')
+
+
+def file_key(filename, kind):
+    '''
+    :return: hex sha1 of the parser version, the kind of object parsed and the contents of the file
+    '''
+    h = hashlib.sha1('{}:{}:'.format(MVE_importer.PARSER_VERSION, kind).encode('utf-8'))
+    with open(filename, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def _entry_prefix(filename, kind, cacheDir):
+    if cacheDir is None:
+        cacheDir = os.path.join(os.path.dirname(os.path.abspath(filename)), CACHE_DIR_NAME)
+    return os.path.join(cacheDir, '{}.{}.'.format(os.path.basename(filename), kind))
+
+
+def _load_entry(path, columns):
+    with open(os.path.join(path, 'meta.json'), 'r') as f:
+        meta = json.load(f)
+    arrays = {c: np.load(os.path.join(path, c + '.npy'), mmap_mode='r') for c in columns}
+    return meta, arrays
+
+
+def _store_entry(prefix, key, meta, arrays):
+    '''
+    Writes a cache entry to a temporary directory, then renames it into place and removes stale entries
+    '''
+    cacheDir = os.path.dirname(prefix)
+    os.makedirs(cacheDir, exist_ok=True)
+    tmp = tempfile.mkdtemp(dir=cacheDir)
+    try:
+        for name, array in arrays.items():
+            np.save(os.path.join(tmp, name + '.npy'), np.ascontiguousarray(array))
+        with open(os.path.join(tmp, 'meta.json'), 'w') as f:
+            json.dump(meta, f)
+        os.replace(tmp, prefix + key)
+    except BaseException:
+        # a full disk or an interrupt must not leave a partial entry behind
+        shutil.rmtree(tmp, ignore_errors=True)
+        raise
+    for entry in os.listdir(cacheDir):
+        path = os.path.join(cacheDir, entry)
+        if path.startswith(prefix) and path != prefix + key:
+            shutil.rmtree(path, ignore_errors=True)
+
+
+def load_TraceSet(filename, cacheDir=None, coordinatePlane=MAP_VIEW):
+    '''
+    Returns the TraceSet of an MVE file, from the cache if the file has been parsed before
+    :param filename: MVE export of fracture traces
+    :param cacheDir: directory holding the cache, defaults to .fraccache next to the file
+    :param coordinatePlane: normal of the plane to project the traces onto, or PlaneProjection.FIT_PLANE,
+                            the projected coordinates of every plane are cached separately
+    :return: TraceSet() whose columns are memory-mapped from the cache
+    '''
+    # map view keeps the key of the files cached before other planes were supported
+    kind = 'TraceSet' if is_map_view(coordinatePlane) else 'TraceSet:{}'.format(
+        coordinatePlane if isinstance(coordinatePlane, str) else [float(c) for c in coordinatePlane])
+    key = file_key(filename, kind)
+    # each plane keeps its own entry, so analyses alternating between planes do not evict each other
+    prefix = _entry_prefix(filename, 'TraceSet' if kind == 'TraceSet' else
+                           'TraceSet-' + hashlib.sha1(kind.encode('utf-8')).hexdigest()[:12], cacheDir)
+    if not os.path.isdir(prefix + key):
+        PROFILER.count('cacheMisses')
+        traceSet = MVE_importer.build_TraceSet(filename, coordinatePlane)
+        meta = {'coordinatePlane': list(traceSet._coordinatePlane), 'traceNames': traceSet._traceNames}
+        try:
+            _store_entry(prefix, key, meta, {c: getattr(traceSet, c) for c in _TRACESET_COLUMNS})
+        except OSError as e:
+            print("Could not write the parse cache for {}: {}".format(filename, e), file=sys.stderr)
+            return traceSet
+    else:
+        PROFILER.count('cacheHits')
+    meta, a = _load_entry(prefix + key, _TRACESET_COLUMNS)
+    return TraceSet(a['_xyz'], a['_offsets'], a['_traceIds'], meta['traceNames'], tuple(meta['coordinatePlane']),
+                    xy=a['_xy'], ptype=a['_ptype'], colorindex=a['_colorindex'], colornum=a['_colornum'],
+                    rvalue=a['_rvalue'], gvalue=a['_gvalue'], bvalue=a['_bvalue'])
+
+
+def load_PointSet(filename, cacheDir=None, coordinatePlane=MAP_VIEW):
+    '''
+    Returns the PointSet of an MVE file, from the cache if the file has been parsed before
+    :param filename: MVE export of points
+    :param cacheDir: directory holding the cache, defaults to .fraccache next to the file
+    :param coordinatePlane: normal of the plane PointSet.xy() projects the points onto
+    :return: PointSet() whose columns are memory-mapped from the cache
+    '''
+    key = file_key(filename, 'PointSet')
+    prefix = _entry_prefix(filename, 'PointSet', cacheDir)
+    if not os.path.isdir(prefix + key):
+        PROFILER.count('cacheMisses')
+        pointSet = MVE_importer.build_PointSet(filename, coordinatePlane)
+        meta = {'nameCategories': pointSet._nameCategories}
+        try:
+            _store_entry(prefix, key, meta, {c: getattr(pointSet, c) for c in _POINTSET_COLUMNS})
+        except OSError as e:
+            print("Could not write the parse cache for {}: {}".format(filename, e), file=sys.stderr)
+            return pointSet
+    else:
+        PROFILER.count('cacheHits')
+    meta, a = _load_entry(prefix + key, _POINTSET_COLUMNS)
+    return PointSet(a['_xyz'], a['_names'], meta['nameCategories'], a['_traceId'], a['_ptype'],
+                    a['_colorindex'], a['_colornum'], a['_rvalue'], a['_gvalue'], a['_bvalue'], coordinatePlane)
+
+
+def store_results(filename, kind, meta, arrays, cacheDir=None):
+    '''
+    Stores the results of an analysis written to an output file, e.g. for incremental reruns (see IncrementalGrid),
+    replacing any results stored before for the same file and kind
+    :param filename: output file of the analysis
+    :param kind: name of the analysis
+    :param meta: dict of JSON serializable settings of the run
+    :param arrays: {name: array} of the results
+    :return: True if the results were stored
+    '''
+    meta = dict(meta, columns=list(arrays))
+    try:
+        # a new key every time, _store_entry() replaces the directory of the previous results
+        _store_entry(_entry_prefix(filename, kind, cacheDir), '{:016x}'.format(time.time_ns()), meta, arrays)
+    except OSError as e:
+        print("Could not store the results of {}: {}".format(filename, e), file=sys.stderr)
+        return False
+    return True
+
+
+def load_results(filename, kind, cacheDir=None):
+    '''
+    Returns the results stored by store_results() for an output file
+    :param filename: output file of the analysis
+    :param kind: name of the analysis
+    :return: tuple (meta, {name: memory-mapped array}), or (None, None) if no results are stored
+    '''
+    prefix = _entry_prefix(filename, kind, cacheDir)
+    cacheDir = os.path.dirname(prefix)
+    if not os.path.isdir(cacheDir):
+        return None, None
+    entries = sorted(e for e in os.listdir(cacheDir) if os.path.join(cacheDir, e).startswith(prefix))
+    if len(entries) == 0:
+        return None, None
+    try:
+        with open(os.path.join(cacheDir, entries[-1], 'meta.json'), 'r') as f:
+            columns = json.load(f)['columns']
+        return _load_entry(os.path.join(cacheDir, entries[-1]), columns)
+    except (OSError, ValueError, KeyError) as e:
+        return None, None
@@ -2,19 +2,36 @@
 
 __author__ = 'ryshackleton'
 
+import io
 import sys
+import numpy as np
 from pprint import pprint
 from FracTrace import FracTrace
 from Point2_MVE import Point2_MVE
+from TraceSet import TraceSet
+from PointSet import PointSet
+from PlaneProjection import MAP_VIEW, FIT_PLANE, resolve_plane
 
 
-def read_exported_mve_lines(filename):
+def iter_exported_mve_lines(filename):
+    """Yields the tab separated items of each non-empty line of an MVE file, one line at a time
+    :return  generator of [ item, item, ... ]
+    """
     with open(filename, mode='rt', encoding='utf-8') as f:
-        return [line.strip().split('\t') for line in f if len(line.strip()) > 0 ]
+        for line in f:
+            line = line.strip()
+            if len(line) > 0:
+                yield line.split('\t')
+
+
+def read_exported_mve_lines(filename):
+    return list(iter_exported_mve_lines(filename))
 
 
-def build_FracTraces(filename):
+def build_FracTraces(filename, coordinatePlane=MAP_VIEW):
     """Builds and returns a list of FracTrace() objects from an MVE file
+    :param coordinatePlane: normal of the plane to project the traces onto, or PlaneProjection.FIT_PLANE to fit
+                            the plane through all of the vertices, default map view
     :return  [ FracTrace(), FracTrace(), ... ]
     """
     lines = read_exported_mve_lines(filename)
@@ -49,26 +66,22 @@ def build_FracTraces(filename):
                     "Colour (green)  Colour (blue)"
             print(errorm)
 
-    #TODO: determine the normal vector for the fracture traces
-    planeNormal = (0.0,0.0,1.0)
+    planeNormal = coordinatePlane
 
+    # traces keyed by id, fracTraceList keeps them in order of first appearance
+    fracTraceById = {}
     for l in lines:
         try:
             # skip the header line
             if( not( l[idi].isnumeric() ) ):
                 continue
 
-            # find the FracTrace that we're working on if it exists
-            thisTrcI = -1
-            try:
-                # overloaded __eq__ operator finds using id
-                thisTrcI = fracTraceList.index(FracTrace(l[idi]))
-            except ValueError as e: # if not found, add the trace
-                fracTraceList.append( FracTrace( l[idi], l[namei], planeNormal,
-                                                 [(l[xi], l[yi], l[zi])] ) )
-                thisTrcI = fracTraceList.index(FracTrace(l[idi]))
-
-            thisTrc = fracTraceList[thisTrcI]
+            # find the FracTrace that we're working on, add it if it doesn't exist yet
+            thisTrc = fracTraceById.get(int(l[idi]))
+            if thisTrc is None:
+                thisTrc = FracTrace( l[idi], l[namei], planeNormal )
+                fracTraceById[thisTrc._traceId] = thisTrc
+                fracTraceList.append(thisTrc)
 
             # append all of the xyz and other attributes
             if( xi != -1 and yi != -1 and zi != -1):
@@ -91,24 +104,324 @@ def build_FracTraces(filename):
         except IndexError as e:
             print("Problem creating fracture traces in build_FracTraces")
 
+    # a fitted plane needs every vertex, so the plane is resolved once for all of the traces
+    vertices = None
+    if coordinatePlane == FIT_PLANE:
+        vertices = np.array([v for frac in fracTraceList for v in frac._vlist3], dtype=np.float64).reshape(-1, 3)
+    planeNormal = resolve_plane(coordinatePlane, vertices)
+
     # do the 3D -> 2D transformation of vertices
     for frac in fracTraceList:
+        frac._coordinatePlane = planeNormal
         frac.build_vlist2()
 
     return fracTraceList
 
+def find_column_indices(header):
+    """Finds the index of each of the MVE columns in the header row
+    :param header: list of column names from the first line of an MVE file
+    :return  dict of column name : index, -1 for any column that is missing from the header
+    """
+    columns = ['x', 'y', 'z', 'Name', 'Id', 'PType', 'Colour Id', 'Colour Num',
+               'Colour (red)', 'Colour (green)', 'Colour (blue)']
+    return {c: (header.index(c) if c in header else -1) for c in columns}
+
+
+# bump whenever the parsed TraceSet or PointSet changes, so MVE_cache discards entries written by an older parser
+PARSER_VERSION = 1
+
+MVE_FLOAT_COLUMNS = ('x', 'y', 'z')
+MVE_INT_COLUMNS = ('Id', 'PType', 'Colour Id', 'Colour Num', 'Colour (red)', 'Colour (green)', 'Colour (blue)')
+
+
+def read_mve_columns(filename):
+    """Reads a whole MVE file straight into typed numpy columns
+    x, y and z become float64 columns, Id, PType and the colour columns become int64 columns and Name becomes
+    an int32 column of codes into the list of distinct names. Column positions are found from the header.
+    Rows with the wrong number of items or with non-numeric values are left out and reported together.
+    :return  tuple (columns, nameCategories, malformedRows) where columns is a dict of header name : array
+             and malformedRows is a list of (line number, reason)
+    """
+    with open(filename, mode='rb') as f:
+        raw = f.read()
+    if b'\r' in raw:
+        raw = raw.replace(b'\r', b'')
+    buf = np.frombuffer(raw, dtype=np.uint8)
+
+    # line boundaries, blank lines and tab positions all come from vectorized passes over the bytes
+    newlines = np.flatnonzero(buf == 10)
+    lineStart = np.concatenate(([0], newlines + 1))
+    lineEnd = np.concatenate((newlines, [len(buf)]))
+    lines = np.flatnonzero(lineEnd > lineStart)
+    # lines that start with white space may be blank, only those few are checked one by one
+    first = buf[lineStart[lines]]
+    maybeBlank = np.flatnonzero((first == 9) | (first == 11) | (first == 12) | (first == 32))
+    blank = [k for k in maybeBlank.tolist() if len(raw[lineStart[lines[k]]:lineEnd[lines[k]]].strip()) == 0]
+    lines = np.delete(lines, blank)
+    if len(lines) == 0:
+        return {}, [], []
+    header = raw[lineStart[lines[0]]:lineEnd[lines[0]]].decode('utf-8').strip().split('\t')
+    numColumns = len(header)
+    rows = lines[1:]
+
+    tabs = np.flatnonzero(buf == 9)
+    firstTab = np.searchsorted(tabs, lineStart[rows])
+    tabCount = np.searchsorted(tabs, lineEnd[rows]) - firstTab
+    wrongLength = tabCount != numColumns - 1
+    malformed = [(r + 1, 'expected {} tab separated items, found {}'.format(numColumns, c + 1))
+                 for r, c in zip(rows[wrongLength].tolist(), tabCount[wrongLength].tolist())]
+    rows = rows[~wrongLength]
+    firstTab = firstTab[~wrongLength]
+
+    def field_spans(c):
+        start = lineStart[rows] if c == 0 else tabs[firstTab + c - 1] + 1
+        end = lineEnd[rows] if c == numColumns - 1 else tabs[firstTab + c]
+        return start, end
+
+    # numeric columns, parsed in bulk by numpy unless some values don't convert
+    numeric = [c for c in MVE_FLOAT_COLUMNS + MVE_INT_COLUMNS if c in header]
+    usecols = [header.index(c) for c in numeric]
+    values = np.zeros((len(rows), len(usecols)))
+    bad = np.zeros(len(rows), dtype=bool)
+    if len(rows) > 0 and len(usecols) > 0:
+        try:
+            if len(malformed) == 0:
+                text = io.StringIO(raw.decode('utf-8'))
+                values = np.loadtxt(text, delimiter='\t', skiprows=int(lines[0]) + 1, usecols=usecols,
+                                    dtype=np.float64, ndmin=2, encoding=None)
+            else:
+                goodLines = (raw[s:e].decode('utf-8') for s, e in zip(lineStart[rows], lineEnd[rows]))
+                values = np.loadtxt(goodLines, delimiter='\t', usecols=usecols, dtype=np.float64, ndmin=2)
+            if len(values) != len(rows):
+                raise ValueError("blank lines inside the data")
+        except ValueError:
+            # find every bad value, one column at a time
+            values = np.zeros((len(rows), len(usecols)))
+            for k, c in enumerate(usecols):
+                for i, (s, e) in enumerate(zip(*field_spans(c))):
+                    try:
+                        values[i, k] = float(raw[s:e])
+                    except ValueError:
+                        if not bad[i]:
+                            malformed.append((int(rows[i]) + 1,
+                                              "non-numeric {} value '{}'".format(header[c], raw[s:e].decode('utf-8'))))
+                        bad[i] = True
+
+    columns = {}
+    for k, c in enumerate(numeric):
+        columns[c] = values[~bad, k] if c in MVE_FLOAT_COLUMNS else values[~bad, k].astype(np.int64)
+
+    # names as categories, the name bytes of every row are gathered into one fixed width array
+    nameCategories = []
+    if 'Name' in header:
+        start, end = field_spans(header.index('Name'))
+        start = start[~bad]
+        end = end[~bad]
+        width = max(int((end - start).max()) if len(start) > 0 else 0, 1)
+        idx = start[:, None] + np.arange(width)[None, :]
+        nameBytes = np.where(idx < end[:, None], buf[np.minimum(idx, max(len(buf) - 1, 0))], 0).astype(np.uint8)
+        nameBytes = nameBytes.view('S{}'.format(width)).ravel()
+        # consecutive rows of a trace share a name, so only the first row of each run has to be sorted
+        runStart = np.flatnonzero(np.concatenate(([len(nameBytes) > 0], nameBytes[1:] != nameBytes[:-1])))
+        categories, codes = np.unique(nameBytes[runStart], return_inverse=True)
+        nameCategories = [n.decode('utf-8') for n in categories.tolist()]
+        columns['Name'] = np.repeat(codes.ravel(), np.diff(np.append(runStart, len(nameBytes)))).astype(np.int32)
+
+    malformed.sort()
+    return columns, nameCategories, malformed
+
+
+def report_malformed_rows(filename, malformedRows, maxListed=10):
+    """Prints one message listing the malformed rows found in a file
+    :param malformedRows: list of (line number, reason) from read_mve_columns()
+    """
+    if len(malformedRows) == 0:
+        return
+    print("Skipped {} malformed rows in {}:".format(len(malformedRows), filename), file=sys.stderr)
+    for line, reason in malformedRows[:maxListed]:
+        print("    line {}: {}".format(line, reason), file=sys.stderr)
+    if len(malformedRows) > maxListed:
+        print("    ...", file=sys.stderr)
+
+
+def build_TraceSet(filename, coordinatePlane=MAP_VIEW):
+    """Builds and returns a columnar TraceSet() of all of the fracture traces in an MVE file
+    Each row of the file becomes one vertex, rows are grouped into traces by Id in order of first appearance
+    :param coordinatePlane: normal of the plane to project the traces onto, or PlaneProjection.FIT_PLANE to fit
+                            the plane through all of the vertices (e.g. for a cliff face), default map view
+    :return  TraceSet()
+    """
+    columns, nameCategories, malformed = read_mve_columns(filename)
+    if len(columns) == 0:
+        return TraceSet([], [0], [], [])
+    if any(c not in columns for c in ('x', 'y', 'z', 'Name', 'Id')):
+        print("Invalid header, header should contain AT LEAST the following tab separated items in any order\n"
+              "x    y   z   Name    Id")
+        return TraceSet([], [0], [], [])
+    report_malformed_rows(filename, malformed)
+
+    # number the traces in order of first appearance, then stable sort the rows by trace
+    uniqueIds, firstRow, rowTrace = np.unique(columns['Id'], return_index=True, return_inverse=True)
+    traceOrder = np.argsort(firstRow, kind='stable')
+    rank = np.empty_like(traceOrder)
+    rank[traceOrder] = np.arange(len(traceOrder))
+    rowRank = rank[rowTrace.ravel()]
+    order = np.argsort(rowRank, kind='stable')
+    offsets = np.concatenate(([0], np.cumsum(np.bincount(rowRank, minlength=len(uniqueIds)))))
+
+    xyz = np.column_stack((columns['x'], columns['y'], columns['z']))[order]
+    traceNames = [nameCategories[c] for c in columns['Name'][firstRow[traceOrder]].tolist()]
+    attrColumns = {'ptype': 'PType', 'colorindex': 'Colour Id', 'colornum': 'Colour Num',
+                   'rvalue': 'Colour (red)', 'gvalue': 'Colour (green)', 'bvalue': 'Colour (blue)'}
+    attrs = {name: columns[c][order] for name, c in attrColumns.items() if c in columns}
+
+    return TraceSet(xyz, offsets, uniqueIds[traceOrder], traceNames, coordinatePlane, **attrs)
+
+
+def build_PointSet(filename, coordinatePlane=MAP_VIEW):
+    """Builds and returns a columnar PointSet() of all of the points in an MVE file
+    :param coordinatePlane: normal of the plane to project the points onto, the plane of the traces they sample
+    :return  PointSet()
+    """
+    columns, nameCategories, malformed = read_mve_columns(filename)
+    if any(c not in columns for c in ('x', 'y', 'z')):
+        print("Invalid header, header should contain AT LEAST the following tab separated items in any order\n"
+              "x    y   z")
+        return PointSet([], coordinatePlane=coordinatePlane)
+    report_malformed_rows(filename, malformed)
+    return PointSet(np.column_stack((columns['x'], columns['y'], columns['z'])),
+                    columns.get('Name'), nameCategories, columns.get('Id'), columns.get('PType'),
+                    columns.get('Colour Id'), columns.get('Colour Num'), columns.get('Colour (red)'),
+                    columns.get('Colour (green)'), columns.get('Colour (blue)'), coordinatePlane)
+
+
+def iter_FracTraces(filename, coordinatePlane=MAP_VIEW):
+    """Yields the FracTrace() objects of an MVE file one at a time, without reading the whole file
+    Rows are assumed to be grouped by Id (as MVE exports them): a trace is yielded as soon as the Id changes,
+    an Id that shows up again later in the file starts a new FracTrace with the same Id
+    :param coordinatePlane: normal of the plane to project the traces onto, default map view (not FIT_PLANE, the
+                            traces are projected before the rest of the file is read)
+    :return  generator of FracTrace()
+    """
+    if coordinatePlane == FIT_PLANE:
+        raise ValueError("iter_FracTraces cannot fit the coordinate plane through vertices it has not read yet, "
+                         "use build_FracTraces or build_TraceSet")
+    lines = iter_exported_mve_lines(filename)
+    header = next(lines, None)
+    if header is None:
+        return
+    ci = find_column_indices(header)
+    if -1 in (ci['x'], ci['y'], ci['z'], ci['Name'], ci['Id']):
+        print("Invalid header, header should contain AT LEAST the following tab separated items in any order\n"
+              "x    y   z   Name    Id")
+        return
+
+    planeNormal = resolve_plane(coordinatePlane, None)
+
+    thisTrc = None
+    for l in lines:
+        try:
+            # skip any repeated header lines
+            if not l[ci['Id']].isnumeric():
+                continue
+
+            if thisTrc is None or thisTrc._traceId != int(l[ci['Id']]):
+                if thisTrc is not None:
+                    thisTrc.build_vlist2()
+                    yield thisTrc
+                thisTrc = FracTrace(l[ci['Id']], l[ci['Name']], planeNormal)
+
+            # append all of the xyz and other attributes
+            thisTrc.append_vertex3( (l[ci['x']], l[ci['y']], l[ci['z']]) )
+            if ci['Colour Num'] != -1:
+                thisTrc.append_color_num(l[ci['Colour Num']])
+            if ci['Colour Id'] != -1:
+                thisTrc.append_color_index(l[ci['Colour Id']])
+            if ci['Colour (red)'] != -1:
+                thisTrc.append_color_R(l[ci['Colour (red)']])
+            if ci['Colour (green)'] != -1:
+                thisTrc.append_color_G(l[ci['Colour (green)']])
+            if ci['Colour (blue)'] != -1:
+                thisTrc.append_color_B(l[ci['Colour (blue)']])
+            if ci['PType'] != -1:
+                thisTrc.append_ptype(l[ci['PType']])
+
+        except IndexError as e:
+            print("Problem creating fracture traces in iter_FracTraces")
+
+    if thisTrc is not None:
+        thisTrc.build_vlist2()
+        yield thisTrc
+
+
+def iter_TraceSets(filename, tracesPerChunk=10000):
+    """Yields the fracture traces of an MVE file as a series of TraceSet() chunks
+    :param tracesPerChunk: maximum number of traces in each TraceSet
+    :return  generator of TraceSet()
+    """
+    chunk = []
+    for trace in iter_FracTraces(filename):
+        chunk.append(trace)
+        if len(chunk) >= tracesPerChunk:
+            yield TraceSet.from_FracTraces(chunk)
+            chunk = []
+    if len(chunk) > 0:
+        yield TraceSet.from_FracTraces(chunk)
+
+
 def build_point_list(filename):
     """Builds a list of Point2_MVE() objects from an MVE file
     :return  [ Point2_MVE(), Point2_MVE(), ... ]
     """
-    lines = read_exported_mve_lines(filename)
-    point2List = []
+    return list(iter_points(filename))
+
+
+def iter_point_chunks(filename, pointsPerChunk=65536):
+    """Yields the Point2_MVE() objects of an MVE file in lists of up to pointsPerChunk points
+    :return  generator of [ Point2_MVE(), Point2_MVE(), ... ]
+    """
+    chunk = []
+    for pt in iter_points(filename):
+        chunk.append(pt)
+        if len(chunk) >= pointsPerChunk:
+            yield chunk
+            chunk = []
+    if len(chunk) > 0:
+        yield chunk
+
+
+class PointSetFile():
+    """The points of an MVE file, read again as PointSet() chunks every time they are iterated, e.g. a grid too
+    large to hold in memory"""
+
+    def __init__(self, filename, coordinatePlane=MAP_VIEW):
+        """
+        :param filename: MVE export of the points
+        :param coordinatePlane: normal of the plane to project the points onto, the plane of the traces they sample
+        """
+        self._filename = filename
+        self._coordinatePlane = coordinatePlane
+
+    def iter_chunks(self, pointsPerChunk=65536):
+        '''
+        Reads the points, only holding one chunk of them at a time
+        :return: generator of PointSet() of up to pointsPerChunk points, like PointSet.iter_chunks()
+        '''
+        for points in iter_point_chunks(self._filename, pointsPerChunk):
+            yield PointSet.from_Point2_MVE_list(points, self._coordinatePlane)
+
+
+def iter_points(filename):
+    """Yields the Point2_MVE() objects of an MVE file one at a time, without reading the whole file
+    :return  generator of Point2_MVE()
+    """
+    lines = iter_exported_mve_lines(filename)
+    header = next(lines, None)
     # find the indices of x, y, z, etc in each row of the file
     xi = yi = zi = namei = idi = colori = -1
     colorni = colorRi = colorBi = colorGi = ptypei = -1
     try:
-        if( len(lines) > 0 ):
-            header = lines[0]
+        if header is not None:
             xi = header.index('x')
             yi = header.index('y')
             zi = header.index('z')
@@ -149,6 +462,8 @@ def build_point_list(filename):
                 continue
             if namei > 0:
                 pt._Name = l[namei]
+            if idi > 0:
+                pt._traceId = int(l[idi])
             if colorni > 0:
                 pt._colornum = l[colorni]
             if colori > 0:
@@ -161,13 +476,11 @@ def build_point_list(filename):
                 pt._bvalue = l[colorBi]
             if ptypei > 0:
                 pt._ptype = l[ptypei]
-            point2List.append(pt)
+            yield pt
 
         except IndexError as e:
             print("Problem creating points in build point list")
 
-    return point2List
-
 
 def print_FracTraces(fracTraces=[]):
     """Prints the fracture traces to the stdout
@@ -182,8 +495,8 @@ def print_FracTraces(fracTraces=[]):
 
 def main(filename):
     try:
-        series = read_exported_mve_lines(filename)
-        pprint(series)
+        for line in iter_exported_mve_lines(filename):
+            pprint(line)
     except (FileExistsError, FileNotFoundError):
         print("File '{}' not found or doesn't exist:".format(filename))
         print("usage: python3 MVE_importer filename.")
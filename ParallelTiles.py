@@ -0,0 +1,158 @@
+__author__ = 'ryshackleton'
+
+import math
+import multiprocessing
+import numpy as np
+from multiprocessing import shared_memory
+from CircularScanlines import DEFAULT_CHUNK_BYTES, _grid_chunks, segment_length_inside_circles, \
+    polygon_length_inside_circles
+from SpatialIndex import SegmentIndex, PointIndex
+
+'''
+Multi-process evaluation of grid analyses.
+The grid is split into square tiles that are farmed out to worker processes. The large inputs (trace segments,
+intersection points) are copied once into shared memory that every worker maps read-only, so only the grid points
+of each tile travel between processes. Each worker indexes the shared inputs once and queries them within the tile
+bounds plus a halo of one radius, and results are computed exactly as in the serial code, so they are bit-identical
+to a serial run.
+'''
+
+# number of tiles handed out per worker, more tiles balance the load better between dense and sparse areas
+TILES_PER_WORKER = 4
+# upper limit on the grid points in one tile
+MAX_TILE_POINTS = 16384
+
+# arrays shared with this worker process, set up by _attach_shared()
+_shared = {}
+_sharedMemory = []
+
+
+def _attach_shared(specs):
+    '''
+    Pool initializer, maps the shared arrays into the worker process
+    :param specs: {name: (shared memory name, shape, dtype string)}
+    '''
+    for name, (shmName, shape, dtype) in specs.items():
+        shm = shared_memory.SharedMemory(name=shmName)
+        _sharedMemory.append(shm)
+        array = np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf)
+        array.flags.writeable = False
+        _shared[name] = array
+
+
+def _run_tile(task):
+    tileFunction, grid_xy, radii = task
+    return tileFunction(_shared, grid_xy, radii)
+
+
+def _cached_index(shared, key, build):
+    '''
+    Returns the spatial index of the shared arrays stored under key, built by build() on the first tile of this worker
+    '''
+    if key not in shared:
+        shared[key] = build()
+    return shared[key]
+
+
+def p21_tile(shared, grid_xy, radii):
+    '''
+    Computes p21 for the grid points of one tile from the shared 'segs' array
+    :return: (G,R) array of p21 values, identical to CircularScanlines.compute_p21_radii()
+    '''
+    segs = shared['segs']
+    index = _cached_index(shared, 'segIndex', lambda: SegmentIndex(segs))
+    lengths = segment_length_inside_circles(grid_xy, radii, segs, index, DEFAULT_CHUNK_BYTES)
+    return lengths / np.array([math.pi * r * r for r in radii])
+
+
+def polygon_p21_tile(shared, grid_xy, radii):
+    '''
+    Computes the 'polygon' method p21 for the grid points of one tile from the shared 'segs' and 'segTrace' arrays
+    :return: (G,R) array of p21 values, identical to CircularScanlines.compute_polygon_p21_radii()
+    '''
+    segs = shared['segs']
+    index = _cached_index(shared, 'segIndex', lambda: SegmentIndex(segs))
+    lengths = polygon_length_inside_circles(grid_xy, radii, segs, shared['segTrace'], index, DEFAULT_CHUNK_BYTES)
+    return lengths / np.array([math.pi * r * r for r in radii])
+
+
+def count_tile(shared, grid_xy, radii):
+    '''
+    Counts the shared 'points' closer than each radius to the grid points of one tile
+    :return: (G,R) array of counts, identical to SpatialIndex.PointIndex.count_within_radii()
+    '''
+    radius = max(radii)
+    index = _cached_index(shared, ('pointIndex', radius), lambda: PointIndex(shared['points'], radius))
+    return index.count_within_radii(grid_xy, radii)
+
+
+class TilePool():
+    """Pool of worker processes sharing a set of read-only arrays, used as a context manager:
+
+        with TilePool({'segs': segs}, workers) as pool:
+            p21 = pool.map(p21_tile, grid_xy, radii)
+    """
+
+    def __init__(self, arrays, workers):
+        """
+        Copies the arrays into shared memory and starts the worker processes
+        :param arrays: {name: numpy array} handed to the tile functions as shared[name]
+        :param workers: number of worker processes
+        """
+        self._workers = max(int(workers), 1)
+        self._sharedMemory = []
+        specs = {}
+        try:
+            for name, array in arrays.items():
+                array = np.ascontiguousarray(array)
+                shm = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+                self._sharedMemory.append(shm)
+                np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)[...] = array
+                specs[name] = (shm.name, array.shape, array.dtype.str)
+            self._pool = multiprocessing.Pool(self._workers, initializer=_attach_shared, initargs=(specs,))
+        except Exception:
+            self.close()
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.close()
+
+    def close(self):
+        '''
+        Stops the workers and releases the shared memory
+        '''
+        pool = getattr(self, '_pool', None)
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+            self._pool = None
+        for shm in self._sharedMemory:
+            shm.close()
+            shm.unlink()
+        self._sharedMemory = []
+
+    def map(self, tileFunction, grid_xy, radii):
+        '''
+        Evaluates tileFunction(shared, tile_xy, radii) over spatial tiles of the grid in the worker processes
+        :param tileFunction: module level function returning one row of values per grid point of a tile
+        :param grid_xy: (G,2) array of grid points
+        :param radii: sequence of search radii, the largest is also the halo around each tile
+        :return: (G,R) array of the values, in the order of grid_xy
+        '''
+        grid_xy = np.asarray(grid_xy, dtype=np.float64).reshape(-1, 2)
+        radii = [float(r) for r in radii]
+        if len(grid_xy) == 0:
+            return np.zeros((0, len(radii)))
+        extent = max(float(np.ptp(grid_xy[:, 0])), float(np.ptp(grid_xy[:, 1])))
+        tileSize = max(extent / math.ceil(math.sqrt(TILES_PER_WORKER * self._workers)), 2.0 * max(radii))
+        tiles = list(_grid_chunks(grid_xy, tileSize, MAX_TILE_POINTS))
+        values = None
+        tasks = ((tileFunction, grid_xy[tile], radii) for tile in tiles)
+        for tile, tileValues in zip(tiles, self._pool.imap(_run_tile, tasks)):
+            if values is None:
+                values = np.zeros((len(grid_xy),) + tileValues.shape[1:], dtype=tileValues.dtype)
+            values[tile] = tileValues
+        return values
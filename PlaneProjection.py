@@ -0,0 +1,143 @@
+__author__ = 'ryshackleton'
+
+import math
+import numpy as np
+
+'''
+Projection of 3d trace and grid vertices onto the 2d coordinate plane the analyses work in.
+A coordinate plane is given by its normal (nx, ny, nz) and passes through the origin, so the traces and the grid of
+a model project identically. Map view, (0,0,1) or (0,0,-1), keeps x and y as they are. Any other plane, e.g. a cliff
+face digitised on a photogrammetry model, is projected with one matrix multiply of all the stacked vertices by the
+in-plane axes: u along strike (horizontal) and v up the dip, so a vertical face facing south has u east and v up.
+FIT_PLANE fits the plane through all of the vertices by SVD.
+'''
+
+MAP_VIEW = (0.0, 0.0, 1.0)
+# coordinatePlane value asking for the best fit plane of the vertices
+FIT_PLANE = 'fit'
+# dip in degrees of the best fit plane of the vertices above which a map view analysis is suspicious
+STEEP_DIP = 45.0
+# number of vertices sampled to fit the plane checked by map_view_warning()
+_DIP_SAMPLES = 100000
+
+
+def is_map_view(normal):
+    '''
+    :return: True if the normal is the map view normal (0,0,1) or (0,0,-1)
+    '''
+    return tuple(normal) in ((0.0, 0.0, 1.0), (0.0, 0.0, -1.0))
+
+
+def unit_normal(normal):
+    '''
+    :param normal: sequence of 3 numbers, the normal of a plane
+    :return: tuple of the unit length normal
+    '''
+    n = np.asarray(normal, dtype=np.float64).reshape(3)
+    length = math.sqrt(float(n @ n))
+    if not length > 0.0 or not math.isfinite(length):
+        raise ValueError("The normal of a coordinate plane must be a finite, non-zero vector, got {}".format(normal))
+    return tuple((n / length).tolist())
+
+
+def fit_plane(xyz):
+    '''
+    Fits a plane to points by SVD (total least squares)
+    :param xyz: (V,3) array of points, at least 3 of them not on one line
+    :return: tuple of the unit normal of the best fit plane, with its last non-zero component (nz, else ny, else nx)
+             positive so the same points always give the same normal
+    '''
+    xyz = np.asarray(xyz, dtype=np.float64).reshape(-1, 3)
+    if len(xyz) < 3:
+        raise ValueError("At least 3 vertices are needed to fit a coordinate plane, got {}".format(len(xyz)))
+    singular, axes = np.linalg.svd(xyz - xyz.mean(axis=0), full_matrices=False)[1:]
+    if not singular[1] > 1e-12 * max(singular[0], 1.0):
+        raise ValueError("The vertices lie on a line, they do not define a coordinate plane")
+    normal = axes[2]
+    sign = next((np.sign(c) for c in normal[::-1].tolist() if abs(c) > 1e-12), 1.0)
+    return unit_normal(normal * sign)
+
+
+def plane_basis(normal):
+    '''
+    :param normal: normal of the coordinate plane
+    :return: (3,2) array whose columns are the unit in-plane axes u and v, xyz @ basis projects points onto the plane
+    '''
+    if is_map_view(normal):
+        return np.array([[1.0, 0.0], [0.0, 1.0], [0.0, 0.0]])
+    n = np.array(unit_normal(normal))
+    strike = np.array([-n[1], n[0], 0.0])
+    length = math.sqrt(float(strike @ strike))
+    if not length > 1e-12:
+        # a horizontal plane has no strike, keep x and y
+        return np.array([[1.0, 0.0], [0.0, 1.0], [0.0, 0.0]])
+    u = strike / length
+    v = np.cross(n, u)
+    return np.column_stack((u, v))
+
+
+def project_to_plane(xyz, normal=MAP_VIEW):
+    '''
+    Projects 3d points onto a coordinate plane
+    :param xyz: (V,3) array of points
+    :param normal: normal of the coordinate plane
+    :return: (V,2) array of the in-plane coordinates, x and y themselves in map view
+    '''
+    xyz = np.asarray(xyz, dtype=np.float64).reshape(-1, 3)
+    if is_map_view(normal):
+        return np.ascontiguousarray(xyz[:, :2])
+    return np.ascontiguousarray(xyz @ plane_basis(normal))
+
+
+def resolve_plane(coordinatePlane, xyz):
+    '''
+    :param coordinatePlane: normal of the coordinate plane, or FIT_PLANE
+    :param xyz: (V,3) array of the vertices, used to fit the plane
+    :return: tuple of the normal of the coordinate plane (the best fit normal for FIT_PLANE)
+    '''
+    if isinstance(coordinatePlane, str):
+        if coordinatePlane != FIT_PLANE:
+            raise ValueError("Unknown coordinate plane '{}', give a normal or '{}'".format(coordinatePlane, FIT_PLANE))
+        return fit_plane(xyz)
+    if is_map_view(coordinatePlane):
+        return tuple(float(c) for c in coordinatePlane)
+    return unit_normal(coordinatePlane)
+
+
+def parse_plane(value):
+    '''
+    Parses a coordinate plane given on the command line
+    :param value: 'fit', 'map', or a comma separated normal like '0,-1,0'
+    :return: FIT_PLANE or a tuple of 3 floats
+    '''
+    if value == FIT_PLANE:
+        return FIT_PLANE
+    if value == 'map':
+        return MAP_VIEW
+    normal = tuple(float(v) for v in value.split(','))
+    if len(normal) != 3:
+        raise ValueError("A coordinate plane normal needs 3 components, got '{}'".format(value))
+    return normal
+
+
+def map_view_warning(coordinatePlane, xyz, maxDip=STEEP_DIP):
+    '''
+    Checks that vertices analysed in map view are not digitised on a steep surface like a cliff face,
+    whose traces would be squashed onto a thin strip of the map
+    :param coordinatePlane: normal of the coordinate plane of the analysis
+    :param xyz: (V,3) array of the vertices
+    :param maxDip: largest dip in degrees of the plane fit through the vertices accepted in map view
+    :return: warning message if the analysis is in map view and the vertices dip more than maxDip, else None
+    '''
+    if isinstance(coordinatePlane, str) or not is_map_view(coordinatePlane):
+        return None
+    xyz = np.asarray(xyz, dtype=np.float64).reshape(-1, 3)
+    try:
+        normal = fit_plane(xyz[::max(len(xyz) // _DIP_SAMPLES, 1)])
+    except ValueError:
+        return None
+    dip = math.degrees(math.acos(min(abs(normal[2]), 1.0)))
+    if dip <= maxDip:
+        return None
+    return "Warning: the vertices lie on a plane dipping {:.0f} degrees but are analysed in map view, " \
+           "give --plane fit (or the normal {:.3f},{:.3f},{:.3f}) to analyse them in that plane".format(dip, *(round(c, 3) + 0.0 for c in normal))
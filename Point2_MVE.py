@@ -19,6 +19,7 @@ class Point2_MVE(Point2):
         self._bvalue = 255
         self._otherint  = 0
         self._otherfloat = 0.0
+        self._othervalues = []
 
     def to_string(self):
         # 'x	y	z	Name	Id	PType	Colour Num	Colour Id	Colour (red)	Colour (green)	Colour (blue)')
@@ -28,6 +29,8 @@ class Point2_MVE(Point2):
                                                                        self._rvalue,self._gvalue,self._bvalue,
                                                                        self._otherint,
                                                                        self._otherfloat)
+        for v in self._othervalues:
+            str += '  {}'.format(v)
         return str
 
 
@@ -0,0 +1,118 @@
+__author__ = 'ryshackleton'
+
+import numpy as np
+from Point2_MVE import Point2_MVE
+from PlaneProjection import MAP_VIEW, project_to_plane, resolve_plane
+
+
+class PointSet():
+    """Models the points of an MVE file (usually a grid of circular scanline centers) as typed columns"""
+
+    def __init__(self, xyz, names=None, nameCategories=None, traceId=None, ptype=None,
+                 colorindex=None, colornum=None, rvalue=None, gvalue=None, bvalue=None, coordinatePlane=MAP_VIEW):
+        """
+        Initializes a PointSet
+
+        :param xyz: (N,3) array of point coordinates
+        :param names: (N) array of integer codes into nameCategories
+        :param nameCategories: list of the distinct Name strings
+        :param traceId, ptype, colorindex, colornum: optional (N) integer attribute columns
+        :param rvalue, gvalue, bvalue: optional (N) integer colour columns, default 255 as in Point2_MVE
+        :param coordinatePlane: normal of the coordinate plane xy() projects the points onto, usually the
+                                coordinatePlane of the TraceSet the points sample
+        """
+        self._xyz = np.ascontiguousarray(xyz, dtype=np.float64).reshape(-1, 3)
+        n = len(self._xyz)
+
+        def column(c, default=0):
+            if c is None:
+                return np.full(n, default, dtype=np.int32)
+            return np.asarray(c, dtype=np.int32)
+        self._names = column(names)
+        self._nameCategories = [''] if nameCategories is None else list(nameCategories)
+        self._traceId = column(traceId)
+        self._ptype = column(ptype)
+        self._colorindex = column(colorindex)
+        self._colornum = column(colornum)
+        self._rvalue = column(rvalue, 255)
+        self._gvalue = column(gvalue, 255)
+        self._bvalue = column(bvalue, 255)
+        self._coordinatePlane = resolve_plane(coordinatePlane, self._xyz)
+
+    @classmethod
+    def from_Point2_MVE_list(cls, points, coordinatePlane=MAP_VIEW):
+        '''
+        Builds a PointSet from a list of Point2_MVE objects, the inverse of to_Point2_MVE_list()
+        :param points: list of Point2_MVE() objects
+        :param coordinatePlane: normal of the coordinate plane xy() projects the points onto
+        :return: PointSet holding copies of the coordinates and attributes of the points
+        '''
+        nameCategories = sorted(set(pt._Name for pt in points))
+        codes = {name: i for i, name in enumerate(nameCategories)}
+
+        def column(attr):
+            return [int(float(getattr(pt, attr))) for pt in points]
+        return cls([(pt._x, pt._y, pt._z) for pt in points], [codes[pt._Name] for pt in points], nameCategories,
+                   column('_traceId'), column('_ptype'), column('_colorindex'), column('_colornum'),
+                   column('_rvalue'), column('_gvalue'), column('_bvalue'), coordinatePlane)
+
+    def __len__(self):
+        return len(self._xyz)
+
+    def xy(self):
+        '''
+        :return: (N,2) array of the coordinates of the points in the coordinate plane, x,y in map view
+        '''
+        return project_to_plane(self._xyz, self._coordinatePlane)
+
+    def name(self, i):
+        '''
+        :return: Name string of point i
+        '''
+        return self._nameCategories[self._names[i]]
+
+    def to_Point2_MVE_list(self, start=0, stop=None):
+        '''
+        Copies the points into a list of Point2_MVE objects
+        :param start, stop: copy only the points in the slice [start:stop]
+        :return: [ Point2_MVE(), Point2_MVE(), ... ]
+        '''
+        points = []
+        for i, (x, y, z) in enumerate(self._xyz[start:stop].tolist(), start):
+            pt = Point2_MVE(x, y)
+            pt._z = z
+            pt._Name = self.name(i)
+            pt._traceId = int(self._traceId[i])
+            pt._ptype = int(self._ptype[i])
+            pt._colorindex = int(self._colorindex[i])
+            pt._colornum = int(self._colornum[i])
+            pt._rvalue = int(self._rvalue[i])
+            pt._gvalue = int(self._gvalue[i])
+            pt._bvalue = int(self._bvalue[i])
+            points.append(pt)
+        return points
+
+    def iter_Point2_MVE_chunks(self, pointsPerChunk=65536):
+        '''
+        Yields the points as lists of up to pointsPerChunk Point2_MVE objects
+        :return: generator of [ Point2_MVE(), Point2_MVE(), ... ]
+        '''
+        for start in range(0, len(self), pointsPerChunk):
+            yield self.to_Point2_MVE_list(start, start + pointsPerChunk)
+
+    def subset(self, start=0, stop=None):
+        '''
+        :return: PointSet of the points in the slice [start:stop], sharing the columns of this one
+        '''
+        return PointSet(self._xyz[start:stop], self._names[start:stop], self._nameCategories,
+                        self._traceId[start:stop], self._ptype[start:stop], self._colorindex[start:stop],
+                        self._colornum[start:stop], self._rvalue[start:stop], self._gvalue[start:stop],
+                        self._bvalue[start:stop], self._coordinatePlane)
+
+    def iter_chunks(self, pointsPerChunk=65536):
+        '''
+        Yields the points as PointSets of up to pointsPerChunk points, e.g. to compute and write a large grid in parts
+        :return: generator of PointSet()
+        '''
+        for start in range(0, len(self), pointsPerChunk):
+            yield self.subset(start, start + pointsPerChunk)
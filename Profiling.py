@@ -0,0 +1,131 @@
+__author__ = 'ryshackleton'
+
+import json
+import time
+import contextlib
+
+'''
+Optional instrumentation of the analyses: wall time per pipeline phase and counts of the geometry primitives.
+The module level PROFILER is disabled by default. While disabled, phase() hands back one shared do-nothing context
+manager and count() returns after a single attribute test, and the geometry code only counts once per batch of
+queries or tests, never per element, so leaving the instrumentation in the hot paths costs next to nothing.
+Counters are only collected in the calling process, work done by ParallelTiles worker processes is not counted.
+'''
+
+# derived ratios of the report, (name, numerator counter, denominator counter)
+_RATIOS = (('circleCandidatesPerQuery', 'circleSegmentTests', 'circleQueries'),
+           ('pointCandidatesPerQuery', 'pointCandidates', 'pointQueries'),
+           ('lineCandidatesPerQuery', 'lineCandidates', 'lineQueries'),
+           ('intersectionsPerSegmentTest', 'intersections', 'segmentTests'))
+
+_NO_PHASE = contextlib.nullcontext()
+_END = object()
+
+
+class _Phase():
+    """Context manager adding its wall time to one phase of a Profiler"""
+
+    def __init__(self, profiler, name):
+        self._profiler = profiler
+        self._name = name
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        seconds, calls = self._profiler._phases.get(self._name, (0.0, 0))
+        self._profiler._phases[self._name] = (seconds + time.perf_counter() - self._start, calls + 1)
+        return False
+
+
+class Profiler():
+    """Accumulates phase wall times and primitive counters while enabled"""
+
+    def __init__(self):
+        self._enabled = False
+        self.reset()
+
+    def reset(self):
+        '''
+        Clears all of the recorded phases and counters
+        '''
+        self._phases = {}
+        self._counters = {}
+        self._start = time.perf_counter()
+
+    def enable(self, enabled=True):
+        '''
+        Turns the recording on (or off), the phases and counters recorded so far are cleared when turned on
+        '''
+        if enabled and not self._enabled:
+            self.reset()
+        self._enabled = bool(enabled)
+
+    def is_enabled(self):
+        return self._enabled
+
+    def phase(self, name):
+        '''
+        :return: context manager timing the code inside it as the named phase, phases of the same name add up
+        '''
+        if not self._enabled:
+            return _NO_PHASE
+        return _Phase(self, name)
+
+    def iterate(self, name, iterable):
+        '''
+        :return: the iterable, with the time spent getting each of its items added to the named phase when enabled
+        '''
+        if not self._enabled:
+            return iterable
+        return self._timed_items(name, iterable)
+
+    def _timed_items(self, name, iterable):
+        items = iter(iterable)
+        while True:
+            with self.phase(name):
+                item = next(items, _END)
+            if item is _END:
+                return
+            yield item
+
+    def count(self, name, n=1):
+        '''
+        Adds n to the named counter
+        '''
+        if self._enabled:
+            self._counters[name] = self._counters.get(name, 0) + int(n)
+
+    def report(self, **info):
+        '''
+        :param info: any other values to include in the report, e.g. the command line arguments
+        :return: dict of the total wall time, {phase: {'seconds', 'calls'}}, the counters and the derived ratios
+        '''
+        ratios = {}
+        for name, numerator, denominator in _RATIOS:
+            if self._counters.get(denominator, 0) > 0:
+                ratios[name] = self._counters.get(numerator, 0) / self._counters[denominator]
+        report = dict(info)
+        report.update({'totalSeconds': time.perf_counter() - self._start,
+                       'phases': {name: {'seconds': seconds, 'calls': calls}
+                                  for name, (seconds, calls) in self._phases.items()},
+                       'counters': dict(self._counters), 'ratios': ratios})
+        return report
+
+    def write_report(self, filename, **info):
+        '''
+        Writes the report as JSON
+        :param filename: name of the file to write, '-' writes to standard output
+        :param info: any other values to include in the report
+        :return: nothing
+        '''
+        text = json.dumps(self.report(**info), indent=2)
+        if filename == '-':
+            print(text)
+        else:
+            with open(filename, 'w') as f:
+                f.write(text + '\n')
+
+
+PROFILER = Profiler()
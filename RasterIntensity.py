@@ -0,0 +1,238 @@
+__author__ = 'ryshackleton'
+
+import math
+import numpy as np
+from Point import Point2
+from TraceSet import TraceSet
+from CircularScanlines import parse_radii
+
+'''
+Approximate fracture length/area (p21) maps by rasterizing the traces and convolving with a disk.
+Trace length is deposited onto a fine grid of cells, then one FFT convolution with a disk kernel per radius gives
+the trace length inside a circle centered at every cell at once. The convolution is done tile by tile (overlap-add),
+so the FFTs stay small however large the raster is. P21 at arbitrary points is interpolated from the cell centers.
+The error shrinks with the cell size, see error_report() for checking it against the exact clipping.
+'''
+
+# default number of cells across the smallest radius
+DEFAULT_CELLS_PER_RADIUS = 10
+# default limit on the bytes of the rasters kept in memory, one for the trace lengths and one per radius
+DEFAULT_MAX_RASTER_BYTES = 2 * 1024 * 1024 * 1024
+# number of trace pieces deposited per batch, limits the memory used while rasterizing
+_MAX_PIECES = 1 << 22
+# width of the FFTs convolving one tile of the raster, tiles are this wide less the kernel width
+_FFT_SIZE = 1024
+
+
+def rasterize_segments(segs, origin, cellSize, shape):
+    '''
+    Deposits the length of straight segments onto a grid of cells
+    Each segment is cut into pieces no longer than half a cell, and the length of every piece is shared between the
+    four cell centers around its midpoint in proportion to its distance from each (cloud in cell weighting)
+    :param segs: (S,4) array of segments x0,y0,x1,y1
+    :param origin: (x, y) of the center of cell [0,0]
+    :param cellSize: width of the square cells
+    :param shape: (ny, nx) number of cells, the segments must lie at least one cell inside the grid
+    :return: (ny,nx) array of the segment length deposited in each cell
+    '''
+    ny, nx = shape
+    raster = np.zeros(ny * nx)
+    if len(segs) == 0:
+        return raster.reshape(shape)
+    segLen = np.hypot(segs[:, 2] - segs[:, 0], segs[:, 3] - segs[:, 1])
+    numPieces = np.maximum(np.ceil(segLen / (0.5 * cellSize)).astype(np.int64), 1)
+    cumPieces = np.cumsum(numPieces)
+
+    start = 0
+    while start < len(segs):
+        stop = max(int(np.searchsorted(cumPieces, cumPieces[start] - numPieces[start] + _MAX_PIECES, side='right')),
+                   start + 1)
+        n = numPieces[start:stop]
+        s = np.repeat(np.arange(start, stop), n)
+        k = np.arange(n.sum()) - np.repeat(np.cumsum(n) - n, n)
+        t = (k + 0.5) / n[s - start]
+        fx = (segs[s, 0] + t * (segs[s, 2] - segs[s, 0]) - origin[0]) / cellSize
+        fy = (segs[s, 1] + t * (segs[s, 3] - segs[s, 1]) - origin[1]) / cellSize
+        pieceLen = segLen[s] / n[s - start]
+        ix = np.floor(fx).astype(np.int64)
+        iy = np.floor(fy).astype(np.int64)
+        wx = fx - ix
+        wy = fy - iy
+        # the four corners of all pieces are deposited in one go, without a temporary the size of the raster
+        cell = iy * nx + ix
+        np.add.at(raster, np.concatenate((cell, cell + 1, cell + nx, cell + nx + 1)),
+                  np.concatenate((pieceLen * (1 - wx) * (1 - wy), pieceLen * wx * (1 - wy),
+                                  pieceLen * (1 - wx) * wy, pieceLen * wx * wy)))
+        start = stop
+    return raster.reshape(shape)
+
+
+def disk_kernel(radius, cellSize, halfWidth, supersample=8):
+    '''
+    Fraction of each cell that lies inside a disk centered on the middle cell
+    :param radius: radius of the disk
+    :param cellSize: width of the square cells
+    :param halfWidth: the kernel has 2*halfWidth+1 cells on each side
+    :param supersample: each cell is sampled at supersample x supersample points
+    :return: (2*halfWidth+1, 2*halfWidth+1) array of fractions between 0 and 1
+    '''
+    sub = (np.arange(supersample) + 0.5) / supersample - 0.5
+    offsets = np.arange(-halfWidth, halfWidth + 1)
+    x = ((offsets[:, None] + sub[None, :]) * cellSize).ravel()
+    inside = (x[:, None]**2 + x[None, :]**2) < radius * radius
+    n = 2 * halfWidth + 1
+    return inside.reshape(n, supersample, n, supersample).mean(axis=(1, 3))
+
+
+def convolve_tiles(raster, kernels, fftSize=_FFT_SIZE):
+    '''
+    Convolves a raster with several kernels by overlap-add: each tile of the raster is convolved through zero padded
+    FFTs of at most fftSize cells a side and the results, which spill one kernel half width past the tile, are added up
+    Tiles holding no trace length are skipped
+    :param raster: (ny,nx) array
+    :param kernels: list of (n,n) arrays, n odd and the same for all kernels
+    :param fftSize: width of the FFTs
+    :return: list of (ny,nx) arrays, the convolution of the raster with each kernel centered on each cell
+    '''
+    ny, nx = raster.shape
+    n = kernels[0].shape[0]
+    halfWidth = n // 2
+    tileSize = max(fftSize - n + 1, n)
+    fftShape = (min(tileSize, ny) + n - 1, min(tileSize, nx) + n - 1)
+    # the transform of each kernel is shared by all tiles, and the transform of each tile by all kernels
+    kernelFFTs = [np.fft.rfft2(k, fftShape) for k in kernels]
+    results = [np.zeros((ny, nx)) for k in kernels]
+    for y0 in range(0, ny, tileSize):
+        for x0 in range(0, nx, tileSize):
+            tile = raster[y0:y0 + tileSize, x0:x0 + tileSize]
+            if not tile.any():
+                continue
+            tileFFT = np.fft.rfft2(tile, fftShape)
+            # cell [i,j] of the full convolution of the tile lands on cell [y0+i-halfWidth, x0+j-halfWidth]
+            i0 = max(halfWidth - y0, 0)
+            j0 = max(halfWidth - x0, 0)
+            i1 = min(tile.shape[0] + n - 1, ny - y0 + halfWidth)
+            j1 = min(tile.shape[1] + n - 1, nx - x0 + halfWidth)
+            for kernelFFT, result in zip(kernelFFTs, results):
+                full = np.fft.irfft2(tileFFT * kernelFFT, fftShape)
+                result[y0 + i0 - halfWidth:y0 + i1 - halfWidth, x0 + j0 - halfWidth:x0 + j1 - halfWidth] += \
+                    full[i0:i1, j0:j1]
+    return results
+
+
+class RasterIntensity():
+    """Rasterized trace lengths convolved with disks, approximate p21 for several radii anywhere on the map"""
+
+    def __init__(self, traces, radii, cellSize=None, maxBytes=DEFAULT_MAX_RASTER_BYTES):
+        """
+        Rasterizes the traces and convolves them with a disk of each radius
+        :param traces: TraceSet or list of FracTrace() objects
+        :param radii: radius, or list of radii, of the circular scanlines
+        :param cellSize: width of the raster cells, defaults to the smallest radius / DEFAULT_CELLS_PER_RADIUS
+        :param maxBytes: limit on the memory of the rasters, a ValueError is raised if the traces need more
+        """
+        if not isinstance(traces, TraceSet):
+            traces = TraceSet.from_FracTraces(traces)
+        self._radii = parse_radii(radii)
+        if len(self._radii) == 0 or not min(self._radii) > 0.0:
+            raise ZeroDivisionError('Circle radius must be non-zero')
+        if cellSize is None:
+            cellSize = min(self._radii) / DEFAULT_CELLS_PER_RADIUS
+        if not cellSize > 0.0:
+            raise ValueError("RasterIntensity cell size must be greater than zero")
+        self._cellSize = float(cellSize)
+
+        segs = traces.segments()[0]
+        halfWidth = int(math.ceil(max(self._radii) / self._cellSize)) + 1
+        if len(segs) == 0:
+            self._origin = (0.0, 0.0)
+            self._p21 = [np.zeros((1, 1)) for r in self._radii]
+            return
+        # the raster reaches one kernel half width past the traces, so circles centered outside it hold no trace
+        margin = (halfWidth + 1) * self._cellSize
+        xmin = float(min(segs[:, 0].min(), segs[:, 2].min())) - margin
+        ymin = float(min(segs[:, 1].min(), segs[:, 3].min())) - margin
+        xmax = float(max(segs[:, 0].max(), segs[:, 2].max())) + margin
+        ymax = float(max(segs[:, 1].max(), segs[:, 3].max())) + margin
+        self._origin = (xmin, ymin)
+        shape = (int(math.ceil((ymax - ymin) / self._cellSize)) + 1,
+                 int(math.ceil((xmax - xmin) / self._cellSize)) + 1)
+        rasterBytes = (len(self._radii) + 1) * shape[0] * shape[1] * 8
+        if rasterBytes > maxBytes:
+            raise ValueError("RasterIntensity needs {} rasters of {} x {} cells ({:.1f} GiB), more than the limit of "
+                             "{:.1f} GiB, use a larger cell size".format(len(self._radii) + 1, shape[1], shape[0],
+                                                                         rasterBytes / 2.0**30, maxBytes / 2.0**30))
+        lengths = rasterize_segments(segs, self._origin, self._cellSize, shape)
+
+        # FFT round off leaves tiny non-zero lengths where there are no traces
+        roundOff = 1e-12 * lengths.sum()
+        kernels = [disk_kernel(r, self._cellSize, halfWidth) for r in self._radii]
+        self._p21 = []
+        for r, inside in zip(self._radii, convolve_tiles(lengths, kernels)):
+            inside[inside <= roundOff] = 0.0
+            inside /= math.pi * r * r
+            self._p21.append(inside)
+
+    def p21_at(self, grid_xy):
+        '''
+        Interpolates p21 at any points from the values at the cell centers
+        :param grid_xy: (G,2) array of circle centers
+        :return: (G,R) array of approximate p21 values, one column per radius
+        '''
+        grid_xy = np.asarray(grid_xy, dtype=np.float64).reshape(-1, 2)
+        fx = (grid_xy[:, 0] - self._origin[0]) / self._cellSize
+        fy = (grid_xy[:, 1] - self._origin[1]) / self._cellSize
+        ix = np.floor(fx).astype(np.int64)
+        iy = np.floor(fy).astype(np.int64)
+        ny, nx = self._p21[0].shape
+        # points outside the raster are too far from every trace to have any p21
+        inside = (ix >= 0) & (ix < nx - 1) & (iy >= 0) & (iy < ny - 1)
+        ix = np.where(inside, ix, 0)
+        iy = np.where(inside, iy, 0)
+        wx = fx - ix
+        wy = fy - iy
+        values = np.zeros((len(grid_xy), len(self._radii)))
+        for ri, p21 in enumerate(self._p21):
+            if nx < 2 or ny < 2:
+                continue
+            v = p21[iy, ix] * (1 - wx) * (1 - wy) + p21[iy, ix + 1] * wx * (1 - wy) + \
+                p21[iy + 1, ix] * (1 - wx) * wy + p21[iy + 1, ix + 1] * wx * wy
+            values[:, ri] = np.where(inside, v, 0.0)
+        return values
+
+
+def exact_p21_at(grid_xy, radius, traces):
+    '''
+    Computes p21 at a few points with FracTrace.trace_length_inside_circular_scanline() for checking approximations
+    :param grid_xy: (G,2) array of circle centers
+    :param radius: radius of the circular scanlines
+    :param traces: TraceSet of fracture traces
+    :return: (G) array of p21 values
+    '''
+    grid_xy = np.asarray(grid_xy, dtype=np.float64).reshape(-1, 2)
+    segmentIndex = traces.segment_index()
+    segmentTrace = traces.segments()[1]
+    p21 = np.zeros(len(grid_xy))
+    for i, (x, y) in enumerate(grid_xy.tolist()):
+        center = Point2(x, y)
+        for ti in np.unique(segmentTrace[segmentIndex.query_circle(x, y, radius)]).tolist():
+            p21[i] += traces[ti].trace_length_inside_circular_scanline(None, center, radius)
+        p21[i] /= math.pi * radius * radius
+    return p21
+
+
+def error_report(approx, exact):
+    '''
+    Summarizes the error of approximate p21 values
+    :param approx: (N) array of approximate values
+    :param exact: (N) array of exact values at the same points
+    :return: dict of the number of samples, the maximum, mean and root mean square absolute errors,
+             and the mean exact value for scale
+    '''
+    approx = np.asarray(approx, dtype=np.float64)
+    exact = np.asarray(exact, dtype=np.float64)
+    err = np.abs(approx - exact)
+    if len(err) == 0:
+        return {'samples': 0, 'maxAbsError': 0.0, 'meanAbsError': 0.0, 'rmsError': 0.0, 'meanExact': 0.0}
+    return {'samples': int(len(err)), 'maxAbsError': float(err.max()), 'meanAbsError': float(err.mean()),
+            'rmsError': float(np.sqrt(np.mean(err * err))), 'meanExact': float(exact.mean())}
@@ -0,0 +1,236 @@
+__author__ = 'ryshackleton'
+
+import os
+import numpy as np
+from PointSet import PointSet
+
+'''
+Writers for the results of the analyses, whole columns at a time.
+'tsv' is a tab separated text file with the MVE export header, so grid results can be read back by MVE_importer or
+loaded into Move like the grid itself, 'npy' is one (N,C) float64 array, 'npz' holds every column as a named array,
+and 'raster' (grid results only) is an .npz of one 2d array per result column plus the origin and spacing of the
+grid, for grids whose points lie on a regular lattice.
+Text values are formatted exactly like str() of the python number, columns with few distinct values (grid
+coordinates, attributes) format each distinct value once.
+'''
+
+FORMATS = ('tsv', 'npy', 'npz', 'raster')
+# attribute columns of an MVE export, in the order written before the result columns
+MVE_COLUMNS = ('x', 'y', 'z', 'Name', 'Id', 'PType', 'Colour Num', 'Colour Id',
+               'Colour (red)', 'Colour (green)', 'Colour (blue)')
+_EXTENSIONS = {'.npy': 'npy', '.npz': 'npz'}
+# largest ratio of the number of lattice nodes to the number of points for the points to count as a regular grid
+MAX_EMPTY_NODES_RATIO = 4
+
+
+def output_format(filename, format=None):
+    '''
+    :param filename: name of the output file
+    :param format: one of FORMATS, or None to choose from the file extension ('.npy', '.npz', anything else is 'tsv')
+    :return: the format to write
+    '''
+    if format is None:
+        return _EXTENSIONS.get(os.path.splitext(filename)[1].lower(), 'tsv')
+    if format not in FORMATS:
+        raise ValueError("Unknown output format '{}', expected one of {}".format(format, FORMATS))
+    return format
+
+
+def format_column(values):
+    '''
+    Formats a column of values as strings, like str() of each value
+    :param values: (N) array or list of numbers or strings
+    :return: list of N strings
+    '''
+    values = np.asarray(values)
+    if values.dtype.kind not in 'biuf' or len(values) == 0:
+        return [str(v) for v in values.tolist()]
+    # distinct values are found on the bit patterns so -0.0 and 0.0 or different nans are told apart
+    bits = values.view('u{}'.format(values.dtype.itemsize)) if values.dtype.kind == 'f' else values
+    unique, first, inverse = np.unique(bits, return_index=True, return_inverse=True)
+    if len(unique) > len(values) // 2:
+        return list(map(str, values.tolist()))
+    text = np.array(list(map(str, values[first].tolist())), dtype=object)
+    return text[inverse.ravel()].tolist()
+
+
+def write_tsv_rows(f, columns):
+    '''
+    Writes rows of tab separated values
+    :param f: open text file
+    :param columns: list of (N) arrays or lists of strings or numbers, one per column
+    :return: nothing
+    '''
+    if len(columns) == 0 or len(columns[0]) == 0:
+        return
+    text = [c if isinstance(c, list) and isinstance(c[0], str) else format_column(c) for c in columns]
+    f.write('\n'.join(map('\t'.join, zip(*text))))
+    f.write('\n')
+
+
+def regular_grid(xy, tolerance=1e-06):
+    '''
+    Finds the regular lattice a set of points lies on
+    :param xy: (N,2) array of points
+    :param tolerance: largest difference relative to the spacing between a point and its lattice node
+    :return: tuple (origin, spacing, shape, ix, iy) of the lower left node (x0,y0), spacing (dx,dy) and
+             (rows, columns) of the lattice and the (N) column and row of each point, or None if the points are not
+             on a regular lattice, leave too many of its nodes empty or two points share a node
+    '''
+    xy = np.asarray(xy, dtype=np.float64).reshape(-1, 2)
+    if len(xy) == 0:
+        return None
+    origin = xy.min(axis=0)
+    spacing = np.zeros(2)
+    index = np.zeros((2, len(xy)), dtype=np.int64)
+    for k in range(2):
+        steps = np.diff(np.unique(xy[:, k]))
+        # coordinates a rounding error apart are the same lattice line
+        steps = steps[steps > tolerance * steps.max()] if len(steps) > 0 else steps
+        if len(steps) == 0:
+            continue
+        spacing[k] = steps.min()
+        index[k] = np.rint((xy[:, k] - origin[k]) / spacing[k]).astype(np.int64)
+        if np.abs(origin[k] + index[k] * spacing[k] - xy[:, k]).max() > tolerance * spacing[k]:
+            return None
+    shape = (int(index[1].max()) + 1, int(index[0].max()) + 1)
+    # scattered points can sit on a fine lattice of their rounding, a grid leaves few of its nodes empty
+    if shape[0] * shape[1] > MAX_EMPTY_NODES_RATIO * len(xy):
+        return None
+    if len(np.unique(index[1] * shape[1] + index[0])) != len(xy):
+        return None
+    return origin, spacing, shape, index[0], index[1]
+
+
+class GridResultWriter():
+    """Writes grid points (PointSet chunks) with their result columns, in order, to one of the FORMATS.
+    'tsv' is written as the chunks come, the other formats are collected and written by close()."""
+
+    def __init__(self, filename, resultNames, format=None):
+        """
+        Opens a result file
+        :param filename: name of the output file
+        :param resultNames: list of the names of the result columns
+        :param format: one of FORMATS, None chooses from the file extension (see output_format())
+        """
+        self._filename = filename
+        self._resultNames = list(resultNames)
+        self._format = output_format(filename, format)
+        self._chunks = []
+        self._file = None
+        if self._format == 'tsv':
+            self._file = open(filename, 'w')
+            self._file.write('\t'.join(MVE_COLUMNS + tuple(self._resultNames)) + '\n')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+    def write(self, points, results):
+        '''
+        Writes the next chunk of grid points
+        :param points: PointSet of the grid points
+        :param results: (N,R) array of the results of each point, or list of R (N) arrays (the columns can be of
+                        different types), one column per result name
+        :return: nothing
+        '''
+        if isinstance(results, np.ndarray):
+            results = np.asarray(results).reshape(len(points), len(self._resultNames))
+            results = [results[:, r] for r in range(len(self._resultNames))]
+        if len(results) != len(self._resultNames):
+            raise ValueError("Expected {} result columns, got {}".format(len(self._resultNames), len(results)))
+        if self._file is None:
+            self._chunks.append((points, results))
+            return
+        names = np.array(points._nameCategories + [''], dtype=object)[points._names].tolist()
+        columns = [points._xyz[:, 0], points._xyz[:, 1], points._xyz[:, 2], names, points._traceId, points._ptype,
+                   points._colornum, points._colorindex, points._rvalue, points._gvalue, points._bvalue]
+        write_tsv_rows(self._file, columns + list(results))
+
+    def _columns(self):
+        '''
+        :return: dict of name: array of every column of the points written so far
+        '''
+        def joined(get):
+            return np.concatenate([get(points, results) for points, results in self._chunks])
+        columns = {'x': joined(lambda p, r: p._xyz[:, 0]), 'y': joined(lambda p, r: p._xyz[:, 1]),
+                   'z': joined(lambda p, r: p._xyz[:, 2]),
+                   'Name': joined(lambda p, r: np.array(p._nameCategories + [''], dtype=str)[p._names])}
+        for name, attr in zip(MVE_COLUMNS[4:], ('_traceId', '_ptype', '_colornum', '_colorindex',
+                                                '_rvalue', '_gvalue', '_bvalue')):
+            columns[name] = joined(lambda p, r: getattr(p, attr))
+        for k, name in enumerate(self._resultNames):
+            columns[name] = joined(lambda p, r: r[k])
+        return columns
+
+    def close(self):
+        '''
+        Finishes the file, writing the collected points unless the format is 'tsv'
+        :return: nothing
+        '''
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+            return
+        if self._chunks is None:
+            return
+        if len(self._chunks) == 0:
+            self._chunks.append((PointSet(np.zeros((0, 3))), [np.zeros(0)] * len(self._resultNames)))
+        columns = self._columns()
+        # raster rows and columns follow the points' coordinates in their coordinate plane
+        xy = np.concatenate([points.xy() for points, results in self._chunks])
+        self._chunks = None
+        with open(self._filename, 'wb') as f:
+            if self._format == 'npy':
+                np.save(f, np.column_stack([columns[c] for c in ('x', 'y', 'z')] +
+                                           [columns[c].astype(np.float64) for c in self._resultNames]))
+            elif self._format == 'npz':
+                np.savez(f, **columns)
+            else:
+                np.savez(f, **raster_layout(xy, {name: columns[name] for name in self._resultNames}))
+
+
+def raster_layout(xy, columns):
+    '''
+    Lays out columns of values at the points of a regular grid as 2d arrays
+    :param xy: (N,2) array of the grid points
+    :param columns: dict of name: (N) array of values
+    :return: dict of 'origin' (x0,y0) of the lower left point, 'spacing' (dx,dy), 'columns' (the names) and, for
+             each name, a (rows, columns) float64 array whose row i, column j holds the value at x0+j*dx, y0+i*dy
+             (nan where the grid has no point)
+    '''
+    grid = regular_grid(xy)
+    if grid is None:
+        raise ValueError("The grid points are not on a regular lattice, they cannot be written as a raster")
+    origin, spacing, shape, ix, iy = grid
+    layout = {'origin': origin, 'spacing': spacing, 'columns': np.array(list(columns), dtype=str)}
+    for name, values in columns.items():
+        raster = np.full(shape, np.nan)
+        raster[iy, ix] = values
+        layout[name] = raster
+    return layout
+
+
+def write_table(filename, columns, format=None):
+    '''
+    Writes a table of named columns
+    :param filename: name of the output file
+    :param columns: dict of name: (N) array or list of values, all of the same length
+    :param format: 'tsv', 'npy' (numeric columns only) or 'npz', None chooses from the file extension
+    :return: nothing
+    '''
+    format = output_format(filename, format)
+    if format == 'tsv':
+        with open(filename, 'w') as f:
+            f.write('\t'.join(columns) + '\n')
+            write_tsv_rows(f, list(columns.values()))
+    elif format == 'npy':
+        np.save(filename, np.column_stack([np.asarray(c, dtype=np.float64) for c in columns.values()]))
+    elif format == 'npz':
+        with open(filename, 'wb') as f:
+            np.savez(f, **{name: np.asarray(c) for name, c in columns.items()})
+    else:
+        raise ValueError("Only grid results can be written as a raster")
@@ -0,0 +1,494 @@
+__author__ = 'ryshackleton'
+
+import math
+import numpy as np
+from VectorGeometry import distances_to_segments
+from Profiling import PROFILER
+
+# number of consecutive segments bounded by each leaf of a SegmentBVH
+BVH_LEAF_SIZE = 8
+
+
+class SegmentIndex():
+    """Uniform grid spatial index over straight segments.
+    Each grid cell lists the segments whose bounding box overlaps it, stored as one sorted array plus cell offsets."""
+
+    def __init__(self, segs, cellSize=None):
+        """
+        Builds the index
+        :param segs: (S,4) array of x0,y0,x1,y1 segments
+        :param cellSize: width of the square grid cells, defaults to the mean segment extent
+                         (or the mean point spacing if that is larger)
+        """
+        self._segs = np.ascontiguousarray(segs, dtype=np.float64).reshape(-1, 4)
+        self._xmin = np.minimum(self._segs[:, 0], self._segs[:, 2])
+        self._xmax = np.maximum(self._segs[:, 0], self._segs[:, 2])
+        self._ymin = np.minimum(self._segs[:, 1], self._segs[:, 3])
+        self._ymax = np.maximum(self._segs[:, 1], self._segs[:, 3])
+
+        numSegs = len(self._segs)
+        if numSegs == 0:
+            self._origin = (0.0, 0.0)
+            self._cellSize = 1.0 if cellSize is None else float(cellSize)
+            self._ncx = self._ncy = 1
+            self._cellStart = np.zeros(2, dtype=np.int64)
+            self._cellSegs = np.zeros(0, dtype=np.int64)
+            return
+
+        self._origin = (float(self._xmin.min()), float(self._ymin.min()))
+        width = float(self._xmax.max()) - self._origin[0]
+        height = float(self._ymax.max()) - self._origin[1]
+        if cellSize is None:
+            meanExtent = float(np.maximum(self._xmax - self._xmin, self._ymax - self._ymin).mean())
+            cellSize = max(meanExtent, math.sqrt(width * height / numSegs))
+        if not cellSize > 0.0:
+            cellSize = max(width, height, 1.0)
+        self._cellSize = float(cellSize)
+        self._ncx = int(width // self._cellSize) + 1
+        self._ncy = int(height // self._cellSize) + 1
+
+        # every segment is listed in every cell that its bounding box touches
+        ix0, iy0 = self._cell_coords(self._xmin, self._ymin)
+        ix1, iy1 = self._cell_coords(self._xmax, self._ymax)
+        nx = ix1 - ix0 + 1
+        counts = nx * (iy1 - iy0 + 1)
+        seg = np.repeat(np.arange(numSegs), counts)
+        local = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        cells = (iy0[seg] + local // nx[seg]) * self._ncx + ix0[seg] + local % nx[seg]
+        order = np.argsort(cells, kind='stable')
+        self._cellSegs = seg[order]
+        self._cellStart = np.concatenate(([0], np.cumsum(np.bincount(cells, minlength=self._ncx * self._ncy))))
+
+    @classmethod
+    def from_points(cls, xy, cellSize=None):
+        '''
+        Builds an index over points, each point is stored as a zero length segment
+        :param xy: (N,2) array of points
+        :param cellSize: width of the square grid cells
+        :return: SegmentIndex where segment i is point i
+        '''
+        xy = np.asarray(xy, dtype=np.float64).reshape(-1, 2)
+        return cls(np.hstack((xy, xy)), cellSize)
+
+    def __len__(self):
+        return len(self._segs)
+
+    def _cell_coords(self, x, y):
+        ix = np.clip(np.floor((np.asarray(x) - self._origin[0]) / self._cellSize), 0, self._ncx - 1).astype(np.int64)
+        iy = np.clip(np.floor((np.asarray(y) - self._origin[1]) / self._cellSize), 0, self._ncy - 1).astype(np.int64)
+        return ix, iy
+
+    def query_bbox(self, xmin, ymin, xmax, ymax):
+        '''
+        Finds the segments whose bounding boxes overlap a box
+        :return: sorted array of segment indices
+        '''
+        if len(self._segs) == 0:
+            return np.zeros(0, dtype=np.int64)
+        ix0, iy0 = self._cell_coords(xmin, ymin)
+        ix1, iy1 = self._cell_coords(xmax, ymax)
+        cells = (np.arange(iy0, iy1 + 1)[:, None] * self._ncx + np.arange(ix0, ix1 + 1)[None, :]).ravel()
+        starts = self._cellStart[cells]
+        counts = self._cellStart[cells + 1] - starts
+        pos = np.repeat(starts - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())
+        found = np.unique(self._cellSegs[pos])
+        keep = (self._xmin[found] <= xmax) & (self._xmax[found] >= xmin) & \
+               (self._ymin[found] <= ymax) & (self._ymax[found] >= ymin)
+        return found[keep]
+
+    def query_circle(self, cx, cy, radius):
+        '''
+        Finds the segments that lie within or intersect a circle
+        :param cx: X coordinate of the center of the circle
+        :param cy: Y coordinate of the center of the circle
+        :param radius: Radius of the circle
+        :return: sorted array of the indices of segments whose minimum distance to the center is <= radius
+        '''
+        found = self.query_bbox(cx - radius, cy - radius, cx + radius, cy + radius)
+        PROFILER.count('circleQueries')
+        PROFILER.count('circleSegmentTests', len(found))
+        return found[distances_to_segments(self._segs[found], cx, cy) <= radius]
+
+    def query_lines(self, lines):
+        '''
+        Finds the segments in every grid cell crossed by each of a batch of lines
+        Each line is clipped to the grid, then the cells it passes through are found from the parameters at which it
+        crosses the grid lines, all lines at once
+        :param lines: (L,4) array of line segments x0,y0,x1,y1
+        :return: tuple (lineIndices, segmentIndices) of arrays listing each (line, candidate segment) pair once,
+                 sorted by line and then segment
+        '''
+        lines = np.asarray(lines, dtype=np.float64).reshape(-1, 4)
+        if len(self._segs) == 0 or len(lines) == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        # line coordinates in units of cells
+        fx0 = (lines[:, 0] - self._origin[0]) / self._cellSize
+        fy0 = (lines[:, 1] - self._origin[1]) / self._cellSize
+        dx = (lines[:, 2] - self._origin[0]) / self._cellSize - fx0
+        dy = (lines[:, 3] - self._origin[1]) / self._cellSize - fy0
+
+        # clip each line to the grid (Liang-Barsky), giving the parameter range [t0, t1] inside it
+        t0 = np.zeros(len(lines))
+        t1 = np.ones(len(lines))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            for f, d, n in ((fx0, dx, self._ncx), (fy0, dy, self._ncy)):
+                ta = np.where(d != 0.0, (0.0 - f) / d, -np.inf)
+                tb = np.where(d != 0.0, (n - f) / d, np.inf)
+                outside = (d == 0.0) & ((f < 0.0) | (f > n))
+                t0 = np.maximum(t0, np.minimum(ta, tb))
+                t1 = np.where(outside, -1.0, np.minimum(t1, np.maximum(ta, tb)))
+        inside = np.nonzero(t0 <= t1)[0]
+
+        # parameters where each line crosses the vertical and horizontal grid lines
+        lineParts = [inside, inside]
+        params = [t0[inside], t1[inside]]
+        for f, d in ((fx0, dx), (fy0, dy)):
+            a = f[inside] + t0[inside] * d[inside]
+            b = f[inside] + t1[inside] * d[inside]
+            first = np.floor(np.minimum(a, b)).astype(np.int64) + 1
+            count = np.maximum(np.ceil(np.maximum(a, b)).astype(np.int64) - first, 0)
+            line = np.repeat(inside, count)
+            k = np.repeat(first, count) + np.arange(count.sum()) - np.repeat(np.cumsum(count) - count, count)
+            lineParts.append(line)
+            params.append((k - f[line]) / d[line])
+        line = np.concatenate(lineParts)
+        t = np.concatenate(params)
+        order = np.lexsort((t, line))
+        line = line[order]
+        t = t[order]
+
+        # the cell of each piece between consecutive crossings is the cell of the middle of the piece
+        same = line[1:] == line[:-1]
+        line = line[:-1][same]
+        tm = 0.5 * (t[:-1][same] + t[1:][same])
+        ix = np.clip(np.floor(fx0[line] + tm * dx[line]).astype(np.int64), 0, self._ncx - 1)
+        iy = np.clip(np.floor(fy0[line] + tm * dy[line]).astype(np.int64), 0, self._ncy - 1)
+        cells = iy * self._ncx + ix
+
+        starts = self._cellStart[cells]
+        counts = self._cellStart[cells + 1] - starts
+        pairLines = np.repeat(line, counts)
+        pairSegs = self._cellSegs[np.repeat(starts - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())]
+        pairs = np.unique(pairLines * len(self._segs) + pairSegs)
+        PROFILER.count('lineQueries', len(lines))
+        PROFILER.count('lineCandidates', len(pairs))
+        return pairs // len(self._segs), pairs % len(self._segs)
+
+    def query_knn(self, x, y, k):
+        '''
+        Finds the k segments nearest to a point
+        :param x: X coordinate of the point
+        :param y: Y coordinate of the point
+        :param k: number of segments to return
+        :return: tuple (indices, distances) of the k nearest segments, nearest first
+        '''
+        k = min(k, len(self._segs))
+        if k <= 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0)
+        # grow the search circle until it holds k segments, everything closer is then inside it
+        radius = self._cellSize
+        maxRadius = math.hypot(self._ncx, self._ncy) * self._cellSize + \
+            math.hypot(x - self._origin[0], y - self._origin[1])
+        while True:
+            found = self.query_bbox(x - radius, y - radius, x + radius, y + radius)
+            dist = distances_to_segments(self._segs[found], x, y)
+            inside = dist <= radius
+            if inside.sum() >= k or radius > maxRadius:
+                found = found[inside]
+                dist = dist[inside]
+                break
+            radius *= 2.0
+        order = np.argsort(dist, kind='stable')[:k]
+        return found[order], dist[order]
+
+
+class SegmentBVH():
+    """Bounding volume hierarchy over the segments of one polyline, e.g. a single long fracture trace.
+    Leaves bound runs of leafSize consecutive segments, which lie close together along a trace, and every node above
+    bounds two consecutive nodes of the level below, so node n has children 2n and 2n+1 on the next level.
+    _levels[0] holds the root and _levels[-1] the leaves, each an (N,4) array of xmin,ymin,xmax,ymax rows."""
+
+    def __init__(self, segs, leafSize=BVH_LEAF_SIZE):
+        """
+        Builds the hierarchy
+        :param segs: (S,4) array of x0,y0,x1,y1 segments
+        :param leafSize: number of consecutive segments bounded by each leaf
+        """
+        self._segs = np.ascontiguousarray(segs, dtype=np.float64).reshape(-1, 4)
+        self._leafSize = max(int(leafSize), 1)
+        self._boxes = np.column_stack((np.minimum(self._segs[:, 0], self._segs[:, 2]),
+                                       np.minimum(self._segs[:, 1], self._segs[:, 3]),
+                                       np.maximum(self._segs[:, 0], self._segs[:, 2]),
+                                       np.maximum(self._segs[:, 1], self._segs[:, 3])))
+        self._levels = []
+        if len(self._segs) == 0:
+            return
+        boxes = self._boxes
+        step = self._leafSize
+        while True:
+            starts = np.arange(0, len(boxes), step)
+            boxes = np.column_stack((np.minimum.reduceat(boxes[:, 0], starts), np.minimum.reduceat(boxes[:, 1], starts),
+                                     np.maximum.reduceat(boxes[:, 2], starts), np.maximum.reduceat(boxes[:, 3], starts)))
+            self._levels.insert(0, boxes)
+            if len(boxes) == 1:
+                break
+            step = 2
+
+    def __len__(self):
+        return len(self._segs)
+
+    def bbox(self):
+        '''
+        :return: (xmin, ymin, xmax, ymax) of all of the segments, None if there are none
+        '''
+        if len(self._levels) == 0:
+            return None
+        return tuple(self._levels[0][0].tolist())
+
+    def _children(self, level, nodes):
+        children = np.stack((2 * nodes, 2 * nodes + 1), axis=1).ravel()
+        return children[children < len(self._levels[level + 1])]
+
+    def _leaf_segments(self, leaves):
+        '''
+        :return: tuple (segments, leaf) of the segments of each of the leaves, in order, and the position in leaves of
+                 the leaf of each segment
+        '''
+        starts = leaves * self._leafSize
+        counts = np.minimum(starts + self._leafSize, len(self._segs)) - starts
+        leaf = np.repeat(np.arange(len(leaves)), counts)
+        return np.repeat(starts - np.cumsum(counts) + counts, counts) + np.arange(counts.sum()), leaf
+
+    def query_bbox(self, xmin, ymin, xmax, ymax):
+        '''
+        Finds the segments whose bounding boxes overlap a box
+        :return: sorted array of the indices of the segments
+        '''
+        if len(self._levels) == 0:
+            return np.zeros(0, dtype=np.int64)
+        nodes = np.arange(len(self._levels[0]))
+        for level, boxes in enumerate(self._levels):
+            if level > 0:
+                nodes = self._children(level - 1, nodes)
+            b = boxes[nodes]
+            nodes = nodes[(b[:, 0] <= xmax) & (b[:, 2] >= xmin) & (b[:, 1] <= ymax) & (b[:, 3] >= ymin)]
+        found = self._leaf_segments(nodes)[0]
+        b = self._boxes[found]
+        return found[(b[:, 0] <= xmax) & (b[:, 2] >= xmin) & (b[:, 1] <= ymax) & (b[:, 3] >= ymin)]
+
+    def candidate_pairs(self, other, tol=0.0):
+        '''
+        Finds the pairs of a segment of this hierarchy and a segment of another whose bounding boxes lie within a
+        distance tolerance of one another, by descending both hierarchies together
+        :param other: SegmentBVH of the other segments
+        :param tol: boxes closer than tol count as overlapping
+        :return: tuple (i, j) of arrays of the segment of this and of the other hierarchy of each pair,
+                 sorted by i and then j
+        '''
+        if len(self._levels) == 0 or len(other._levels) == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+
+        def overlapping(boxA, boxB):
+            return (boxA[:, 0] <= boxB[:, 2] + tol) & (boxA[:, 2] + tol >= boxB[:, 0]) & \
+                   (boxA[:, 1] <= boxB[:, 3] + tol) & (boxA[:, 3] + tol >= boxB[:, 1])
+
+        la = lb = 0
+        a = np.repeat(np.arange(len(self._levels[0])), len(other._levels[0]))
+        b = np.tile(np.arange(len(other._levels[0])), len(self._levels[0]))
+        while True:
+            keep = overlapping(self._levels[la][a], other._levels[lb][b])
+            a = a[keep]
+            b = b[keep]
+            descendA = la < len(self._levels) - 1
+            descendB = lb < len(other._levels) - 1
+            if not (descendA or descendB):
+                break
+            if descendA:
+                a, b = np.stack((2 * a, 2 * a + 1), axis=1).ravel(), np.repeat(b, 2)
+                valid = a < len(self._levels[la + 1])
+                a, b = a[valid], b[valid]
+                la += 1
+            if descendB:
+                a, b = np.repeat(a, 2), np.stack((2 * b, 2 * b + 1), axis=1).ravel()
+                valid = b < len(other._levels[lb + 1])
+                a, b = a[valid], b[valid]
+                lb += 1
+
+        # every segment of leaf a with every segment of leaf b
+        segA, pairA = self._leaf_segments(a)
+        countsB = np.minimum(b * other._leafSize + other._leafSize, len(other._segs)) - b * other._leafSize
+        perA = countsB[pairA]
+        i = np.repeat(segA, perA)
+        local = np.arange(perA.sum()) - np.repeat(np.cumsum(perA) - perA, perA)
+        j = np.repeat(b[pairA] * other._leafSize, perA) + local
+        keep = overlapping(self._boxes[i], other._boxes[j])
+        i = i[keep]
+        j = j[keep]
+        order = np.lexsort((j, i))
+        return i[order], j[order]
+
+
+class PointIndex():
+    """Hashed grid of binned points for fixed-radius neighbour queries.
+    Only occupied cells are stored: points are sorted by cell key and occupied cell _cellKeys[c]
+    owns the points _cellStart[c]:_cellStart[c+1] of _cellPoints, so tiny cells cost no extra memory."""
+
+    def __init__(self, xy, cellSize):
+        """
+        Builds the index
+        :param xy: (N,2) array of points
+        :param cellSize: width of the square grid cells, usually the query radius
+        """
+        self._xy = np.ascontiguousarray(xy, dtype=np.float64).reshape(-1, 2)
+        if not cellSize > 0.0:
+            raise ValueError("PointIndex cell size must be greater than zero")
+        self._cellSize = float(cellSize)
+        if len(self._xy) == 0:
+            self._origin = (0.0, 0.0)
+            self._ncx = self._ncy = 1
+        else:
+            self._origin = (float(self._xy[:, 0].min()), float(self._xy[:, 1].min()))
+            self._ncx = int((float(self._xy[:, 0].max()) - self._origin[0]) // self._cellSize) + 1
+            self._ncy = int((float(self._xy[:, 1].max()) - self._origin[1]) // self._cellSize) + 1
+        ix, iy = self._cell_coords(self._xy)
+        keys = ix * self._ncy + iy
+        self._cellPoints = np.argsort(keys, kind='stable')
+        self._cellKeys, counts = np.unique(keys, return_counts=True)
+        self._cellStart = np.concatenate(([0], np.cumsum(counts)))
+
+    def __len__(self):
+        return len(self._xy)
+
+    def _cell_coords(self, xy):
+        ix = np.floor((xy[:, 0] - self._origin[0]) / self._cellSize).astype(np.int64)
+        iy = np.floor((xy[:, 1] - self._origin[1]) / self._cellSize).astype(np.int64)
+        return ix, iy
+
+    def neighbour_pairs(self, query_xy, radius):
+        '''
+        Finds all of the points closer than the radius to each query point
+        :param query_xy: (Q,2) array of query points
+        :param radius: search radius, a point p is a neighbour of q if q.distance_to(p) < radius
+        :return: tuple (queries, points, distances) of arrays, one entry per neighbour pair, ordered by query
+                 and then by point index within each query's neighbourhood cells
+        '''
+        query_xy = np.asarray(query_xy, dtype=np.float64).reshape(-1, 2)
+        qx, qy = self._cell_coords(query_xy)
+        reach = int(math.ceil(radius / self._cellSize))
+        queries = []
+        points = []
+        for ox in range(-reach, reach + 1):
+            for oy in range(-reach, reach + 1):
+                cx = qx + ox
+                cy = qy + oy
+                valid = np.nonzero((cx >= 0) & (cx < self._ncx) & (cy >= 0) & (cy < self._ncy))[0]
+                keys = cx[valid] * self._ncy + cy[valid]
+                pos = np.minimum(np.searchsorted(self._cellKeys, keys), len(self._cellKeys) - 1)
+                occupied = np.nonzero(self._cellKeys[pos] == keys)[0] if len(self._cellKeys) > 0 else valid[:0]
+                pos = pos[occupied]
+                starts = self._cellStart[pos]
+                counts = self._cellStart[pos + 1] - starts
+                queries.append(np.repeat(valid[occupied], counts))
+                points.append(self._cellPoints[np.repeat(starts - np.cumsum(counts) + counts, counts) +
+                                               np.arange(counts.sum())])
+        queries = np.concatenate(queries)
+        points = np.concatenate(points)
+        PROFILER.count('pointQueries', len(query_xy))
+        PROFILER.count('pointCandidates', len(points))
+        # same arithmetic as Point2.distance_to()
+        dx = query_xy[queries, 0] - self._xy[points, 0]
+        dy = query_xy[queries, 1] - self._xy[points, 1]
+        distances = (dx*dx + dy*dy)**0.5
+        keep = distances < radius
+        order = np.argsort(queries[keep], kind='stable')
+        return queries[keep][order], points[keep][order], distances[keep][order]
+
+    def count_within(self, query_xy, radius, maxQueries=65536):
+        '''
+        Counts the points closer than the radius to every query point
+        :param query_xy: (Q,2) array of query points
+        :param radius: search radius, uses the same strict < radius rule as Point2.distance_to(p) < radius
+        :param maxQueries: number of query points handled at once, limits memory use
+        :return: (Q) array of neighbour counts
+        '''
+        query_xy = np.asarray(query_xy, dtype=np.float64).reshape(-1, 2)
+        counts = np.zeros(len(query_xy), dtype=np.int64)
+        for start in range(0, len(query_xy), maxQueries):
+            chunk = query_xy[start:start + maxQueries]
+            queries = self.neighbour_pairs(chunk, radius)[0]
+            counts[start:start + len(chunk)] = np.bincount(queries, minlength=len(chunk))
+        return counts
+
+    def count_within_radii(self, query_xy, radii, maxQueries=65536):
+        '''
+        Counts the points closer than each of several radii to every query point,
+        the neighbours are found once with the largest radius and the distances reused for the smaller radii
+        :param query_xy: (Q,2) array of query points
+        :param radii: sequence of R search radii, each uses the strict < radius rule of count_within()
+        :param maxQueries: number of query points handled at once, limits memory use
+        :return: (Q,R) array of neighbour counts, column k is identical to count_within(query_xy, radii[k])
+        '''
+        query_xy = np.asarray(query_xy, dtype=np.float64).reshape(-1, 2)
+        radii = [float(r) for r in radii]
+        counts = np.zeros((len(query_xy), len(radii)), dtype=np.int64)
+        if len(radii) == 0:
+            return counts
+        for start in range(0, len(query_xy), maxQueries):
+            chunk = query_xy[start:start + maxQueries]
+            queries, points, distances = self.neighbour_pairs(chunk, max(radii))
+            for ri, r in enumerate(radii):
+                counts[start:start + len(chunk), ri] = np.bincount(queries[distances < r], minlength=len(chunk))
+        return counts
+
+
+def find_root(parent, i):
+    '''
+    Finds the root of an element of a union-find forest, halving the path to it on the way
+    :param parent: list of the parent of each element, the roots are their own parent
+    :param i: element
+    :return: the root of the tree holding i
+    '''
+    while parent[i] != i:
+        parent[i] = parent[parent[i]]
+        i = parent[i]
+    return i
+
+
+def merge_close_points(xy, tol=1e-03):
+    '''
+    Merges points that lie within a distance tolerance of one another
+    Points are hashed into tolerance sized cells and only compared with points in neighbouring cells,
+    chains of points closer than tol are merged into one point
+    :param xy: (N,2) array of points
+    :param tol: points closer than tol are the same point (as in Point2.same_point())
+    :return: tuple (representatives, hits, inverse) of arrays: index into xy of the first point of each merged
+             point (in order of first appearance), number of points merged into each one,
+             and the position in representatives of every input point
+    '''
+    xy = np.asarray(xy, dtype=np.float64).reshape(-1, 2)
+    if len(xy) == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+
+    # exact duplicates are merged first so only distinct points go through the hash grid
+    distinct, first, inverse = np.unique(xy, axis=0, return_index=True, return_inverse=True)
+    inverse = inverse.ravel()
+    labels = first
+    if tol > 0.0 and len(distinct) > 1:
+        queries, points = PointIndex(distinct, tol).neighbour_pairs(distinct, tol)[:2]
+        keep = queries < points
+        # union-find over the close pairs, each chain of close points is rooted at its smallest input index
+        firstIndex = first.tolist()
+        parent = list(range(len(distinct)))
+        for a, b in zip(queries[keep].tolist(), points[keep].tolist()):
+            ra = find_root(parent, a)
+            rb = find_root(parent, b)
+            if ra != rb:
+                if firstIndex[ra] < firstIndex[rb]:
+                    parent[rb] = ra
+                else:
+                    parent[ra] = rb
+        labels = first[[find_root(parent, i) for i in range(len(parent))]]
+
+    representatives, position = np.unique(labels[inverse], return_inverse=True)
+    position = position.ravel()
+    return representatives, np.bincount(position, minlength=len(representatives)), position
@@ -112,10 +112,10 @@ class StraightLine2:
         else: # parallel lines
             # test if line end-points lies on this line
             if self.isEndPoint(line._v0,tolerance):
-                intersectionPoints.append(Point2(line._v0))
+                intersectionPoints.append(Point2(line._v0._x,line._v0._y))
             # test if line end-points lies on this line
             if self.isEndPoint(line._v1,tolerance):
-                intersectionPoints.append(Point2(line._v1))
+                intersectionPoints.append(Point2(line._v1._x,line._v1._y))
             return intersectionPoints
 
         # no intersection
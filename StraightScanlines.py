@@ -0,0 +1,192 @@
+__author__ = 'ryshackleton'
+
+import math
+import numpy as np
+from VectorGeometry import segment_intersections
+
+'''
+Straight (linear) scanline sampling of fracture traces: P10, intersection positions and fracture spacings
+for batches of scanlines, either given explicitly or generated as parallel families at given azimuths and spacings.
+Azimuths are in degrees clockwise from north (the +y axis).
+'''
+
+
+def clip_lines_to_box(px, py, dirx, diry, bounds):
+    '''
+    Clips infinite lines to a rectangle
+    :param px, py: (N) arrays of a point on each line
+    :param dirx, diry: direction of the lines
+    :param bounds: (xmin, ymin, xmax, ymax) of the rectangle
+    :return: (M,4) array of x0,y0,x1,y1 segments of the lines crossing the rectangle, and the (M) index of each line
+    '''
+    xmin, ymin, xmax, ymax = bounds
+    s0 = np.full(len(px), -np.inf)
+    s1 = np.full(len(px), np.inf)
+    for p, d, lo, hi in ((px, dirx, xmin, xmax), (py, diry, ymin, ymax)):
+        if abs(d) > 0.0:
+            a = (lo - p) / d
+            b = (hi - p) / d
+            s0 = np.maximum(s0, np.minimum(a, b))
+            s1 = np.minimum(s1, np.maximum(a, b))
+        else:
+            outside = (p < lo) | (p > hi)
+            s1 = np.where(outside, -np.inf, s1)
+    keep = np.nonzero(s0 < s1)[0]
+    lines = np.column_stack((px[keep] + s0[keep] * dirx, py[keep] + s0[keep] * diry,
+                             px[keep] + s1[keep] * dirx, py[keep] + s1[keep] * diry))
+    return lines, keep
+
+
+def parallel_scanlines(bounds, azimuth, spacing):
+    '''
+    Generates a family of parallel scanlines covering a rectangle
+    :param bounds: (xmin, ymin, xmax, ymax) of the sampled area
+    :param azimuth: direction of the scanlines in degrees clockwise from north
+    :param spacing: perpendicular distance between neighbouring scanlines, the lines lie at whole multiples of the
+                    spacing from the origin so families at the same azimuth and spacing always line up
+    :return: (N,4) array of x0,y0,x1,y1 scanlines clipped to the rectangle
+    '''
+    if not spacing > 0.0:
+        raise ValueError("Scanline spacing must be greater than zero")
+    a = math.radians(azimuth)
+    dirx, diry = math.sin(a), math.cos(a)
+    # unit normal to the scanlines, offsets of the corners along it give the range of lines to generate
+    nx, ny = diry, -dirx
+    xmin, ymin, xmax, ymax = bounds
+    corners = [x * nx + y * ny for x in (xmin, xmax) for y in (ymin, ymax)]
+    offsets = np.arange(math.ceil(min(corners) / spacing), math.floor(max(corners) / spacing) + 1) * spacing
+    return clip_lines_to_box(offsets * nx, offsets * ny, dirx, diry, bounds)[0]
+
+
+def scanline_families(bounds, azimuths, spacings):
+    '''
+    Generates parallel scanline families for every combination of azimuth and spacing, e.g. an orientation sweep
+    with azimuths=range(0, 180, 5)
+    :param bounds: (xmin, ymin, xmax, ymax) of the sampled area
+    :param azimuths: sequence of azimuths in degrees clockwise from north
+    :param spacings: sequence of scanline spacings
+    :return: tuple (lines, azimuth, spacing) of the (N,4) array of scanlines and (N) arrays of the azimuth and spacing
+             of the family of each line
+    '''
+    lines = [np.zeros((0, 4))]
+    lineAzimuth = [np.zeros(0)]
+    lineSpacing = [np.zeros(0)]
+    for azimuth in azimuths:
+        for spacing in spacings:
+            family = parallel_scanlines(bounds, azimuth, spacing)
+            lines.append(family)
+            lineAzimuth.append(np.full(len(family), float(azimuth)))
+            lineSpacing.append(np.full(len(family), float(spacing)))
+    return np.concatenate(lines), np.concatenate(lineAzimuth), np.concatenate(lineSpacing)
+
+
+class ScanlineIntersections():
+    """Models the intersections of a batch of straight scanlines with fracture traces.
+    The intersections of scanline i are _position[_lineStart[i]:_lineStart[i+1]], sorted by distance along the line
+    from its first point, with matching rows of _xy and _traceIndex."""
+
+    def __init__(self, lines, line, position, xy, traceIndex, traceIds):
+        """
+        Initializes a ScanlineIntersections
+        :param lines: (L,4) array of x0,y0,x1,y1 scanlines
+        :param line: (K) scanline index of each intersection, sorted
+        :param position: (K) distance of each intersection from the first point of its scanline
+        :param xy: (K,2) array of intersection points
+        :param traceIndex: (K) index in the TraceSet of the trace crossed
+        :param traceIds: (T) array of trace Ids of the TraceSet
+        """
+        self._lines = np.asarray(lines, dtype=np.float64).reshape(-1, 4)
+        self._position = np.asarray(position, dtype=np.float64)
+        self._xy = np.asarray(xy, dtype=np.float64).reshape(-1, 2)
+        self._traceIndex = np.asarray(traceIndex, dtype=np.int64)
+        self._traceId = np.asarray(traceIds, dtype=np.int64)[self._traceIndex]
+        self._lineStart = np.searchsorted(np.asarray(line, dtype=np.int64), np.arange(len(self._lines) + 1))
+
+    def __len__(self):
+        return len(self._lines)
+
+    def lengths(self):
+        '''
+        :return: (L) array of scanline lengths
+        '''
+        return np.hypot(self._lines[:, 2] - self._lines[:, 0], self._lines[:, 3] - self._lines[:, 1])
+
+    def counts(self):
+        '''
+        :return: (L) array of the number of traces crossed by each scanline
+        '''
+        return np.diff(self._lineStart)
+
+    def p10(self):
+        '''
+        :return: (L) array of fractures per unit length along each scanline (0 for zero length scanlines)
+        '''
+        lengths = self.lengths()
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(lengths > 0.0, self.counts() / lengths, 0.0)
+
+    def positions(self, i):
+        '''
+        :return: array of the distances of the intersections of scanline i from its first point, in order
+        '''
+        return self._position[self._lineStart[i]:self._lineStart[i + 1]]
+
+    def spacings(self, i):
+        '''
+        :return: array of the distances between consecutive intersections along scanline i
+        '''
+        return np.diff(self.positions(i))
+
+    def mean_spacings(self):
+        '''
+        :return: (L) array of the mean fracture spacing along each scanline (nan with fewer than 2 intersections)
+        '''
+        counts = self.counts()
+        if len(self._position) == 0:
+            return np.full(len(self), np.nan)
+        first = self._position[np.minimum(self._lineStart[:-1], len(self._position) - 1)]
+        last = self._position[np.maximum(self._lineStart[1:] - 1, 0)]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(counts > 1, (last - first) / (counts - 1), np.nan)
+
+
+def intersect_scanlines(lines, traceSet, tol=1e-03, linesPerBatch=4096):
+    '''
+    Intersects a batch of straight scanlines with the traces of a TraceSet
+    Candidate trace segments are found by walking each scanline through the cells of the TraceSet's SegmentIndex,
+    the intersections use the same tolerance rules as StraightLine2.intersectionPoints(), and a trace crossed at a
+    vertex shared by two of its segments is counted once
+    :param lines: (L,4) array of x0,y0,x1,y1 scanlines
+    :param traceSet: TraceSet of the fracture traces
+    :param tol: distance tolerance for sameness of points
+    :param linesPerBatch: number of scanlines handled at once, limits memory use
+    :return: ScanlineIntersections
+    '''
+    lines = np.asarray(lines, dtype=np.float64).reshape(-1, 4)
+    segs, segTrace = traceSet.segments()
+    index = traceSet.segment_index()
+    found = {'line': [], 'position': [], 'xy': [], 'trace': []}
+    for start in range(0, len(lines), linesPerBatch):
+        li, si = index.query_lines(lines[start:start + linesPerBatch])
+        li += start
+        pairs, xy = segment_intersections(lines[li], segs[si], tol)
+        line = li[pairs]
+        trace = segTrace[si[pairs]]
+        position = np.hypot(xy[:, 0] - lines[line, 0], xy[:, 1] - lines[line, 1])
+
+        # drop repeated crossings of the same trace at the same point along a scanline
+        order = np.lexsort((position, trace, line))
+        line, trace, position, xy = line[order], trace[order], position[order], xy[order]
+        keep = np.ones(len(line), dtype=bool)
+        keep[1:] = (line[1:] != line[:-1]) | (trace[1:] != trace[:-1]) | (position[1:] - position[:-1] >= tol)
+        line, trace, position, xy = line[keep], trace[keep], position[keep], xy[keep]
+        order = np.lexsort((position, line))
+        found['line'].append(line[order])
+        found['position'].append(position[order])
+        found['xy'].append(xy[order])
+        found['trace'].append(trace[order])
+
+    if len(found['line']) == 0:
+        return ScanlineIntersections(lines, [], [], np.zeros((0, 2)), [], traceSet._traceIds)
+    return ScanlineIntersections(lines, np.concatenate(found['line']), np.concatenate(found['position']),
+                                 np.concatenate(found['xy']), np.concatenate(found['trace']), traceSet._traceIds)
@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+
+__author__ = 'ryshackleton'
+
+import math
+import argparse
+import numpy as np
+from TraceSet import TraceSet
+
+'''
+Reproducible synthetic fracture networks written as Midland Valley-Move exports.
+Trace centers are a Poisson point process in a square, trace lengths follow a power law (Pareto) distribution,
+azimuths follow a von Mises distribution around a mean azimuth (axial, so 0 and 180 degrees are the same direction),
+and each trace is a polyline whose heading wanders by a normally distributed angle at every vertex (tortuosity).
+The same arguments and seed always give the same network.
+'''
+
+MVE_HEADER = 'x\ty\tz\tName\tId\tPType\tColour Num\tColour Id\tColour (red)\tColour (green)\tColour (blue)\n'
+
+
+def generate_network(numTraces, size=100.0, minLength=1.0, maxLength=None, exponent=2.5, azimuth=0.0, kappa=0.0,
+                     tortuosity=0.0, segmentLength=None, poisson=True, seed=0):
+    '''
+    Generates a synthetic fracture network
+    :param numTraces: mean number of traces (the actual number is Poisson distributed unless poisson is False)
+    :param size: trace centers lie in the square [0,size] x [0,size]
+    :param minLength: shortest trace length, the scale of the power law
+    :param maxLength: longest trace length, lengths are truncated to it (default: size)
+    :param exponent: power law exponent a of the length density p(l) ~ l^-a, a > 1
+    :param azimuth: mean trace azimuth in degrees clockwise from north
+    :param kappa: von Mises concentration of the azimuths, 0 gives uniformly random azimuths
+    :param tortuosity: standard deviation in degrees of the change of heading at each vertex, 0 gives straight traces
+    :param segmentLength: distance between trace vertices (default: minLength / 2)
+    :param poisson: draw the number of traces from a Poisson distribution with mean numTraces
+    :param seed: random seed
+    :return: TraceSet of the network
+    '''
+    if not exponent > 1.0:
+        raise ValueError("The power law exponent must be greater than 1")
+    rng = np.random.default_rng(seed)
+    maxLength = size if maxLength is None else maxLength
+    segmentLength = 0.5 * minLength if segmentLength is None else segmentLength
+    n = int(rng.poisson(numTraces)) if poisson else int(numTraces)
+
+    centers = rng.uniform(0.0, size, (n, 2))
+    lengths = np.minimum(minLength * (1.0 - rng.uniform(0.0, 1.0, n))**(-1.0 / (exponent - 1.0)), maxLength)
+    # axial von Mises: draw on the doubled angle so the distribution is symmetric about azimuth and azimuth+180
+    if kappa > 0.0:
+        headings = math.radians(azimuth) + 0.5 * rng.vonmises(0.0, kappa, n)
+    else:
+        headings = rng.uniform(0.0, math.pi, n)
+
+    numSegs = np.maximum(np.ceil(lengths / segmentLength).astype(np.int64), 1)
+    offsets = np.concatenate(([0], np.cumsum(numSegs + 1)))
+    trace = np.repeat(np.arange(n), numSegs)
+    step = (lengths / numSegs)[trace]
+    turn = rng.normal(0.0, math.radians(tortuosity), len(trace)) if tortuosity > 0.0 else np.zeros(len(trace))
+    # heading of every segment: the trace heading plus the accumulated turns along the trace
+    cumTurn = np.cumsum(turn)
+    firstSeg = offsets[:-1] - np.arange(n)
+    cumTurn -= np.repeat(cumTurn[firstSeg] - turn[firstSeg], numSegs)
+    heading = headings[trace] + cumTurn
+    dx = step * np.sin(heading)
+    dy = step * np.cos(heading)
+
+    # walk each trace from its start, then shift it so its middle vertex sits on the center
+    xy = np.zeros((offsets[-1], 2))
+    vertex = np.arange(len(trace)) + trace + 1
+    xy[vertex, 0] = dx
+    xy[vertex, 1] = dy
+    xy = np.cumsum(xy, axis=0)
+    xy -= np.repeat(xy[offsets[:-1]], numSegs + 1, axis=0)
+    middle = offsets[:-1] + numSegs // 2
+    xy += np.repeat(centers - xy[middle], numSegs + 1, axis=0)
+
+    xyz = np.column_stack((xy, np.zeros(len(xy))))
+    ids = np.arange(1, n + 1)
+    column = lambda value: np.full(len(xyz), value, dtype=np.int32)
+    return TraceSet(xyz, offsets, ids, ['Trace_{}'.format(i) for i in ids], ptype=column(1), colorindex=column(4),
+                    colornum=column(3), rvalue=column(255), gvalue=column(0), bvalue=column(0))
+
+
+def write_mve_traces(filename, traceSet):
+    '''
+    Writes the traces of a TraceSet as a Midland Valley-Move export readable by MVE_importer
+    :param filename: name of the file to write
+    :param traceSet: TraceSet of the traces
+    :return: nothing
+    '''
+    vertexTrace = np.repeat(np.arange(len(traceSet)), np.diff(traceSet._offsets))
+    with open(filename, 'w') as f:
+        f.write(MVE_HEADER)
+        rows = zip(traceSet._xyz.tolist(), vertexTrace.tolist(), traceSet._ptype.tolist(),
+                   traceSet._colornum.tolist(), traceSet._colorindex.tolist(), traceSet._rvalue.tolist(),
+                   traceSet._gvalue.tolist(), traceSet._bvalue.tolist())
+        names = traceSet._traceNames
+        ids = traceSet._traceIds.tolist()
+        for (x, y, z), t, ptype, colornum, colorindex, r, g, b in rows:
+            f.write('{:.4f}\t{:.4f}\t{:.4f}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\n'.format(
+                x, y, z, names[t], ids[t], ptype, colornum, colorindex, r, g, b))
+
+
+def write_mve_grid(filename, size, spacing):
+    '''
+    Writes a regular grid of points as a Midland Valley-Move export, e.g. circular scanline centers
+    :param filename: name of the file to write
+    :param size: the grid covers the square [0,size] x [0,size]
+    :param spacing: distance between neighbouring grid points
+    :return: number of grid points written
+    '''
+    coords = np.arange(0.0, size + 0.5 * spacing, spacing)
+    with open(filename, 'w') as f:
+        f.write(MVE_HEADER)
+        i = 0
+        for x in coords.tolist():
+            for y in coords.tolist():
+                f.write('{}\t{}\t0.0\tGrid\t{}\t0\t0\t0\t255\t255\t255\n'.format(x, y, i))
+                i += 1
+    return i
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Writes a synthetic fracture network and grid as MVE exports")
+    parser.add_argument('traceFileName')
+    parser.add_argument('gridFileName', nargs='?', default=None)
+    parser.add_argument('--traces', type=float, default=1000, help="mean number of traces (default 1000)")
+    parser.add_argument('--size', type=float, default=100.0, help="side of the square area (default 100)")
+    parser.add_argument('--min-length', dest='minLength', type=float, default=1.0)
+    parser.add_argument('--max-length', dest='maxLength', type=float, default=None)
+    parser.add_argument('--exponent', type=float, default=2.5, help="power law exponent of the trace lengths")
+    parser.add_argument('--azimuth', type=float, default=0.0, help="mean azimuth in degrees clockwise from north")
+    parser.add_argument('--kappa', type=float, default=0.0, help="von Mises concentration, 0 for random azimuths")
+    parser.add_argument('--tortuosity', type=float, default=0.0, help="heading change per vertex in degrees")
+    parser.add_argument('--segment-length', dest='segmentLength', type=float, default=None)
+    parser.add_argument('--grid-spacing', dest='gridSpacing', type=float, default=1.0)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+    traces = generate_network(args.traces, args.size, args.minLength, args.maxLength, args.exponent, args.azimuth,
+                              args.kappa, args.tortuosity, args.segmentLength, seed=args.seed)
+    write_mve_traces(args.traceFileName, traces)
+    if args.gridFileName is not None:
+        write_mve_grid(args.gridFileName, args.size, args.gridSpacing)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+__author__ = 'ryshackleton'
+
+import numpy as np
+from Point import Point2
+from VectorGeometry import segment_intersections
+from SpatialIndex import merge_close_points
+
+
+class TraceIntersections():
+    """Models the intersection points between the traces of a TraceSet.
+    Intersection k lies at _xy[k] and is the crossing of segment _segmentA[k] of trace _traceIndexA[k]
+    with segment _segmentB[k] of trace _traceIndexB[k] (segment indices count from the start of each trace)."""
+
+    def __init__(self, xy, traceIndexA, segmentA, traceIndexB, segmentB, traceIds):
+        """
+        Initializes a TraceIntersections
+        :param xy: (K,2) array of intersection points
+        :param traceIndexA: (K) index in the TraceSet of the first trace of each intersection
+        :param segmentA: (K) index of the segment within the first trace
+        :param traceIndexB: (K) index in the TraceSet of the second trace of each intersection
+        :param segmentB: (K) index of the segment within the second trace
+        :param traceIds: (T) array of trace Ids of the TraceSet, used to look up the Ids of each trace index
+        """
+        self._xy = np.asarray(xy, dtype=np.float64).reshape(-1, 2)
+        self._traceIndexA = np.asarray(traceIndexA, dtype=np.int64)
+        self._segmentA = np.asarray(segmentA, dtype=np.int64)
+        self._traceIndexB = np.asarray(traceIndexB, dtype=np.int64)
+        self._segmentB = np.asarray(segmentB, dtype=np.int64)
+        self._traceIdA = np.asarray(traceIds, dtype=np.int64)[self._traceIndexA]
+        self._traceIdB = np.asarray(traceIds, dtype=np.int64)[self._traceIndexB]
+
+    def __len__(self):
+        return len(self._xy)
+
+    def unique_points(self, tol=1e-03):
+        '''
+        Merges intersection points that lie within a distance tolerance of one another
+        (e.g. a trace crossing at a vertex is found by both segments that share the vertex)
+        :param tol: points closer than tol are the same intersection
+        :return: tuple (xy, hits) of the (U,2) array of unique intersection points in order of first appearance
+                 and the (U) array of the number of raw intersections merged into each of them
+        '''
+        representatives, hits = merge_close_points(self._xy, tol)[:2]
+        return self._xy[representatives], hits
+
+    def to_Point2_list(self):
+        '''
+        :return: list(Point2()) of all intersection points
+        '''
+        return [Point2(x, y) for x, y in self._xy.tolist()]
+
+
+def _sweep_candidate_pairs(segs, segTrace, tol, maxPairs):
+    '''
+    Sort-and-sweep along x: yields chunks of candidate segment pairs whose tolerance-expanded bounding boxes overlap
+    :param segs: (S,4) array of segments
+    :param segTrace: (S) array of the trace index of each segment
+    :param tol: distance tolerance used to expand the bounding boxes
+    :param maxPairs: approximate maximum number of x-overlapping pairs handled per chunk
+    :return: generator of (i, j) arrays of segment indices with segTrace[i] < segTrace[j]
+    '''
+    xmin = np.minimum(segs[:, 0], segs[:, 2]) - tol
+    xmax = np.maximum(segs[:, 0], segs[:, 2]) + tol
+    ymin = np.minimum(segs[:, 1], segs[:, 3]) - tol
+    ymax = np.maximum(segs[:, 1], segs[:, 3]) + tol
+
+    order = np.argsort(xmin, kind='stable')
+    sortedXmin = xmin[order]
+    # every segment after position p in the sweep whose xmin is <= xmax of segment p overlaps it in x
+    stop = np.searchsorted(sortedXmin, xmax[order], side='right')
+    counts = np.maximum(stop - np.arange(len(order)) - 1, 0)
+    cumulative = np.cumsum(counts)
+
+    start = 0
+    while start < len(order):
+        end = max(np.searchsorted(cumulative, cumulative[start] - counts[start] + maxPairs, side='right'), start + 1)
+        c = counts[start:end]
+        p = np.repeat(np.arange(start, end), c)
+        q = p + 1 + (np.arange(c.sum()) - np.repeat(np.cumsum(c) - c, c))
+        i = order[p]
+        j = order[q]
+        keep = (ymin[i] <= ymax[j]) & (ymin[j] <= ymax[i]) & (segTrace[i] != segTrace[j])
+        i = i[keep]
+        j = j[keep]
+        # the trace that comes first in the TraceSet is always "this" trace of the intersection test
+        swap = segTrace[i] > segTrace[j]
+        i[swap], j[swap] = j[swap], i[swap]
+        yield i, j
+        start = end
+
+
+def find_trace_intersections(traceSet, tol=1e-03, maxPairs=1000000):
+    '''
+    Finds the intersections between all pairs of different traces in a TraceSet
+    Gives the same points as calling FracTrace.intersection_points_with_trace() on every pair of traces i < j,
+    but only segments whose bounding boxes overlap are tested
+    :param traceSet: TraceSet to intersect
+    :param tol: Tolerance used for determining distance tolerances (as in StraightLine2.intersectionPoints())
+    :param maxPairs: maximum number of candidate segment pairs to test at once, limits memory use
+    :return: TraceIntersections ordered by trace pair, then by segment pair, as the pairwise loops would find them
+    '''
+    segs, segTrace = traceSet.segments()
+    segLocal = np.arange(len(segs)) - traceSet.segment_offsets()[segTrace]
+
+    pairsI = []
+    pairsJ = []
+    xys = []
+    for i, j in _sweep_candidate_pairs(segs, segTrace, tol, maxPairs):
+        pairs, xy = segment_intersections(segs[i], segs[j], tol)
+        pairsI.append(i[pairs])
+        pairsJ.append(j[pairs])
+        xys.append(xy)
+
+    if len(xys) == 0:
+        return TraceIntersections(np.zeros((0, 2)), [], [], [], [], traceSet._traceIds)
+    i = np.concatenate(pairsI)
+    j = np.concatenate(pairsJ)
+    xy = np.concatenate(xys)
+
+    # candidate pairs come out of the sweep in x order, sort them into trace pair / segment pair order,
+    # the stable sort keeps the order of multiple points found for the same segment pair
+    order = np.lexsort((j, i, segTrace[j], segTrace[i]))
+    i = i[order]
+    j = j[order]
+    return TraceIntersections(xy[order], segTrace[i], segLocal[i], segTrace[j], segLocal[j], traceSet._traceIds)
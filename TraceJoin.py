@@ -0,0 +1,131 @@
+__author__ = 'ryshackleton'
+
+import numpy as np
+from TraceSet import TraceSet
+from SpatialIndex import PointIndex, merge_close_points, find_root
+
+'''
+Joins fracture traces whose endpoints lie within a distance tolerance into longer traces,
+the columnar equivalent of repeatedly calling FracTrace.append_if_same_endpoints() on every pair of traces
+'''
+
+
+def endpoint_links(traceSet, tol=1e-03):
+    '''
+    Chooses which trace endpoints are joined together
+    Endpoints are hashed into tolerance sized cells, so only endpoints in neighbouring cells are compared.
+    Candidate links are accepted from the closest to the furthest (ties broken by endpoint order), each endpoint
+    is joined to at most one other endpoint, and links that would close a loop of traces are rejected using a
+    union-find over the traces, so every joined group of traces is a single open chain
+    :param traceSet: TraceSet of the traces to join
+    :param tol: endpoints closer than tol are the same point (as in Point2.same_point())
+    :return: (2T) array, the endpoint joined to endpoint e or -1, where endpoint 2t is the first vertex of trace t
+             and endpoint 2t+1 is its last vertex
+    '''
+    first, last = traceSet.endpoints()
+    endXY = np.empty((2*len(traceSet), 2))
+    endXY[0::2] = first
+    endXY[1::2] = last
+    link = np.full(len(endXY), -1, dtype=np.int64)
+    valid = np.nonzero(np.diff(traceSet._offsets) > 0)[0]
+    if len(valid) < 2 or tol <= 0.0:
+        return link
+
+    ends = np.concatenate((2*valid, 2*valid + 1))
+    queries, points, distances = PointIndex(endXY[ends], tol).neighbour_pairs(endXY[ends], tol)
+    a = ends[queries]
+    b = ends[points]
+    keep = (a // 2 < b // 2)
+    a, b, distances = a[keep], b[keep], distances[keep]
+    order = np.lexsort((b, a, distances))
+
+    parent = list(range(len(traceSet)))
+    for ea, eb in zip(a[order].tolist(), b[order].tolist()):
+        if link[ea] != -1 or link[eb] != -1:
+            continue
+        ra = find_root(parent, ea // 2)
+        rb = find_root(parent, eb // 2)
+        if ra == rb:
+            continue
+        parent[max(ra, rb)] = min(ra, rb)
+        link[ea] = eb
+        link[eb] = ea
+    return link
+
+
+def junction_report(traceSet, link, tol=1e-03):
+    '''
+    Lists the ambiguous junctions, where more than two trace endpoints meet, and how each was resolved
+    :param traceSet: TraceSet of the traces
+    :param link: endpoint links from endpoint_links()
+    :param tol: distance tolerance used to find the links
+    :return: [ (x, y, [traceIds meeting at the junction], [(traceIdA, traceIdB) pairs joined at the junction]), ... ]
+    '''
+    valid = np.nonzero(np.diff(traceSet._offsets) > 0)[0]
+    ends = np.concatenate((2*valid, 2*valid + 1))
+    first, last = traceSet.endpoints()
+    endXY = np.where((ends % 2 == 0)[:, None], first[ends // 2], last[ends // 2])
+    representatives, hits, inverse = merge_close_points(endXY, tol)
+
+    junctions = []
+    ids = traceSet._traceIds
+    byJunction = np.argsort(inverse, kind='stable')
+    junctionStart = np.concatenate(([0], np.cumsum(hits)))
+    for r in np.nonzero(hits > 2)[0].tolist():
+        memberSet = set(ends[byJunction[junctionStart[r]:junctionStart[r+1]]].tolist())
+        joined = [(int(ids[e // 2]), int(ids[link[e] // 2])) for e in sorted(memberSet)
+                  if link[e] in memberSet and e < link[e]]
+        x, y = endXY[representatives[r]].tolist()
+        junctions.append((x, y, [int(ids[e // 2]) for e in sorted(memberSet)], joined))
+    return junctions
+
+
+def concatenate_traces(traceSet, tol=1e-03):
+    '''
+    Joins traces whose endpoints lie within the distance tolerance of one another into single traces
+    Each chain of linked traces is assembled in one pass, starting from the lowest numbered trace at either end
+    of the chain; parts are reversed as needed and the duplicate vertex at each join is dropped,
+    as in FracTrace.append_if_same_endpoints()
+    :param traceSet: TraceSet of the traces to join
+    :param tol: endpoints closer than tol are the same point (as in Point2.same_point())
+    :return: tuple (joined TraceSet, junctions), where junctions is the list from junction_report()
+    '''
+    link = endpoint_links(traceSet, tol)
+    offsets = traceSet._offsets
+    visited = np.zeros(len(traceSet), dtype=bool)
+    vertexParts = []
+    newOffsets = [0]
+    newIds = []
+    newNames = []
+    for t in range(len(traceSet)):
+        if visited[t] or (link[2*t] != -1 and link[2*t+1] != -1):
+            continue
+        # t is at one end of its chain, walk to the other end
+        forward = bool(link[2*t] == -1)
+        newIds.append(traceSet._traceIds[t])
+        names = []
+        numVertices = 0
+        while True:
+            visited[t] = True
+            names.append(traceSet._traceNames[t])
+            part = np.arange(offsets[t], offsets[t+1])
+            if not forward:
+                part = part[::-1]
+            out = link[2*t+1] if forward else link[2*t]
+            if out != -1 and len(part) > 0:
+                part = part[:-1]
+            vertexParts.append(part)
+            numVertices += len(part)
+            if out == -1:
+                break
+            t = int(out // 2)
+            forward = bool(out % 2 == 0)
+        newOffsets.append(newOffsets[-1] + numVertices)
+        newNames.append('_JOIN_'.join(names))
+
+    order = np.concatenate(vertexParts) if len(vertexParts) > 0 else np.zeros(0, dtype=np.int64)
+    joined = TraceSet(traceSet._xyz[order], newOffsets, newIds, newNames, traceSet._coordinatePlane,
+                      xy=traceSet._xy[order], ptype=traceSet._ptype[order],
+                      colorindex=traceSet._colorindex[order], colornum=traceSet._colornum[order],
+                      rvalue=traceSet._rvalue[order], gvalue=traceSet._gvalue[order], bvalue=traceSet._bvalue[order])
+    return joined, junction_report(traceSet, link, tol)
@@ -1,16 +1,29 @@
 __author__ = 'ryshackleton'
 
 import sys
+import argparse
 from pprint import pprint
-from MVE_importer import build_FracTraces, print_FracTraces
+from MVE_importer import print_FracTraces
+from MVE_cache import load_TraceSet
 import FracTrace
+from TraceJoin import concatenate_traces
+from TraceIntersections import find_trace_intersections
+from ResultWriters import output_format, write_table, write_tsv_rows
+from Profiling import PROFILER
+from PlaneProjection import MAP_VIEW, parse_plane, map_view_warning
 
-def main(inputFileName,outputfilename,concatentationTolerance):
+def main(inputFileName,outputfilename,concatentationTolerance,profile=None,format=None,coordinatePlane=MAP_VIEW):
     """Creates FracTraces from lines in a file
      :param inputFileName : ascii text file of MVE exported lines to parse as fracture traces
      :param outputfilename: name of the output file to write the data to
      :param concatentationTolerance: distance tolerance to check for traces with similar endpoints
             and concatenate the traces if their endpoints are too close
+     :param profile: name of a file to write a JSON report of the time spent in each phase and the geometry
+            primitive counts to ('-' prints it), None does not profile (see Profiling)
+     :param format: 'tsv' writes the table of trace lengths followed by the list of intersections as tab separated
+            text, 'npz' writes the columns Name, Id, TraceLength, IntersectionX and IntersectionY as named arrays,
+            None chooses from the extension of outputfilename
+     :param coordinatePlane: normal of the plane to analyse the traces in, or PlaneProjection.FIT_PLANE
      """
     try:
         tolerance = float(concatentationTolerance)
@@ -18,51 +31,72 @@ def main(inputFileName,outputfilename,concatentationTolerance):
         print("Invalid tolerance: Tolerance must be a floating point number")
         return
 
-    traces = build_FracTraces(inputFileName)
+    if profile is not None:
+        PROFILER.enable()
+    try:
+        with PROFILER.phase('parse'):
+            traceSet = load_TraceSet(inputFileName, None, coordinatePlane)
+        warning = map_view_warning(traceSet._coordinatePlane, traceSet._xyz)
+        if warning is not None:
+            print(warning, file=sys.stderr)
 
-    # concatenate traces whose endpoints lie within the concatenationTolerance
-    doubleCheck = True
-    i = 0
-    while doubleCheck == True:
-        doubleCheck = False
-        while i < len(traces)-1:
-            j=i+1
-            while j < len(traces):
-                if traces[i].append_if_same_endpoints(traces[j],tolerance):
-                    traces.pop(i+1)
-                    doubleCheck == True
-                    break
-                j += 1
-            i += 1
+        # concatenate traces whose endpoints lie within the concatenationTolerance
+        with PROFILER.phase('concatenate'):
+            traces, junctions = concatenate_traces(traceSet, tolerance)
+        for x, y, ids, joined in junctions:
+            print('Ambiguous junction of traces {} at {} {}: joined {}'.format(ids, x, y, joined))
 
-    # find all intersection points
-    allIntersects = []
-    i = 0
-    while i < len(traces):
-        j = i+1
-        while j < len(traces):
-            pts = traces[i].intersection_points_with_trace(traces[j])
-            for p in pts:
-                if p not in allIntersects:
-                    allIntersects.append(p)
-            j += 1
-        i += 1
+        # find all intersection points
+        with PROFILER.phase('intersections'):
+            intersectsXY = find_trace_intersections(traces).unique_points()[0]
 
-    with open(outputfilename,'w') as f:
-        f.write('Name  Id   TraceLength\n')
-        for t in traces:
-            f.write('{} {}  {}\n'.format(t._traceName,t._traceId,t.get_trace_length2()))
+        with PROFILER.phase('write'):
+            write_trace_lengths(outputfilename, traces, intersectsXY, format)
 
-        f.write('\n{} Trace Intersections:\n'.format(len(allIntersects)))
-        for p in allIntersects:
-            f.write('{} {} 0.0 Point2\n'.format(p._x, p._y))
+        if profile is not None:
+            PROFILER.write_report(profile, command='TraceLengths', tolerance=tolerance, tracesRead=len(traceSet),
+                                  tracesJoined=len(traces), uniqueIntersections=len(intersectsXY))
+    finally:
+        if profile is not None:
+            PROFILER.enable(False)
 
 #    print_FracTraces(traces)
 
 
+def write_trace_lengths(outputfilename, traces, intersectsXY, format=None):
+    """Writes the length of every trace and the list of trace intersections
+     :param outputfilename: name of the output file
+     :param traces: TraceSet of the (concatenated) traces
+     :param intersectsXY: (U,2) array of the unique intersection points of the traces
+     :param format: 'tsv' or 'npz', see main()
+     """
+    lengths = {'Name': traces._traceNames, 'Id': traces._traceIds, 'TraceLength': traces.trace_lengths()}
+    if output_format(outputfilename, format) == 'tsv':
+        with open(outputfilename,'w') as f:
+            f.write('Name\tId\tTraceLength\n')
+            write_tsv_rows(f, list(lengths.values()))
+            f.write('\n{} Trace Intersections:\n'.format(len(intersectsXY)))
+            write_tsv_rows(f, [intersectsXY[:, 0], intersectsXY[:, 1], ['0.0'] * len(intersectsXY),
+                               ['Point2'] * len(intersectsXY)])
+    else:
+        write_table(outputfilename, dict(lengths, IntersectionX=intersectsXY[:, 0],
+                                         IntersectionY=intersectsXY[:, 1]), format)
+
+
 if __name__ == '__main__':
-    try:
-        main(sys.argv[1], sys.argv[2], sys.argv[3])
-    except IndexError as e:
-        print("Incorrect command line arguments.")
-        print("usage: TraceLengths InputFileName OutputFileName DistanceToleranceToConcatenateTraces")
+    parser = argparse.ArgumentParser(description="Concatenates fracture traces and writes their lengths and "
+                                                 "intersections")
+    parser.add_argument('InputFileName')
+    parser.add_argument('OutputFileName')
+    parser.add_argument('DistanceToleranceToConcatenateTraces')
+    parser.add_argument('--profile', nargs='?', const='-', default=None, metavar='REPORT_FILE',
+                        help="record the time of each phase and the geometry primitive counts, and write them as "
+                             "JSON to REPORT_FILE (default: print them)")
+    parser.add_argument('--format', choices=('tsv', 'npz'), default=None,
+                        help="output format (default: from the output file extension)")
+    parser.add_argument('--plane', type=parse_plane, default=MAP_VIEW,
+                        help="coordinate plane to analyse the traces in: 'map' (default), 'fit' for the plane fit "
+                             "through all trace vertices (e.g. a cliff face), or its normal like 0,-1,0")
+    args = parser.parse_args()
+    main(args.InputFileName, args.OutputFileName, args.DistanceToleranceToConcatenateTraces, args.profile,
+         args.format, args.plane)
@@ -0,0 +1,337 @@
+__author__ = 'ryshackleton'
+
+import numpy as np
+from Point import Point2
+from StraightLine2 import StraightLine2
+from FracTrace import FracTrace
+from SpatialIndex import SegmentIndex
+from PlaneProjection import project_to_plane, resolve_plane
+
+
+def _attribute_column(values, numVertices, default=0):
+    '''
+    Converts a list of per-vertex attribute values (usually strings from the MVE file) into a typed column
+    :param values: list of attribute values for one trace
+    :param numVertices: number of vertices in the trace
+    :param default: value used when the trace has no values for this attribute
+    :return: numpy int32 array with one entry per vertex
+    '''
+    if len(values) == 0:
+        return np.full(numVertices, default, dtype=np.int32)
+    col = np.asarray(values, dtype=np.float64).astype(np.int32)
+    if len(col) < numVertices:
+        # parsed traces have one value per vertex, but a FracTrace built or edited by hand can have fewer,
+        # pad the front with the first value so attributes stay aligned with the end of the trace
+        col = np.concatenate((np.full(numVertices - len(col), col[0], dtype=np.int32), col))
+    return col[:numVertices]
+
+
+class TraceSet():
+    """Models all of the fracture traces of a file as contiguous coordinate and attribute columns.
+    Vertices of trace i are the rows _offsets[i]:_offsets[i+1] of every per-vertex column."""
+
+    def __init__(self, xyz, offsets, traceIds, traceNames, coordinatePlane=(0.0,0.0,1.0), xy=None,
+                 ptype=None, colorindex=None, colornum=None, rvalue=None, gvalue=None, bvalue=None):
+        """
+        Initializes a TraceSet
+
+        :param xyz: (V,3) array of the original 3d vertex coordinates of all traces
+        :param offsets: (T+1) array of vertex offsets, trace i owns vertices offsets[i]:offsets[i+1]
+        :param traceIds: (T) array of integer trace Ids
+        :param traceNames: list of T trace name strings
+        :param coordinatePlane: tuple representing the normal of the coordinate plane in which the traces exist,
+                    or PlaneProjection.FIT_PLANE to use the plane fit through all of the vertices
+        :param xy: (V,2) array of the 2d coordinates projected to the coordinatePlane,
+                    computed from xyz if not specified
+        :param ptype, colorindex, colornum, rvalue, gvalue, bvalue: optional (V) integer attribute columns
+
+        :type _xyz = float64 array (V,3) representing the original 3D coordinates
+        :type _xy = float64 array (V,2) representing the 2D coordinates projected to the coordinatePlane
+        """
+        self._xyz = np.ascontiguousarray(xyz, dtype=np.float64).reshape(-1, 3)
+        self._offsets = np.asarray(offsets, dtype=np.int64)
+        self._traceIds = np.asarray(traceIds, dtype=np.int64)
+        self._traceNames = list(traceNames)
+        self._coordinatePlane = resolve_plane(coordinatePlane, self._xyz) if xy is None else tuple(coordinatePlane)
+        if len(self._offsets) != len(self._traceIds) + 1 or len(self._traceNames) != len(self._traceIds):
+            raise ValueError("TraceSet: offsets must have one more entry than traceIds and traceNames")
+        if self._offsets[-1] != len(self._xyz):
+            raise ValueError("TraceSet: last offset must equal the number of vertices")
+
+        numVertices = len(self._xyz)
+        self._xy = self._project_xy() if xy is None else np.ascontiguousarray(xy, dtype=np.float64).reshape(-1, 2)
+
+        def column(c):
+            if c is None:
+                return np.zeros(numVertices, dtype=np.int32)
+            return np.asarray(c, dtype=np.int32)
+        self._ptype = column(ptype)
+        self._colorindex = column(colorindex)
+        self._colornum = column(colornum)
+        self._rvalue = column(rvalue)
+        self._gvalue = column(gvalue)
+        self._bvalue = column(bvalue)
+
+        self._views = None
+        self._segments = None
+        self._segTrace = None
+        self._lengths = None
+        self._segmentIndex = None
+        self._segmentOffsets = None
+
+    @classmethod
+    def from_FracTraces(cls, fracTraces):
+        '''
+        Builds a TraceSet from a list of FracTrace objects
+        :param fracTraces: list of FracTrace() objects
+        :return: TraceSet holding copies of all of the vertices and attributes of the traces
+        '''
+        xyzList = []
+        xyList = []
+        offsets = [0]
+        traceIds = []
+        traceNames = []
+        attrs = {'ptype': [], 'colorindex': [], 'colornum': [], 'rvalue': [], 'gvalue': [], 'bvalue': []}
+        coordinatePlane = (0.0,0.0,1.0)
+        for t in fracTraces:
+            n = len(t._vlist2)
+            xy = np.array([(v._x, v._y) for v in t._vlist2], dtype=np.float64).reshape(-1, 2)
+            vlist3 = [v for v in t._vlist3 if len(v) == 3]
+            if len(vlist3) == n:
+                xyz = np.array(vlist3, dtype=np.float64).reshape(-1, 3)
+            else:
+                xyz = np.column_stack((xy, np.zeros(n)))
+            xyList.append(xy)
+            xyzList.append(xyz)
+            offsets.append(offsets[-1] + n)
+            traceIds.append(t._traceId)
+            traceNames.append(t._traceName)
+            for name in attrs:
+                attrs[name].append(_attribute_column(getattr(t, '_' + name), n))
+            coordinatePlane = t._coordinatePlane
+
+        def stack(arrays, width):
+            if len(arrays) == 0:
+                return np.zeros((0, width)) if width > 1 else np.zeros(0, dtype=np.int32)
+            return np.concatenate(arrays)
+
+        return cls(stack(xyzList, 3), offsets, traceIds, traceNames, coordinatePlane, xy=stack(xyList, 2),
+                   **{name: stack(col, 1) for name, col in attrs.items()})
+
+    def to_FracTraces(self):
+        '''
+        Copies this TraceSet into a list of independent (mutable) FracTrace objects
+        :return: [ FracTrace(), FracTrace(), ... ]
+        '''
+        traces = []
+        for i in range(len(self)):
+            s, e = self._offsets[i], self._offsets[i+1]
+            t = FracTrace(self._traceIds[i], self._traceNames[i], self._coordinatePlane,
+                          [tuple(v) for v in self._xyz[s:e].tolist()])
+            t._vlist2 = [Point2(x, y) for x, y in self._xy[s:e].tolist()]
+            t._ptype = self._ptype[s:e].tolist()
+            t._colorindex = self._colorindex[s:e].tolist()
+            t._colornum = self._colornum[s:e].tolist()
+            t._rvalue = self._rvalue[s:e].tolist()
+            t._gvalue = self._gvalue[s:e].tolist()
+            t._bvalue = self._bvalue[s:e].tolist()
+            traces.append(t)
+        return traces
+
+    def _project_xy(self):
+        '''
+        Does the 3D to 2D conversion by projecting the xyz column to the coordinate plane, all traces at once
+        :return: (V,2) array of projected coordinates
+        '''
+        return project_to_plane(self._xyz, self._coordinatePlane)
+
+    #============================================================================
+
+    # Sequence access, each trace is exposed as a read-only FracTraceView
+    def __len__(self):
+        return len(self._traceIds)
+
+    def __getitem__(self, i):
+        return self.views()[i]
+
+    def __iter__(self):
+        return iter(self.views())
+
+    def views(self):
+        '''
+        Returns the (cached) list of FracTraceView objects of this TraceSet
+        :return: [ FracTraceView(), FracTraceView(), ... ]
+        '''
+        if self._views is None:
+            self._views = [FracTraceView(self, i) for i in range(len(self))]
+        return self._views
+
+    def num_vertices(self):
+        return len(self._xyz)
+
+    def trace_xy(self, i):
+        '''
+        Returns the 2D vertices of trace i
+        :param i: index of the trace in this TraceSet
+        :return: (n,2) view into the coordinate column
+        '''
+        return self._xy[self._offsets[i]:self._offsets[i+1]]
+
+    def endpoints(self):
+        '''
+        Returns the first and last 2D vertex of every trace
+        :return: tuple of two (T,2) arrays (first vertices, last vertices)
+        '''
+        counts = np.diff(self._offsets)
+        valid = counts > 0
+        first = np.full((len(self), 2), np.nan)
+        last = np.full((len(self), 2), np.nan)
+        first[valid] = self._xy[self._offsets[:-1][valid]]
+        last[valid] = self._xy[self._offsets[1:][valid] - 1]
+        return first, last
+
+    def segments(self):
+        '''
+        Returns all of the straight segments of all traces
+        :return: tuple (segs, segTrace) where segs is a (S,4) array of x0,y0,x1,y1 rows
+                 and segTrace is the (S) array of the index of the trace that owns each segment
+        '''
+        if self._segments is None:
+            # every consecutive vertex pair except the pairs that span two traces
+            keep = np.ones(max(len(self._xy) - 1, 0), dtype=bool)
+            ends = self._offsets[1:-1] - 1
+            keep[ends[(ends >= 0) & (ends < len(keep))]] = False
+            starts = np.nonzero(keep)[0]
+            self._segments = np.ascontiguousarray(np.hstack((self._xy[starts], self._xy[starts + 1])))
+            self._segTrace = np.searchsorted(self._offsets, starts, side='right') - 1
+        return self._segments, self._segTrace
+
+    def segment_index(self):
+        '''
+        Returns the (cached) spatial index over the segments() of this TraceSet
+        :return: SegmentIndex where segment k is row k of segments()
+        '''
+        if self._segmentIndex is None:
+            self._segmentIndex = SegmentIndex(self.segments()[0])
+        return self._segmentIndex
+
+    def segment_offsets(self):
+        '''
+        Returns the (cached) offsets of each trace's segments in the segments() array
+        :return: (T+1) array, trace i owns segments segment_offsets[i]:segment_offsets[i+1]
+        '''
+        if self._segmentOffsets is None:
+            counts = np.maximum(np.diff(self._offsets) - 1, 0)
+            self._segmentOffsets = np.concatenate(([0], np.cumsum(counts)))
+        return self._segmentOffsets
+
+    def trace_lengths(self):
+        '''
+        Returns the 2D length of every trace by summing up each segment length
+        :return: (T) array of trace lengths
+        '''
+        if self._lengths is None:
+            segs, segTrace = self.segments()
+            dx = segs[:, 0] - segs[:, 2]
+            dy = segs[:, 1] - segs[:, 3]
+            segLen = (dx*dx + dy*dy)**0.5
+            # bincount sums sequentially, so lengths match FracTrace.get_trace_length2()
+            self._lengths = np.bincount(segTrace, weights=segLen, minlength=len(self))
+        return self._lengths
+
+
+class FracTraceView(FracTrace):
+    """Read-only FracTrace backed by one trace of a TraceSet.
+    The list attributes of FracTrace are built on demand from the TraceSet columns."""
+
+    def __init__(self, traceSet, index):
+        self._traceSet = traceSet
+        self._index = index
+        self._traceId = int(traceSet._traceIds[index])
+        self._traceName = traceSet._traceNames[index]
+        self._coordinatePlane = traceSet._coordinatePlane
+        self._segmentList = []
+        self._segmentCache = None
+
+    def _slice(self, column):
+        return column[self._traceSet._offsets[self._index]:self._traceSet._offsets[self._index+1]]
+
+    @property
+    def _vlist2(self):
+        return [Point2(x, y) for x, y in self._slice(self._traceSet._xy).tolist()]
+
+    @property
+    def _vlist3(self):
+        return [tuple(v) for v in self._slice(self._traceSet._xyz).tolist()]
+
+    @property
+    def _ptype(self):
+        return self._slice(self._traceSet._ptype).tolist()
+
+    @property
+    def _colorindex(self):
+        return self._slice(self._traceSet._colorindex).tolist()
+
+    @property
+    def _colornum(self):
+        return self._slice(self._traceSet._colornum).tolist()
+
+    @property
+    def _rvalue(self):
+        return self._slice(self._traceSet._rvalue).tolist()
+
+    @property
+    def _gvalue(self):
+        return self._slice(self._traceSet._gvalue).tolist()
+
+    @property
+    def _bvalue(self):
+        return self._slice(self._traceSet._bvalue).tolist()
+
+    def _read_only(self, *args, **kwargs):
+        raise TypeError("FracTraceView is read-only, use TraceSet.to_FracTraces() to get editable traces")
+
+    build_circular_trace = append_vertex3 = append_ptype = _read_only
+    append_color_index = append_color_num = append_color_R = append_color_G = append_color_B = _read_only
+    pop_all = reverse_all = extend_other_lists = append_if_same_endpoints = build_vlist2 = _read_only
+
+    def is_endpoint(self, o, tol):
+        '''
+        Checks if the specified point is an endpoint
+        :param o: another Point2 to check for endpointness
+        :param tol: distance tolerance to check the specified point for
+        :return: None if point o is not an endpoint,
+                the index of the matching endpoint in this FracTrace if o lies within the distance tolerance of an endpoint
+        '''
+        xy = self._slice(self._traceSet._xy)
+        if len(xy) < 1:
+            return None
+        if Point2(xy[0, 0], xy[0, 1]).same_point(o, tol):
+            return 0
+        if Point2(xy[-1, 0], xy[-1, 1]).same_point(o, tol):
+            return len(xy)-1
+        return None
+
+    def to_segments(self):
+        '''
+        returns a list of StraightLine2 objects representing this line as a list of straight line segments
+        :return: A list of segments representing this line
+        '''
+        xy = self._slice(self._traceSet._xy).tolist()
+        return [StraightLine2(xy[i-1][0], xy[i-1][1], xy[i][0], xy[i][1]) for i in range(1, len(xy))]
+
+    def _segment_cache(self):
+        '''
+        Returns the cache of the segment array, sliced from the TraceSet's segments(), which never goes stale
+        :return: dict of the 'segs' array and, once built, the 'bbox' and 'bvh' of the segments
+        '''
+        if self._segmentCache is None:
+            offsets = self._traceSet.segment_offsets()
+            self._segmentCache = {'segs': self._traceSet.segments()[0][offsets[self._index]:offsets[self._index+1]]}
+        return self._segmentCache
+
+    def get_trace_length2(self):
+        """returns the 2D length of the trace by summing up each segment length
+        :return: length of this line segment
+        """
+        return float(self._traceSet.trace_lengths()[self._index])
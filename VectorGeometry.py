@@ -0,0 +1,348 @@
+__author__ = 'ryshackleton'
+
+import numpy as np
+from Profiling import PROFILER
+
+'''
+Array versions of the Point2 and StraightLine2 geometry primitives.
+Segments are stored as (N,4) float64 arrays of x0,y0,x1,y1 rows and points as (N,2) arrays of x,y rows.
+The arithmetic is done in the same order as the scalar versions, so results match them exactly.
+'''
+
+
+def segment_array(segments):
+    '''
+    :param segments: list of StraightLine2 segments
+    :return: (N,4) array of the segments
+    '''
+    return np.array([(s._v0._x, s._v0._y, s._v1._x, s._v1._y) for s in segments], dtype=np.float64).reshape(-1, 4)
+
+
+def same_points(p, o, tolerance=1e-03):
+    '''
+    Array version of Point2.same_point()
+    :param p: (N,2) array of points
+    :param o: (N,2) array of points to compare to
+    :param tolerance: the minimum distance to be considered the same point
+    :return: (N) boolean array, True where the points are closer than the tolerance
+    '''
+    dx = p[:, 0] - o[:, 0]
+    dy = p[:, 1] - o[:, 1]
+    return (dx*dx + dy*dy)**0.5 < tolerance
+
+
+def segment_intersections(segsA, segsB, tolerance=1e-03):
+    '''
+    Array version of StraightLine2.intersectionPoints() for pairs of segments segsA[i], segsB[i]
+    :param segsA: (N,4) array of segments ("this" segment in StraightLine2.intersectionPoints())
+    :param segsB: (N,4) array of segments to be checked against
+    :param tolerance: distance tolerance for sameness of points
+    :return: tuple (pairs, xy) where pairs is the index of the segment pair of each intersection
+             and xy is the (K,2) array of intersection points, in the same order that
+             StraightLine2.intersectionPoints() would return them pair by pair
+    '''
+    segsA = np.asarray(segsA, dtype=np.float64).reshape(-1, 4)
+    segsB = np.asarray(segsB, dtype=np.float64).reshape(-1, 4)
+
+    xlk = segsA[:, 2] - segsA[:, 0]
+    xnm = segsB[:, 2] - segsB[:, 0]
+    xmk = segsB[:, 0] - segsA[:, 0]
+    ylk = segsA[:, 3] - segsA[:, 1]
+    ynm = segsB[:, 3] - segsB[:, 1]
+    ymk = segsB[:, 1] - segsA[:, 1]
+
+    denom = xnm*ylk - xlk*ynm
+    crossing = np.fabs(denom) > tolerance
+    with np.errstate(divide='ignore', invalid='ignore'):
+        s = (xnm*ymk - xmk*ynm) / denom
+        t = (xlk*ymk - ylk*xmk) / denom
+    hit = crossing & ~((s < 0.0) | (t < 0.0) | (s > 1.0) | (t > 1.0))
+    hitXY = np.column_stack((segsA[hit, 0] + xlk[hit]*s[hit], segsA[hit, 1] + ylk[hit]*s[hit]))
+
+    # parallel lines: test if the end-points of segsB lie on an end-point of segsA
+    parallel = ~crossing
+    v0 = parallel & (same_points(segsA[:, 0:2], segsB[:, 0:2], tolerance) |
+                     same_points(segsA[:, 2:4], segsB[:, 0:2], tolerance))
+    v1 = parallel & (same_points(segsA[:, 0:2], segsB[:, 2:4], tolerance) |
+                     same_points(segsA[:, 2:4], segsB[:, 2:4], tolerance))
+
+    pairs = np.concatenate((np.nonzero(hit)[0], np.nonzero(v0)[0], np.nonzero(v1)[0]))
+    rank = np.concatenate((np.zeros(hit.sum(), dtype=np.int8), np.ones(v0.sum(), dtype=np.int8),
+                           np.full(v1.sum(), 2, dtype=np.int8)))
+    xy = np.concatenate((hitXY, segsB[v0, 0:2], segsB[v1, 2:4]))
+    order = np.lexsort((rank, pairs))
+    PROFILER.count('segmentTests', len(segsA))
+    PROFILER.count('intersections', len(pairs))
+    return pairs[order], xy[order]
+
+
+def all_segment_intersections(segsA, segsB, tolerance=1e-03, maxPairs=1000000):
+    '''
+    Array version of StraightLine2.intersectionPoints() for every pair of a segment of segsA and a segment of segsB
+    :param segsA: (N,4) array of segments ("this" segment in StraightLine2.intersectionPoints())
+    :param segsB: (M,4) array of segments to be checked against
+    :param tolerance: distance tolerance for sameness of points
+    :param maxPairs: maximum number of segment pairs tested at once, limits memory use
+    :return: tuple (i, j, xy) of the index in segsA and in segsB of the segments of each intersection and the (K,2)
+             array of intersection points, in the order that looping over segsA, then segsB, would find them
+    '''
+    segsA = np.asarray(segsA, dtype=np.float64).reshape(-1, 4)
+    segsB = np.asarray(segsB, dtype=np.float64).reshape(-1, 4)
+    found = {'i': [np.zeros(0, dtype=np.int64)], 'j': [np.zeros(0, dtype=np.int64)], 'xy': [np.zeros((0, 2))]}
+    if len(segsB) == 0:
+        return found['i'][0], found['j'][0], found['xy'][0]
+    rowsPerBlock = max(maxPairs // len(segsB), 1)
+    for start in range(0, len(segsA), rowsPerBlock):
+        rows = np.arange(start, min(start + rowsPerBlock, len(segsA)))
+        i = np.repeat(rows, len(segsB))
+        j = np.tile(np.arange(len(segsB)), len(rows))
+        pairs, xy = segment_intersections(segsA[i], segsB[j], tolerance)
+        found['i'].append(i[pairs])
+        found['j'].append(j[pairs])
+        found['xy'].append(xy)
+    return np.concatenate(found['i']), np.concatenate(found['j']), np.concatenate(found['xy'])
+
+
+def distances(p, o):
+    '''
+    Array version of Point2.distance_to()
+    :param p: (N,2) array of points
+    :param o: (N,2) array of points, or one (2) point, to measure the distance to
+    :return: (N) array of distances
+    '''
+    p = np.asarray(p, dtype=np.float64)
+    o = np.asarray(o, dtype=np.float64)
+    dx = p[..., 0] - o[..., 0]
+    dy = p[..., 1] - o[..., 1]
+    return (dx*dx + dy*dy)**0.5
+
+
+def _projections(segs, px, py, tolerance):
+    '''
+    Shared part of closest_points() and minimum_distances(), StraightLine2.closestPoint() arithmetic
+    :return: tuple (dx, dy, t, degenerate, onSegment, d0, d1) of arrays
+    '''
+    dx = segs[:, 2] - segs[:, 0]
+    dy = segs[:, 3] - segs[:, 1]
+    d = dx*dx + dy*dy
+    n = dx*(px - segs[:, 0]) + dy*(py - segs[:, 1])
+    degenerate = d == 0.0
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t = n / np.where(degenerate, 1.0, d)
+    onSegment = ~degenerate & (t > 0.0) & ((t - 1.0) < tolerance)
+    ex0 = segs[:, 0] - px
+    ey0 = segs[:, 1] - py
+    ex1 = segs[:, 2] - px
+    ey1 = segs[:, 3] - py
+    return dx, dy, t, degenerate, onSegment, (ex0*ex0 + ey0*ey0)**0.5, (ex1*ex1 + ey1*ey1)**0.5
+
+
+def closest_points(segs, px, py, tolerance=1e-03):
+    '''
+    Array version of StraightLine2.closestPoint(), with the same tolerance rule: a projection with parameter
+    0 < t < 1 + tolerance lies on the segment, otherwise the nearer end point is the closest point
+    :param segs: (N,4) array of segments
+    :param px: x coordinate of the point, or (N) array of one point per segment
+    :param py: y coordinate of the point, or (N) array of one point per segment
+    :param tolerance: tolerance on the projection parameter, as in StraightLine2.closestPoint()
+    :return: tuple (x, y) of (N) arrays of the closest points, zero length segments give the point itself
+    '''
+    segs = np.asarray(segs, dtype=np.float64).reshape(-1, 4)
+    dx, dy, t, degenerate, onSegment, d0, d1 = _projections(segs, px, py, tolerance)
+    nearer0 = d0 < d1
+    x = np.where(onSegment, dx*t + segs[:, 0], np.where(nearer0, segs[:, 0], segs[:, 2]))
+    y = np.where(onSegment, dy*t + segs[:, 1], np.where(nearer0, segs[:, 1], segs[:, 3]))
+    x = np.where(degenerate, px, x)
+    y = np.where(degenerate, py, y)
+    return x, y
+
+
+def minimum_distances(segs, px, py, tolerance=1e-03):
+    '''
+    Array version of StraightLine2.minimumDistance(), with the tolerance rule of closest_points()
+    :param segs: (N,4) array of segments
+    :param px: x coordinate of the point, or (N) array of one point per segment
+    :param py: y coordinate of the point, or (N) array of one point per segment
+    :param tolerance: tolerance on the projection parameter, as in StraightLine2.minimumDistance()
+    :return: (N) array of distances, 0 for zero length segments as in StraightLine2.minimumDistance()
+    '''
+    segs = np.asarray(segs, dtype=np.float64).reshape(-1, 4)
+    dx, dy, t, degenerate, onSegment, d0, d1 = _projections(segs, px, py, tolerance)
+    ex = dx*t + segs[:, 0] - px
+    ey = dy*t + segs[:, 1] - py
+    distance = np.where(onSegment, (ex*ex + ey*ey)**0.5, np.minimum(d0, d1))
+    return np.where(degenerate, 0.0, distance)
+
+
+def polygon_clipped_pieces(segs, polygonSegs, cx, cy, radius, tolerance=1e-03):
+    '''
+    Array version of clipping segments against a polygonal circle, as FracTrace.trace_length_inside_circular_scanline()
+    does: segments whose closest_points() lie within the radius and whose end points both lie within the radius are
+    kept whole, a segment with one end point inside is cut at each of its intersections with the polygon, and a
+    segment with both end points outside keeps the pieces between consecutive pairs of its intersections
+    :param segs: (N,4) array of segments
+    :param polygonSegs: (K,4) array of the segments of the polygon approximating the circle
+    :param cx: X coordinate of the center of the circle
+    :param cy: Y coordinate of the center of the circle
+    :param radius: Radius of the circle
+    :param tolerance: distance tolerance for the intersections with the polygon
+    :return: tuple (pieceSeg, pieceLength) of the index of the segment of each piece inside the circle and its length,
+             in the order the scalar loop over the segments would measure them
+    '''
+    segs = np.asarray(segs, dtype=np.float64).reshape(-1, 4)
+    polygonSegs = np.asarray(polygonSegs, dtype=np.float64).reshape(1, -1, 4)
+    return polygons_clipped_pieces(segs, np.zeros(len(segs), dtype=np.int64), polygonSegs,
+                                   np.array([cx], dtype=np.float64), np.array([cy], dtype=np.float64), radius, tolerance)
+
+
+def polygons_clipped_pieces(segs, circle, polygonSegs, cx, cy, radius, tolerance=1e-03, maxPairs=1000000):
+    '''
+    polygon_clipped_pieces() for many circles of the same radius at once, segment i is clipped against circle circle[i]
+    :param segs: (N,4) array of segments
+    :param circle: (N) array of the index of the circle of each segment
+    :param polygonSegs: (C,K,4) array of the segments of the polygon approximating each circle
+    :param cx: (C) array of the X coordinates of the centers of the circles
+    :param cy: (C) array of the Y coordinates of the centers of the circles
+    :param radius: Radius of the circles
+    :param tolerance: distance tolerance for the intersections with the polygons
+    :param maxPairs: maximum number of segment and polygon side pairs tested at once, limits memory use
+    :return: tuple (pieceSeg, pieceLength) of the index of the segment of each piece inside its circle and its length,
+             ordered by segment and along each segment as polygon_clipped_pieces() orders them
+    '''
+    segs = np.asarray(segs, dtype=np.float64).reshape(-1, 4)
+    circle = np.asarray(circle, dtype=np.int64).reshape(-1)
+    polygonSegs = np.asarray(polygonSegs, dtype=np.float64)
+    px = np.asarray(cx, dtype=np.float64)[circle]
+    py = np.asarray(cy, dtype=np.float64)[circle]
+    center = np.column_stack((px, py))
+    near = distances(np.column_stack(closest_points(segs, px, py)), center) <= radius
+    v0in = distances(segs[:, 0:2], center) <= radius
+    v1in = distances(segs[:, 2:4], center) <= radius
+    PROFILER.count('closestPointTests', len(segs))
+
+    whole = np.nonzero(near & v0in & v1in)[0]
+    crossing = np.nonzero(near & ~(v0in & v1in))[0]
+    # every crossing segment against every side of its own polygon, in the order of all_segment_intersections()
+    numSides = polygonSegs.shape[1]
+    found = {'seg': [np.zeros(0, dtype=np.int64)], 'xy': [np.zeros((0, 2))]}
+    rowsPerBlock = max(maxPairs // max(numSides, 1), 1)
+    for start in range(0, len(crossing), rowsPerBlock):
+        rows = np.repeat(crossing[start:start + rowsPerBlock], numSides)
+        sides = np.tile(np.arange(numSides), len(rows) // max(numSides, 1))
+        pairs, xy = segment_intersections(segs[rows], polygonSegs[circle[rows], sides], tolerance)
+        found['seg'].append(rows[pairs])
+        found['xy'].append(xy)
+    seg = np.concatenate(found['seg'])
+    xy = np.concatenate(found['xy'])
+    # rank of each intersection among the intersections of its segment
+    rank = np.arange(len(seg)) - np.searchsorted(seg, seg)
+    oneIn = v0in[seg] | v1in[seg]
+    inside = np.where(v0in[seg][:, None], segs[seg, 0:2], segs[seg, 2:4])
+    # segments with both end points outside: every second intersection closes a piece started by the one before
+    span = np.nonzero(~oneIn & (rank % 2 == 1))[0]
+
+    pieceSeg = np.concatenate((whole, seg[oneIn], seg[span]))
+    pieceRank = np.concatenate((np.zeros(len(whole), dtype=np.int64), rank[oneIn], rank[span]))
+    pieceLength = np.concatenate((distances(segs[whole, 0:2], segs[whole, 2:4]),
+                                  distances(xy[oneIn], inside[oneIn]), distances(xy[span], xy[span - 1])))
+    order = np.lexsort((pieceRank, pieceSeg))
+    return pieceSeg[order], pieceLength[order]
+
+
+def distances_to_segments(segs, px, py):
+    '''
+    Euclidean distance from a point to each segment (clamped projection onto the segment)
+    :param segs: (N,4) array of segments
+    :param px: x coordinate of the point
+    :param py: y coordinate of the point
+    :return: (N) array of distances, zero length segments give the distance to their end point
+    '''
+    dx = segs[:, 2] - segs[:, 0]
+    dy = segs[:, 3] - segs[:, 1]
+    d = dx*dx + dy*dy
+    n = dx*(px - segs[:, 0]) + dy*(py - segs[:, 1])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t = np.where(d > 0.0, n / d, 0.0)
+    t = np.clip(t, 0.0, 1.0)
+    ex = segs[:, 0] + dx*t - px
+    ey = segs[:, 1] + dy*t - py
+    return (ex*ex + ey*ey)**0.5
+
+
+def circle_chord_parameters(segs, cx, cy):
+    '''
+    Radius independent part of clipping segments against circles centered at (cx, cy)
+    :param segs: (N,4) array of segments
+    :param cx: X coordinate of the center of the circle
+    :param cy: Y coordinate of the center of the circle
+    :return: tuple (t0, h2, segLen) of arrays: segment parameter of the point closest to the center on the
+             infinite line through each segment, squared distance from the center to that line, and segment length
+    '''
+    dx = segs[:, 2] - segs[:, 0]
+    dy = segs[:, 3] - segs[:, 1]
+    a = dx*dx + dy*dy
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t0 = np.where(a > 0.0, (dx*(cx - segs[:, 0]) + dy*(cy - segs[:, 1])) / a, 0.0)
+    ex = segs[:, 0] + dx*t0 - cx
+    ey = segs[:, 1] + dy*t0 - cy
+    return t0, ex*ex + ey*ey, a**0.5
+
+
+def clipped_chord_lengths(t0, h2, segLen, radius):
+    '''
+    Length of each segment inside a circle, from the output of circle_chord_parameters()
+    :param radius: Radius of the circle
+    :return: (N) array of the length of each segment that lies inside the circle
+    '''
+    with np.errstate(divide='ignore', invalid='ignore'):
+        halfChord = np.sqrt(np.maximum(radius*radius - h2, 0.0)) / segLen
+    t1 = np.maximum(t0 - halfChord, 0.0)
+    t2 = np.minimum(t0 + halfChord, 1.0)
+    return np.where((segLen > 0.0) & (h2 < radius*radius), np.maximum(t2 - t1, 0.0) * segLen, 0.0)
+
+
+def chord_crossings(t0, h2, segLen, radius, closedEnd):
+    '''
+    Number of times each segment crosses a circle, from the output of circle_chord_parameters()
+    A crossing at the end of a segment (parameter 1) only counts when closedEnd is True, so a polyline vertex
+    lying on the circle is counted once, by the segment that starts there; tangent segments do not cross
+    :param radius: Radius of the circle
+    :param closedEnd: boolean array, True for the last segment of each polyline
+    :return: integer array of 0, 1 or 2 crossings of each segment
+    '''
+    with np.errstate(divide='ignore', invalid='ignore'):
+        halfChord = np.sqrt(np.maximum(radius*radius - h2, 0.0)) / segLen
+    cuts = (segLen > 0.0) & (h2 < radius*radius)
+    count = np.zeros(np.broadcast(t0, h2, segLen).shape, dtype=np.int64)
+    for t in (t0 - halfChord, t0 + halfChord):
+        count += cuts & (t >= 0.0) & ((t < 1.0) | (closedEnd & (t <= 1.0)))
+    return count
+
+
+def segment_lengths_inside_circle(segs, cx, cy, radius):
+    '''
+    Exact length of each segment that lies inside a circle
+    :param segs: (N,4) array of segments
+    :param cx: X coordinate of the center of the circle
+    :param cy: Y coordinate of the center of the circle
+    :param radius: Radius of the circle
+    :return: (N) array of clipped segment lengths
+    '''
+    segs = np.asarray(segs, dtype=np.float64).reshape(-1, 4)
+    t0, h2, segLen = circle_chord_parameters(segs, cx, cy)
+    return clipped_chord_lengths(t0, h2, segLen, radius)
+
+
+def segment_crossings_of_circle(segs, cx, cy, radius, closedEnd):
+    '''
+    Number of times each segment of a polyline crosses a circle
+    :param segs: (N,4) array of segments
+    :param cx: X coordinate of the center of the circle
+    :param cy: Y coordinate of the center of the circle
+    :param radius: Radius of the circle
+    :param closedEnd: (N) boolean array, True for the last segment of each polyline (see chord_crossings())
+    :return: (N) integer array of crossings
+    '''
+    segs = np.asarray(segs, dtype=np.float64).reshape(-1, 4)
+    t0, h2, segLen = circle_chord_parameters(segs, cx, cy)
+    return chord_crossings(t0, h2, segLen, radius, closedEnd)
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+
+__author__ = 'ryshackleton'
+
+import os
+import sys
+import math
+import json
+import argparse
+import datetime
+import platform
+import tempfile
+import time
+import numpy as np
+import MVE_importer
+from TraceJoin import concatenate_traces
+from TraceIntersections import find_trace_intersections
+from SpatialIndex import PointIndex
+from CircularScanlines import compute_p21
+from SyntheticNetworks import generate_network, write_mve_traces, write_mve_grid
+
+# trace counts of the scaling suite, the area grows with the count so the trace density stays the same
+SUITE_SIZES = (1000, 2000, 4000, 8000, 16000)
+# traces per unit area of the synthetic networks, and distance between circular scanline centers
+SUITE_DENSITY = 1.0
+SUITE_GRID_SPACING = 1.0
+
+
+def timed(function, *args):
+    '''
+    :return: tuple (result, wall time in seconds) of one call of function(*args)
+    '''
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+
+def benchmark_import(sizes=(1000, 2000, 4000, 8000, 16000, 32000)):
+    '''
+    Times MVE_importer.build_FracTraces() and build_TraceSet() on files with an increasing number of traces,
+    synthetic networks (SyntheticNetworks) of the suite density
+    :param sizes: numbers of traces to time
+    :return: list of (numTraces, build_FracTraces seconds, build_TraceSet seconds)
+    '''
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for n in sizes:
+            filename = os.path.join(tmp, 'traces_{}.txt'.format(n))
+            network = generate_network(n, math.sqrt(n / SUITE_DENSITY), seed=0)
+            write_mve_traces(filename, network)
+            results.append((len(network), timed(MVE_importer.build_FracTraces, filename)[1],
+                            timed(MVE_importer.build_TraceSet, filename)[1]))
+    return results
+
+
+def benchmark_suite(sizes=SUITE_SIZES, radius=1.0, tortuosity=5.0, seed=0):
+    '''
+    Times every stage of the analyses on synthetic networks (SyntheticNetworks) with an increasing number of traces:
+        -import: MVE_importer.build_FracTraces() and build_TraceSet()
+        -concatenate: TraceJoin.concatenate_traces()
+        -intersections: all pairs trace intersections, TraceIntersections.find_trace_intersections()
+        -intersectionsPerRadius: counting the intersections within radius of every grid point
+        -p21: CircularScanlines.compute_p21() at every grid point
+    :param sizes: mean numbers of traces of the networks
+    :param radius: radius of the circular scanlines
+    :param tortuosity: heading change per trace vertex in degrees, see SyntheticNetworks.generate_network()
+    :param seed: random seed of the networks
+    :return: dict of the metadata of the run and a list of results, one dict per size
+    '''
+    runs = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for n in sizes:
+            size = math.sqrt(n / SUITE_DENSITY)
+            traceFileName = os.path.join(tmp, 'traces_{}.txt'.format(n))
+            gridFileName = os.path.join(tmp, 'grid_{}.txt'.format(n))
+            write_mve_traces(traceFileName, generate_network(n, size, tortuosity=tortuosity, seed=seed))
+            write_mve_grid(gridFileName, size, SUITE_GRID_SPACING)
+
+            seconds = {}
+            seconds['buildFracTraces'] = timed(MVE_importer.build_FracTraces, traceFileName)[1]
+            traces, seconds['buildTraceSet'] = timed(MVE_importer.build_TraceSet, traceFileName)
+            grid, seconds['buildPointSet'] = timed(MVE_importer.build_PointSet, gridFileName)
+            grid_xy = grid.xy()
+            seconds['concatenate'] = timed(concatenate_traces, traces)[1]
+            intersections, seconds['intersections'] = timed(find_trace_intersections, traces)
+            intersectsXY = intersections.unique_points()[0]
+            seconds['intersectionsPerRadius'] = timed(
+                lambda: PointIndex(intersectsXY, radius).count_within(grid_xy, radius))[1]
+            seconds['p21'] = timed(compute_p21, grid_xy, radius, traces)[1]
+            runs.append({'traces': len(traces), 'vertices': int(traces.num_vertices()),
+                         'segments': int(len(traces.segments()[0])), 'gridPoints': int(len(grid_xy)),
+                         'intersections': int(len(intersectsXY)), 'seconds': seconds})
+
+    return {'timestamp': datetime.datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(), 'numpy': np.__version__, 'platform': platform.platform(),
+            'sizes': list(sizes), 'radius': radius, 'tortuosity': tortuosity, 'seed': seed,
+            'density': SUITE_DENSITY, 'gridSpacing': SUITE_GRID_SPACING, 'results': runs}
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Times the parsing and analysis stages at increasing sizes")
+    parser.add_argument('sizes', nargs='*', type=int, help="numbers of traces to time")
+    parser.add_argument('--suite', action='store_true',
+                        help="time every analysis stage on synthetic networks instead of only the import")
+    parser.add_argument('--json', dest='jsonFileName', default=None,
+                        help="write the suite results with the python and numpy versions to this JSON file")
+    parser.add_argument('--radius', type=float, default=1.0, help="circular scanline radius of the suite")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    if not args.suite and args.jsonFileName is None:
+        sizes = args.sizes or (1000, 2000, 4000, 8000, 16000, 32000)
+        print('traces  build_FracTraces(s)  us/trace  build_TraceSet(s)  us/trace')
+        for n, tFrac, tSet in benchmark_import(sizes):
+            # linear scaling shows up as a constant time per trace
+            print('{:6d}  {:19.3f}  {:8.1f}  {:17.3f}  {:8.1f}'.format(n, tFrac, 1e6 * tFrac / n, tSet, 1e6 * tSet / n))
+        return
+
+    report = benchmark_suite(args.sizes or SUITE_SIZES, args.radius, seed=args.seed)
+    stages = list(report['results'][0]['seconds']) if len(report['results']) > 0 else []
+    print('traces  ' + '  '.join(stages))
+    for run in report['results']:
+        print('{:6d}  '.format(run['traces']) +
+              '  '.join('{:{}.3f}'.format(run['seconds'][s], len(s)) for s in stages))
+    if args.jsonFileName is not None:
+        with open(args.jsonFileName, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
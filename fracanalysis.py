@@ -0,0 +1,279 @@
+#!/usr/bin/env python3
+
+__author__ = 'ryshackleton'
+
+import sys
+import argparse
+import numpy as np
+import MVE_importer
+import MVE_cache
+import TraceLengths
+import FractureIntersectionsPerRadius
+import p21_within_circular_scanlines
+import p10_straight_scanlines
+import mauldon_circular_scanlines
+from TraceJoin import concatenate_traces
+from TraceIntersections import find_trace_intersections
+from SyntheticNetworks import write_mve_traces
+from ResultWriters import FORMATS
+from PlaneProjection import MAP_VIEW, parse_plane, map_view_warning
+from Profiling import PROFILER
+
+'''
+One command running any number of analyses of the same fracture traces, e.g.
+
+    fracanalysis.py traces.txt lengths lengths.txt 0.3 intersections grid.txt 1,2 ipr.txt p21 grid.txt 1,2 p21.txt
+
+Each stage is a subcommand followed by its own arguments, like the script of the same analysis.
+The traces (and each grid) are parsed once, and the concatenated traces, their segment index and the intersection
+points are built the first time a stage needs them and shared by every later stage, so a full report costs one
+parse and one index build. Stage names cannot be used as bare arguments (write ./p21 for a file named p21).
+'''
+
+# intersection points closer than this are the same point, as in TraceLengths and FractureIntersectionsPerRadius
+INTERSECTION_TOLERANCE = 1e-03
+
+
+class Analysis():
+    """The parsed inputs of a fracanalysis run and the data derived from them, each built once on first use"""
+
+    def __init__(self, traceFileName, useCache=True, coordinatePlane=MAP_VIEW):
+        """
+        :param traceFileName: Midland Valley-Move export of the fracture traces
+        :param useCache: reuse the parsed files from the on-disk parse cache (see MVE_cache)
+        :param coordinatePlane: normal of the plane to analyse the traces in, or PlaneProjection.FIT_PLANE,
+                                the grids are projected onto the same plane as the traces
+        """
+        self._traceFileName = traceFileName
+        self._useCache = useCache
+        self._coordinatePlane = coordinatePlane
+        self._traces = {}
+        self._grids = {}
+        self._intersections = {}
+
+    def traces(self, joinTolerance=None):
+        '''
+        :param joinTolerance: None for the traces as parsed, or the distance tolerance to concatenate traces whose
+                                endpoints are closer than it (see TraceJoin)
+        :return: TraceSet of the traces
+        '''
+        if joinTolerance not in self._traces:
+            if joinTolerance is None:
+                with PROFILER.phase('parse'):
+                    if self._useCache:
+                        self._traces[None] = MVE_cache.load_TraceSet(self._traceFileName, None, self._coordinatePlane)
+                    else:
+                        self._traces[None] = MVE_importer.build_TraceSet(self._traceFileName, self._coordinatePlane)
+                warning = map_view_warning(self._traces[None]._coordinatePlane, self._traces[None]._xyz)
+                if warning is not None:
+                    print(warning, file=sys.stderr)
+            else:
+                traceSet = self.traces()
+                with PROFILER.phase('concatenate'):
+                    traces, junctions = concatenate_traces(traceSet, joinTolerance)
+                for x, y, ids, joined in junctions:
+                    print('Ambiguous junction of traces {} at {} {}: joined {}'.format(ids, x, y, joined))
+                self._traces[joinTolerance] = traces
+        return self._traces[joinTolerance]
+
+    def grid(self, gridFileName):
+        '''
+        :return: PointSet of the points of a grid file (a PointSetFile reading them in chunks without the cache),
+                 projected onto the coordinate plane of the traces
+        '''
+        if gridFileName not in self._grids:
+            plane = self.traces()._coordinatePlane
+            with PROFILER.phase('parse'):
+                if self._useCache:
+                    self._grids[gridFileName] = MVE_cache.load_PointSet(gridFileName, None, plane)
+                else:
+                    # read again by every stage, one chunk at a time
+                    self._grids[gridFileName] = MVE_importer.PointSetFile(gridFileName, plane)
+        return self._grids[gridFileName]
+
+    def intersections(self, joinTolerance=None):
+        '''
+        :param joinTolerance: intersect the traces concatenated with this tolerance, see traces()
+        :return: (U,2) array of the unique intersection points of the traces
+        '''
+        if joinTolerance not in self._intersections:
+            traces = self.traces(joinTolerance)
+            with PROFILER.phase('intersections'):
+                found = find_trace_intersections(traces, INTERSECTION_TOLERANCE)
+                self._intersections[joinTolerance] = found.unique_points(INTERSECTION_TOLERANCE)[0]
+        return self._intersections[joinTolerance]
+
+
+def run_lengths(analysis, args):
+    traces = analysis.traces(args.tolerance)
+    intersectsXY = analysis.intersections(args.tolerance)
+    with PROFILER.phase('write'):
+        TraceLengths.write_trace_lengths(args.outputFileName, traces, intersectsXY, args.format)
+
+
+def run_concat(analysis, args):
+    traces = analysis.traces(args.tolerance)
+    with PROFILER.phase('write'):
+        write_mve_traces(args.outputFileName, traces)
+
+
+def run_intersections(analysis, args):
+    FractureIntersectionsPerRadius.main(analysis._traceFileName, args.gridFileName, args.radii, args.outputFileName,
+                                        args.workers, None, args.incremental, args.format,
+                                        traces=analysis.traces(args.join),
+                                        intersectsXY=analysis.intersections(args.join),
+                                        grid=analysis.grid(args.gridFileName))
+
+
+def run_p21(analysis, args):
+    p21_within_circular_scanlines.main(analysis._traceFileName, args.gridFileName, args.radii, args.outputFileName,
+                                       args.method, analysis._useCache, args.workers, args.cellSize, None,
+                                       args.incremental, args.format, traces=analysis.traces(args.join),
+                                       grid=analysis.grid(args.gridFileName))
+
+
+def run_mauldon(analysis, args):
+    mauldon_circular_scanlines.main(analysis._traceFileName, args.gridFileName, args.radii, args.outputFileName,
+                                    analysis._useCache, args.format, traces=analysis.traces(args.join),
+                                    grid=analysis.grid(args.gridFileName))
+
+
+def run_scanlines(analysis, args):
+    azimuths = list(args.azimuths or [])
+    if args.sweep is not None:
+        azimuths += np.arange(0.0, 180.0, args.sweep).tolist()
+    p10_straight_scanlines.main(analysis._traceFileName, args.outputFileName, azimuths, args.spacings,
+                                args.scanlineFileName, args.bounds, args.positionsFileName, analysis._useCache,
+                                args.format, traces=analysis.traces(args.join))
+
+
+def _number_list(value):
+    return [float(v) for v in value.split(',')]
+
+
+def _stage_parsers():
+    '''
+    :return: dict of stage name: (argparse parser of the stage's arguments, function running the stage)
+    '''
+    stages = {}
+
+    def stage(name, run, description):
+        parser = argparse.ArgumentParser(prog='fracanalysis.py ... ' + name, description=description)
+        stages[name] = (parser, run)
+        return parser
+
+    def join_option(parser):
+        parser.add_argument('--join', type=float, default=None, metavar='TOLERANCE',
+                            help="analyse the traces concatenated with this endpoint distance tolerance "
+                                 "(shared with the lengths and concat stages using the same tolerance)")
+
+    def grid_arguments(parser):
+        parser.add_argument('gridFileName')
+        parser.add_argument('radii', help="radius, or comma separated radii like 0.5,1,2,5")
+        parser.add_argument('outputFileName')
+        parser.add_argument('--format', choices=FORMATS, default=None,
+                            help="output format (default: from the output file extension)")
+        join_option(parser)
+
+    p = stage('lengths', run_lengths, "Concatenates the traces and writes their lengths and intersections")
+    p.add_argument('outputFileName')
+    p.add_argument('tolerance', type=float, help="distance tolerance to concatenate traces with close endpoints")
+    p.add_argument('--format', choices=('tsv', 'npz'), default=None,
+                   help="output format (default: from the output file extension)")
+
+    p = stage('concat', run_concat, "Writes the concatenated traces as a Midland Valley-Move export")
+    p.add_argument('outputFileName')
+    p.add_argument('tolerance', type=float, help="distance tolerance to concatenate traces with close endpoints")
+
+    p = stage('intersections', run_intersections, "Counts trace intersections within a radius of grid points")
+    grid_arguments(p)
+    p.add_argument('--workers', type=int, default=1)
+    p.add_argument('--incremental', action='store_true')
+
+    p = stage('p21', run_p21, "Computes fracture length/area (p21) within circular scanlines")
+    grid_arguments(p)
+    p.add_argument('--method', choices=p21_within_circular_scanlines.METHODS, default='polygon')
+    p.add_argument('--workers', type=int, default=1)
+    p.add_argument('--cell-size', dest='cellSize', type=float, default=None)
+    p.add_argument('--incremental', action='store_true')
+
+    p = stage('mauldon', run_mauldon, "Computes Mauldon's circular scanline estimators")
+    grid_arguments(p)
+
+    p = stage('scanlines', run_scanlines, "Computes p10 and fracture spacings along straight scanlines")
+    p.add_argument('outputFileName')
+    p.add_argument('--azimuths', type=_number_list, default=None)
+    p.add_argument('--sweep', type=float, default=None)
+    p.add_argument('--spacings', type=_number_list, default=[1.0])
+    p.add_argument('--scanlines', dest='scanlineFileName', default=None)
+    p.add_argument('--bounds', type=_number_list, default=None)
+    p.add_argument('--positions', dest='positionsFileName', default=None)
+    p.add_argument('--format', choices=('tsv', 'npy', 'npz'), default=None,
+                   help="format of the output files (default: from the extension of each file)")
+    join_option(p)
+    return stages
+
+
+def parse_stages(argv, stages):
+    '''
+    Splits a command line into the global arguments and the arguments of each stage
+    :param argv: list of command line arguments
+    :param stages: dict from _stage_parsers()
+    :return: tuple (global arguments, [ (stage name, parsed stage arguments), ... ]) in command line order
+    '''
+    splits = [i for i, a in enumerate(argv) if a in stages] + [len(argv)]
+    chain = []
+    for start, stop in zip(splits[:-1], splits[1:]):
+        parser = stages[argv[start]][0]
+        args = parser.parse_args(argv[start + 1:stop])
+        if argv[start] == 'scanlines':
+            if not args.azimuths and args.sweep is None and args.scanlineFileName is None:
+                parser.error("give scanline families with --azimuths or --sweep, or explicit scanlines with "
+                             "--scanlines")
+            if args.bounds is not None and len(args.bounds) != 4:
+                parser.error("--bounds takes four numbers xmin,ymin,xmax,ymax")
+        if argv[start] == 'p21' and args.workers > 1 and args.method == 'fft':
+            parser.error("--workers is not supported by --method fft")
+        chain.append((argv[start], args))
+    return argv[:splits[0]], chain
+
+
+def main(argv=None):
+    stages = _stage_parsers()
+    parser = argparse.ArgumentParser(description="Runs a chain of fracture trace analyses sharing one parse of the "
+                                                 "traces, e.g. fracanalysis.py traces.txt lengths out.txt 0.3 "
+                                                 "p21 grid.txt 1,2 p21.txt",
+                                     epilog="stages: " + ', '.join(stages) + ", run 'fracanalysis.py traces.txt "
+                                            "STAGE -h' for the arguments of a stage")
+    parser.add_argument('fractureTraceFileName')
+    parser.add_argument('--no-cache', dest='useCache', action='store_false',
+                        help="always re-parse the input files instead of using the on-disk parse cache")
+    parser.add_argument('--plane', type=parse_plane, default=MAP_VIEW,
+                        help="coordinate plane to analyse the traces in: 'map' (default), 'fit' for the plane fit "
+                             "through all trace vertices (e.g. a cliff face), or its normal like 0,-1,0")
+    parser.add_argument('--profile', nargs='?', const='-', default=None, metavar='REPORT_FILE',
+                        help="record the time of each phase and the geometry primitive counts of the whole chain, "
+                             "and write them as JSON to REPORT_FILE (default: print them)")
+    argv = sys.argv[1:] if argv is None else list(argv)
+    globalArgv, chain = parse_stages(argv, stages)
+    args = parser.parse_args(globalArgv)
+    if len(chain) == 0:
+        parser.error("give at least one stage: " + ', '.join(stages))
+
+    if args.profile is not None:
+        PROFILER.enable()
+    try:
+        analysis = Analysis(args.fractureTraceFileName, args.useCache, args.plane)
+        for name, stageArgs in chain:
+            with PROFILER.phase('stage:' + name):
+                stages[name][1](analysis, stageArgs)
+        if args.profile is not None:
+            PROFILER.write_report(args.profile, command='fracanalysis', stages=[name for name, a in chain],
+                                  traces=len(analysis.traces()), coordinatePlane=analysis.traces()._coordinatePlane)
+    finally:
+        if args.profile is not None:
+            PROFILER.enable(False)
+
+
+if __name__ == '__main__':
+    main()
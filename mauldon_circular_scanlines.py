@@ -0,0 +1,69 @@
+__author__ = 'ryshackleton'
+
+import argparse
+import MVE_importer
+import MVE_cache
+from CircularScanlines import mauldon_estimators, parse_radii
+from ResultWriters import GridResultWriter, FORMATS
+
+# columns written for each radius, in order, after the grid point attributes
+MAULDON_COLUMNS = ('Crossings', 'FractureLengthPerArea', 'EndpointsInside',
+                   'MauldonIntensity', 'MauldonDensity', 'MauldonMeanLength')
+_ESTIMATOR_KEYS = ('n', 'p21', 'm', 'intensity', 'density', 'meanLength')
+
+
+def main(fractureTraceFileName,gridFileName,circularScanlineRadius,outputFileName,useCache=True,format=None,
+         traces=None,grid=None):
+    '''
+    Computes Mauldon's circular scanline estimators for any number of circular scanlines in one pass:
+        -n, the number of crossings of the circle by the traces, and the estimated intensity (p21) n/4r
+        -m, the number of trace endpoints inside the circle, and the estimated density (p20) m/2 pi r^2
+        -the measured fracture length/area (p21) inside the circle
+        -the estimated mean trace length pi r n/2m (nan where no endpoints are inside the circle)
+    :param fractureTraceFileName: filename of a Midland Valley-Move software export
+                                    representing lines representing fracture traces
+    :param gridFileName: file containing a Midland Valley-Move software export of points representing the grid
+                            of circular scanline centers
+    :param circularScanlineRadius: radius of the circular scanlines, or several radii as a list or a
+                                    comma separated string like '0.5,1,2,5'
+    :param outputFileName: name of the output file to write the grid points with the estimators,
+                            the columns of MAULDON_COLUMNS are written for each radius
+    :param useCache: reuse the parsed traces and grid from the on-disk parse cache (see MVE_cache)
+    :param format: output format, one of ResultWriters.FORMATS, None chooses from the extension of outputFileName
+    :param traces: TraceSet of the traces if they are already parsed, e.g. shared by the stages of fracanalysis
+    :param grid: PointSet (or MVE_importer.PointSetFile) of the grid if it is already parsed
+    :return: nothing
+    '''
+    try:
+        radii = parse_radii(circularScanlineRadius)
+    except (TypeError, ValueError) as e:
+        print("Invalid circularScanlineRadius: The radius must be a floating point number")
+        return
+
+    if traces is None:
+        traces = (MVE_cache.load_TraceSet if useCache else MVE_importer.build_TraceSet)(fractureTraceFileName)
+    if grid is None:
+        grid = MVE_cache.load_PointSet(gridFileName) if useCache else MVE_importer.PointSetFile(gridFileName)
+
+    resultNames = ['{}{}'.format(c, radius) for radius in radii for c in MAULDON_COLUMNS]
+    with GridResultWriter(outputFileName, resultNames, format) as writer:
+        for gridPoints in grid.iter_chunks():
+            estimators = mauldon_estimators(gridPoints.xy(), radii, traces)
+            writer.write(gridPoints, [estimators[k][:, ri] for ri in range(len(radii)) for k in _ESTIMATOR_KEYS])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Computes Mauldon's circular scanline estimators "
+                                                 "(intensity, density, p21 and mean trace length)")
+    parser.add_argument('fractureTraceFileName')
+    parser.add_argument('gridFileName')
+    parser.add_argument('radius_in_meters', help="radius, or comma separated radii like 0.5,1,2,5")
+    parser.add_argument('outputFileName')
+    parser.add_argument('--no-cache', dest='useCache', action='store_false',
+                        help="always re-parse the input files instead of using the on-disk parse cache")
+    parser.add_argument('--format', choices=FORMATS, default=None,
+                        help="output format: 'tsv' (MVE export), 'npy', 'npz' or 'raster' (regular grids only), "
+                             "default: from the output file extension")
+    args = parser.parse_args()
+    main(args.fractureTraceFileName, args.gridFileName, args.radius_in_meters, args.outputFileName, args.useCache,
+         args.format)
@@ -0,0 +1,116 @@
+__author__ = 'ryshackleton'
+
+import math
+import argparse
+import numpy as np
+import MVE_importer
+import MVE_cache
+from StraightScanlines import scanline_families, intersect_scanlines
+from ResultWriters import write_table
+
+
+def _number_list(value):
+    return [float(v) for v in value.split(',')]
+
+
+def main(fractureTraceFileName,outputFileName,azimuths=None,spacings=None,scanlineFileName=None,bounds=None,
+         positionsFileName=None,useCache=True,format=None,traces=None):
+    '''
+    Computes fractures per unit length (p10) and fracture spacings along straight scanlines
+    :param fractureTraceFileName: filename of a Midland Valley-Move software export
+                                    representing lines representing fracture traces
+    :param outputFileName: name of the output file to write one row per scanline with its p10 and mean spacing
+    :param azimuths: list of azimuths (degrees clockwise from north) of parallel scanline families to generate
+    :param spacings: list of spacings between the lines of each family, every azimuth is sampled at every spacing
+    :param scanlineFileName: optional Midland Valley-Move export of explicit scanlines,
+                                each line from the first to the last vertex of a trace is one scanline
+    :param bounds: (xmin, ymin, xmax, ymax) of the area covered by generated families, defaults to the traces' extent
+    :param positionsFileName: optional name of a file to write every intersection with its position along the
+                                scanline and the spacing from the previous intersection
+    :param useCache: reuse the parsed traces from the on-disk parse cache (see MVE_cache)
+    :param format: format of both output files, 'tsv', 'npy' or 'npz', None chooses from the extension of each file
+    :param traces: TraceSet of the traces if they are already parsed, e.g. shared by the stages of fracanalysis
+    :return: nothing
+    '''
+    load = MVE_cache.load_TraceSet if useCache else MVE_importer.build_TraceSet
+    if traces is None:
+        traces = load(fractureTraceFileName)
+    segs = traces.segments()[0]
+    if bounds is None and len(segs) > 0:
+        bounds = (float(segs[:, [0, 2]].min()), float(segs[:, [1, 3]].min()),
+                  float(segs[:, [0, 2]].max()), float(segs[:, [1, 3]].max()))
+
+    lines = [np.zeros((0, 4))]
+    lineAzimuth = [np.zeros(0)]
+    lineSpacing = [np.zeros(0)]
+    if azimuths and spacings and bounds is not None:
+        families = scanline_families(bounds, azimuths, spacings)
+        lines.append(families[0])
+        lineAzimuth.append(families[1])
+        lineSpacing.append(families[2])
+    if scanlineFileName is not None:
+        first, last = load(scanlineFileName).endpoints()
+        explicit = np.hstack((first, last))
+        explicit = explicit[~np.isnan(explicit).any(axis=1)]
+        lines.append(explicit)
+        lineAzimuth.append(np.degrees(np.arctan2(explicit[:, 2] - explicit[:, 0], explicit[:, 3] - explicit[:, 1]))
+                           % 360.0)
+        lineSpacing.append(np.full(len(explicit), np.nan))
+    lines = np.concatenate(lines)
+    lineAzimuth = np.concatenate(lineAzimuth)
+    lineSpacing = np.concatenate(lineSpacing)
+
+    # all scanlines, of every family and orientation, are intersected in one batch
+    result = intersect_scanlines(lines, traces)
+
+    write_table(outputFileName, {'Scanline': np.arange(len(lines)), 'Azimuth': lineAzimuth, 'Spacing': lineSpacing,
+                                 'x0': lines[:, 0], 'y0': lines[:, 1], 'x1': lines[:, 2], 'y1': lines[:, 3],
+                                 'Length': result.lengths(), 'Intersections': result.counts(), 'P10': result.p10(),
+                                 'MeanSpacing': result.mean_spacings()}, format)
+
+    if positionsFileName is not None:
+        # the first intersection of each scanline has no previous one
+        lineStart = result._lineStart
+        position = result._position
+        spacing = np.full(len(position), math.nan)
+        spacing[1:] = position[1:] - position[:-1]
+        spacing[lineStart[:-1][np.diff(lineStart) > 0]] = math.nan
+        write_table(positionsFileName, {'Scanline': np.repeat(np.arange(len(result)), np.diff(lineStart)),
+                                        'TraceId': result._traceId, 'Position': position,
+                                        'x': result._xy[:, 0], 'y': result._xy[:, 1],
+                                        'SpacingFromPrevious': spacing}, format)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Computes fractures per unit length (p10) and fracture spacings "
+                                                 "along straight scanlines")
+    parser.add_argument('fractureTraceFileName')
+    parser.add_argument('outputFileName')
+    parser.add_argument('--azimuths', type=_number_list, default=None,
+                        help="comma separated azimuths in degrees clockwise from north of parallel scanline families")
+    parser.add_argument('--sweep', type=float, default=None,
+                        help="generate families at every multiple of this many degrees from 0 to 180 "
+                             "(an orientation sweep)")
+    parser.add_argument('--spacings', type=_number_list, default=[1.0],
+                        help="comma separated spacings between the scanlines of each family (default 1)")
+    parser.add_argument('--scanlines', dest='scanlineFileName', default=None,
+                        help="MVE export of explicit scanlines, each trace from its first to last vertex")
+    parser.add_argument('--bounds', type=_number_list, default=None,
+                        help="xmin,ymin,xmax,ymax of the area covered by generated families "
+                             "(default: extent of the traces)")
+    parser.add_argument('--positions', dest='positionsFileName', default=None,
+                        help="also write every intersection position and spacing to this file")
+    parser.add_argument('--no-cache', dest='useCache', action='store_false',
+                        help="always re-parse the input files instead of using the on-disk parse cache")
+    parser.add_argument('--format', choices=('tsv', 'npy', 'npz'), default=None,
+                        help="format of the output files (default: from the extension of each file)")
+    args = parser.parse_args()
+    azimuths = list(args.azimuths or [])
+    if args.sweep is not None:
+        azimuths += np.arange(0.0, 180.0, args.sweep).tolist()
+    if len(azimuths) == 0 and args.scanlineFileName is None:
+        parser.error("give scanline families with --azimuths or --sweep, or explicit scanlines with --scanlines")
+    if args.bounds is not None and len(args.bounds) != 4:
+        parser.error("--bounds takes four numbers xmin,ymin,xmax,ymax")
+    main(args.fractureTraceFileName, args.outputFileName, azimuths, args.spacings, args.scanlineFileName,
+         args.bounds, args.positionsFileName, args.useCache, args.format)
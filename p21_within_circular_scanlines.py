@@ -2,71 +2,212 @@ __author__ = 'ryshackleton'
 
 import sys
 import math
+import argparse
+import numpy as np
 from pprint import pprint
 import MVE_importer
-import Point2_MVE
-from FracTrace import FracTrace
+import MVE_cache
+from CircularScanlines import compute_p21_radii, compute_polygon_p21_radii, parse_radii
+from ParallelTiles import TilePool, p21_tile, polygon_p21_tile
+from RasterIntensity import RasterIntensity, exact_p21_at, error_report
+from Profiling import PROFILER
+from IncrementalGrid import IncrementalGrid
+from ResultWriters import GridResultWriter, FORMATS
+from PlaneProjection import MAP_VIEW, parse_plane, map_view_warning
 
-def main(fractureTraceFileName,gridFileName,fractureIntersectionsPerAreaRadius,outputFileName):
+METHODS = ('analytic', 'polygon', 'fft')
+# number of grid points per chunk checked against the exact p21 when using the approximate 'fft' method
+FFT_ERROR_SAMPLES = 16
+
+def main(fractureTraceFileName,gridFileName,fractureIntersectionsPerAreaRadius,outputFileName,method='polygon',
+         useCache=True,workers=1,cellSize=None,profile=None,incremental=False,format=None,traces=None,grid=None,
+         coordinatePlane=MAP_VIEW):
     '''
     Computes fracture length/area (p21) for any number of circular scanlines
-        -fractures are specified as 1D traces on a planar 2D surface (currently limited to map view)
+        -fractures are specified as 1D traces on a planar 2D surface (map view, or the plane given by coordinatePlane)
         -circular scanlines are usually specified as a grid of points with a specified radius, but can be any points
     :param fractureTraceFileName: filename of a Midland Valley-Move software export
                                     representing lines representing fracture traces
     :param gridFileName: file containing a Midland Valley-Move software export of points representing the grid
                             over which to compute the intersections per area
-    :param fractureIntersectionsPerAreaRadius: radius of a circle to search within
+    :param fractureIntersectionsPerAreaRadius: radius of a circle to search within, or several radii as a list or a
+                                                comma separated string like '0.5,1,2,5', all computed in one pass
     :param outputFileName: name of the output file to write the grid points with fracture length/area within the
-                            specified radius
+                            specified radius, one column per radius
+    :param method: 'polygon' (the default) intersects the traces with a 20 sided polygon approximating each circle,
+                    'analytic' clips the traces exactly against each circle,
+                    'fft' approximates p21 from rasterized traces convolved with a disk (see RasterIntensity) and
+                    prints its error against the exact p21 at a sample of the grid points
+    :param useCache: reuse the parsed traces and grid from the on-disk parse cache (see MVE_cache)
+    :param workers: number of worker processes computing tiles of the grid in parallel (not the 'fft' method),
+                    the results are identical to a single process run
+    :param cellSize: raster cell size of the 'fft' method, defaults to RasterIntensity's choice
+    :param profile: name of a file to write a JSON report of the time spent in each phase and the geometry primitive
+                    counts to ('-' prints it), None does not profile (see Profiling)
+    :param incremental: reuse the results stored by the previous incremental run writing the same output file and
+                        only recompute the grid points within the largest radius of traces added, removed or changed
+                        since then (see IncrementalGrid), not supported by the 'fft' method
+    :param format: output format, one of ResultWriters.FORMATS, None chooses from the extension of outputFileName
+    :param traces: TraceSet of the traces if they are already parsed, e.g. shared by the stages of fracanalysis
+    :param grid: PointSet (or MVE_importer.PointSetFile) of the grid if it is already parsed
+    :param coordinatePlane: normal of the plane to analyse the traces in, or PlaneProjection.FIT_PLANE,
+                            the grid is projected onto the same plane as the traces
     :return: nothing
     '''
 
     # ---------------------------------
     # argument checking
     try:
-        radius = float(fractureIntersectionsPerAreaRadius)
-    except TypeError as e:
+        radii = parse_radii(fractureIntersectionsPerAreaRadius)
+    except (TypeError, ValueError) as e:
         print("Invalid fractureIntersectionsPerAreaRadius: The radius must be a floating point number")
         return
-    circleArea = math.pi * radius * radius
-    if circleArea < 0.0:
-        raise ZeroDivisionError('Circle radius must be non-zero')
+    for radius in radii:
+        if not math.pi * radius * radius > 0.0:
+            raise ZeroDivisionError('Circle radius must be non-zero')
+    if method not in METHODS:
+        raise ValueError("Unknown p21 method '{}', expected one of {}".format(method, METHODS))
+    if workers > 1 and method == 'fft':
+        raise ValueError("Parallel workers are not supported by the 'fft' p21 method")
+    if incremental and method == 'fft':
+        raise ValueError("Incremental runs are not supported by the 'fft' p21 method, its raster depends on every trace")
 
-    # ---------------------------------
-    # file import
-    traces = MVE_importer.build_FracTraces(fractureTraceFileName)
-    gridPoints = MVE_importer.build_point_list(gridFileName)
+    if profile is not None:
+        PROFILER.enable()
+    try:
+        # ---------------------------------
+        # file import, the grid is computed and written in chunks
+        with PROFILER.phase('parse'):
+            if traces is None:
+                if useCache:
+                    traces = MVE_cache.load_TraceSet(fractureTraceFileName, None, coordinatePlane)
+                else:
+                    traces = MVE_importer.build_TraceSet(fractureTraceFileName, coordinatePlane)
+                warning = map_view_warning(traces._coordinatePlane, traces._xyz)
+                if warning is not None:
+                    print(warning, file=sys.stderr)
+            if grid is None:
+                # without the cache the grid is read one chunk at a time
+                plane = traces._coordinatePlane
+                grid = MVE_cache.load_PointSet(gridFileName, None, plane) if useCache else \
+                    MVE_importer.PointSetFile(gridFileName, plane)
+        with PROFILER.phase('buildSegments'):
+            if method != 'fft' and workers <= 1:
+                traces.segment_index()
 
-    # ---------------------------------
-    # do intersection calculations and find P21
-    # sum up fracture length inside a circular scanline whose center is at each grid point and whose radius is specified
-    for pt in gridPoints:
-        circularScanline = FracTrace(0,"CircularScanline")
-        circularScanline.build_circular_trace(pt._x,pt._y,radius,20)
-        circularScanline.build_segments()
+        pool = None
+        raster = None
+        previous = None
+        samples = []
+        try:
+            if workers > 1:
+                segs, segTrace = traces.segments()
+                pool = TilePool({'segs': segs, 'segTrace': segTrace}, workers)
+            if method == 'fft':
+                with PROFILER.phase('rasterize'):
+                    raster = RasterIntensity(traces, radii, cellSize)
+            if incremental:
+                with PROFILER.phase('incremental'):
+                    settings = {'method': method, 'radii': radii, 'coordinatePlane': list(traces._coordinatePlane)}
+                    previous = IncrementalGrid(outputFileName, 'p21', settings, traces, gridFileName, max(radii))
+            resultNames = ['FractureLengthPerArea{}'.format(radius) for radius in radii]
+            with GridResultWriter(outputFileName, resultNames, format) as writer:
+                for gridPoints in PROFILER.iterate('readGrid', grid.iter_chunks()):
+                    grid_xy = gridPoints.xy()
+                    with PROFILER.phase('p21'):
+                        if previous is None:
+                            p21s = compute_grid_p21(grid_xy, traces, radii, method, pool, raster)
+                        else:
+                            p21s = previous.values(grid_xy, lambda dirty: compute_grid_p21(
+                                grid_xy[dirty], traces, radii, method, pool, raster))
+                    with PROFILER.phase('write'):
+                        writer.write(gridPoints, p21s)
+                    if raster is not None:
+                        step = max(len(gridPoints) // FFT_ERROR_SAMPLES, 1)
+                        samples.append((grid_xy[::step][:FFT_ERROR_SAMPLES], p21s[::step][:FFT_ERROR_SAMPLES]))
+                    PROFILER.count('gridPoints', len(gridPoints))
+        finally:
+            if pool is not None:
+                pool.close()
+        if previous is not None:
+            with PROFILER.phase('incremental'):
+                previous.save()
+            print(previous.summary())
 
-        pt._otherfloat = 0.0
-        for trace in traces:
-            trace.build_segments()
-            pt._otherfloat += trace.trace_length_inside_circular_scanline(circularScanline._segmentList,pt,radius)
+        if raster is not None and len(samples) > 0:
+            sample_xy = np.concatenate([xy for xy, p21s in samples])
+            for ri, radius in enumerate(radii):
+                approx = np.concatenate([p21s[:, ri] for xy, p21s in samples])
+                with PROFILER.phase('errorReport'):
+                    report = error_report(approx, exact_p21_at(sample_xy, radius, traces))
+                print("fft p21 error for radius {} at {} sampled points: max {}, mean {}, rms {} (mean p21 {})".format(
+                    radius, report['samples'], report['maxAbsError'], report['meanAbsError'], report['rmsError'],
+                    report['meanExact']))
 
-        # calculate fracture length/area (p21)
-        pt._otherfloat /= circleArea
+        if profile is not None:
+            PROFILER.write_report(profile, command='p21_within_circular_scanlines', method=method, radii=radii,
+                                  workers=workers, traces=len(traces), segments=len(traces.segments()[0]))
+    finally:
+        if profile is not None:
+            PROFILER.enable(False)
 
 
-    # ---------------------------------
-    # write the output file
-    with open(outputFileName,'w') as f:
-        f.write('x	y	z	Name	Id	PType	Colour_Num	Colour_Id	Colour_(red)	Colour_(green)	Colour_(blue)')
-        f.write('   NothingAttribute    FractureLengthPerArea{}\n'.format(radius))
-        for pt in gridPoints:
-            f.write(pt.to_string() + '\n')
+def compute_grid_p21(grid_xy, traces, radii, method='polygon', pool=None, raster=None):
+    '''
+    Computes fracture length/area (p21) for an array of grid points
+    :param grid_xy: (N,2) array of the circle centers
+    :param traces: TraceSet of fracture traces
+    :param radii: radius, or list of radii, of the circular scanlines
+    :param method: 'analytic' or 'polygon', see main()
+    :param pool: optional ParallelTiles.TilePool sharing the trace segments as 'segs' and their traces as 'segTrace'
+    :param raster: RasterIntensity of the traces for the same radii, required by the 'fft' method
+    :return: (N,R) array of the p21 of each grid point for each radius
+    '''
+    radii = parse_radii(radii)
+    # sum up fracture length inside a circular scanline whose center is at each grid point and whose radius is specified
+    grid_xy = np.asarray(grid_xy, dtype=np.float64).reshape(-1, 2)
+    if method == 'fft':
+        p21s = raster.p21_at(grid_xy)
+    elif method == 'analytic':
+        p21s = compute_p21_radii(grid_xy, radii, traces) if pool is None else pool.map(p21_tile, grid_xy, radii)
+    else:
+        # 20 sided polygons approximating the circles, clipped one chunk of grid points at a time
+        p21s = compute_polygon_p21_radii(grid_xy, radii, traces) if pool is None else \
+            pool.map(polygon_p21_tile, grid_xy, radii)
+    return np.asarray(p21s, dtype=np.float64).reshape(-1, len(radii))
 
 
 if __name__ == '__main__':
-    try:
-        main( sys.argv[1], sys.argv[2], sys.argv[3], sys.argv[4] )
-    except IndexError:
-        print("Incorrect command line arguments.")
-        print("usage: p21_within_circular_scanlines.py fractureTraceFileName gridFileName radius_in_meters outputFileName")
+    parser = argparse.ArgumentParser(description="Computes fracture length/area (p21) within circular scanlines")
+    parser.add_argument('fractureTraceFileName')
+    parser.add_argument('gridFileName')
+    parser.add_argument('radius_in_meters', help="radius, or comma separated radii like 0.5,1,2,5")
+    parser.add_argument('outputFileName')
+    parser.add_argument('--method', choices=METHODS, default='polygon',
+                        help="'polygon' uses a 20 sided polygon approximation of each circle (default), "
+                             "'analytic' clips traces exactly against each circle, "
+                             "'fft' is a fast approximation from rasterized traces")
+    parser.add_argument('--no-cache', dest='useCache', action='store_false',
+                        help="always re-parse the input files instead of using the on-disk parse cache")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="number of worker processes computing tiles of the grid in parallel (default 1)")
+    parser.add_argument('--cell-size', dest='cellSize', type=float, default=None,
+                        help="raster cell size of the 'fft' method (default: smallest radius / 10)")
+    parser.add_argument('--plane', type=parse_plane, default=MAP_VIEW,
+                        help="coordinate plane to analyse the traces in: 'map' (default), 'fit' for the plane fit "
+                             "through all trace vertices (e.g. a cliff face), or its normal like 0,-1,0")
+    parser.add_argument('--profile', nargs='?', const='-', default=None, metavar='REPORT_FILE',
+                        help="record the time of each phase and the geometry primitive counts, and write them as "
+                             "JSON to REPORT_FILE (default: print them)")
+    parser.add_argument('--incremental', action='store_true',
+                        help="store the results, and on the next run with this option only recompute the grid points "
+                             "near traces added, removed or changed since then")
+    parser.add_argument('--format', choices=FORMATS, default=None,
+                        help="output format: 'tsv' (MVE export with one column per radius), 'npy', 'npz' or 'raster' "
+                             "(regular grids only, an .npz of one 2d array per radius), "
+                             "default: from the output file extension")
+    args = parser.parse_args()
+    if args.workers > 1 and args.method == 'fft':
+        parser.error("--workers is not supported by --method fft")
+    main(args.fractureTraceFileName, args.gridFileName, args.radius_in_meters, args.outputFileName, args.method,
+         args.useCache, args.workers, args.cellSize, args.profile, args.incremental, args.format, None, None, args.plane)